@@ -0,0 +1,377 @@
+"""
+Benchmark harness for the tile puzzle solvers.
+
+Runs every engine in ENGINES over the puzzles in the corpus (by default
+benchmark/corpus.jsonl, in the tilecsp.batch spec format with an additional
+"expect" field of "sat" or "unsat"), measuring wall time, CPU time, decisions,
+prunings and peak memory. Results are written as JSON and compared against a
+stored baseline; the run fails (exit status 1) if any engine returns a wrong
+answer, stops finishing a puzzle, or if its decisions or prunings (which are
+deterministic) regress beyond the given tolerance. The solutions of the
+smaller puzzles are also counted on each board model (see
+tilecsp.batch.MODELS), and the run fails unless the models agree.
+
+Searches are abandoned after --max-decisions variable assignments (status
+"limit"), so puzzles that are out of reach for an engine are still measured.
+Timings are machine specific, so the committed baseline holds no timings:
+--update-baseline also records the timings in a local file (by default
+benchmark/timings.json, not committed), and --check-times compares the
+timings (and peak memory) against it too.
+
+To run:
+    python3 -m benchmark.harness
+    python3 -m benchmark.harness --engines FC --filter 4x4 -o results.json
+    python3 -m benchmark.harness --update-baseline   # record local timings
+    python3 -m benchmark.harness --check-times
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from tilecsp.tileboard import TileBoard, create_tiles
+from tilecsp.edgeboard import EdgeTileBoard, prop_pigeonhole
+from tilecsp.slotboard import SlotTileBoard
+from tilecsp.patterns import prop_block
+from tilecsp.connectivity import prop_connectivity, prop_reachability
+from tilecsp.satboard import SatSearch
+from tilecsp.lns import LNSSearch
+from tilecsp.batch import MODELS, count_spec, puzzle_from_spec
+from search.btsearch import BacktrackingSearch
+from csp.propagators import prop_BT, prop_fc, prop_gac, chain_propagators
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, 'corpus.jsonl')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_TIMINGS = os.path.join(BENCHMARK_DIR, 'timings.json')
+
+# Measurements compared against the baseline, with the absolute slack allowed
+# on top of the relative tolerance (to absorb noise in small measurements):
+# the search counts, which are the same on every machine...
+COUNTS = {'decisions': 10,
+          'prunings': 50}
+# ... and the timings, which are only comparable on the machine which
+# recorded them (see --check-times)
+TIMINGS = {'wall_time': 0.005,
+           'cpu_time': 0.005,
+           'peak_memory': 64 * 1024}
+
+Engine = collections.namedtuple('Engine', 'run max_cells')
+Engine.__doc__ = """
+A solver under benchmark.
+
+    run:        function(puzzle spec, max decisions) ==>
+                    (True/False/None, dict of statistics)
+                returns True if solved, False if unsolvable and None if the
+                search was abandoned
+    max_cells:  largest board (in cells) the engine is run on
+"""
+
+
+def backtracking_engine(propagator, model=TileBoard):
+    """
+    Engine running BacktrackingSearch with the given propagator on boards of
+    the given model (TileBoard or a subclass)
+    """
+    def run(spec, max_decisions):
+        num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+        board = model(spec['id'], create_tiles(num_tiles),
+                      terminal_nodes, dim)
+        solver = BacktrackingSearch(board, logging.WARNING, verbose=False)
+        status = solver.bt_search(propagator, max_decisions)
+        return status, solver.get_stats()
+    return run
+
+
+def sat_engine(spec, max_decisions):
+    """ Engine running the CDCL SAT solver (see tilecsp.satboard) """
+    num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+    board = TileBoard(spec['id'], create_tiles(num_tiles), terminal_nodes, dim)
+    solver = SatSearch(board)
+    status = solver.solve(max_decisions=max_decisions)
+    return status, solver.get_stats()
+
+
+def lns_engine(spec, max_decisions):
+    """
+    Engine running large-neighbourhood search (see tilecsp.lns), with a
+    fixed seed so that runs are repeatable
+    """
+    num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+    board = TileBoard(spec['id'], create_tiles(num_tiles), terminal_nodes, dim)
+    solver = LNSSearch(board, prop_fc, seed=0)
+    status = solver.solve(max_decisions=max_decisions)
+    return status, solver.get_stats()
+
+
+ENGINES = collections.OrderedDict((
+    ('BT', Engine(backtracking_engine(prop_BT), 36)),
+    ('FC', Engine(backtracking_engine(prop_fc), 36)),
+    # GAC over the all-diff constraint is intractable beyond 2x2
+    ('GAC', Engine(backtracking_engine(prop_gac), 4)),
+    ('FC-block', Engine(backtracking_engine(
+        chain_propagators(prop_fc, prop_block)), 36)),
+    # Only layouts without stray loops (see tilecsp.connectivity)
+    ('FC-conn', Engine(backtracking_engine(
+        chain_propagators(prop_fc, prop_connectivity)), 36)),
+    ('FC-reach', Engine(backtracking_engine(
+        chain_propagators(prop_fc, prop_reachability)), 36)),
+    ('FC-edge', Engine(backtracking_engine(
+        chain_propagators(prop_fc, prop_pigeonhole), EdgeTileBoard), 36)),
+    ('FC-slot', Engine(backtracking_engine(
+        chain_propagators(prop_fc, prop_pigeonhole), SlotTileBoard), 36)),
+    ('SAT', Engine(sat_engine, 36)),
+    # Incomplete: only finds solutions, for boards beyond complete search
+    ('LNS', Engine(lns_engine, 196)),
+))
+
+STATUS_NAMES = {True: 'sat', False: 'unsat', None: 'limit'}
+
+# Largest board (in cells) whose solutions are counted on every model
+COUNT_MAX_CELLS = 16
+
+
+def load_corpus(path):
+    """
+    :return: Puzzle specs in the corpus
+    :rtype: list[dict]
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def measure(engine, spec, max_decisions, repeat):
+    """
+    Run engine on spec repeat times (keeping the fastest run), plus once
+    more under tracemalloc to measure peak memory.
+
+    :type engine: Engine
+    :type spec: dict
+    :type max_decisions: int
+    :type repeat: int
+    :rtype: dict
+    """
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        status, stats = engine.run(spec, max_decisions)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best is None or wall < best['wall_time']:
+            best = {'status': STATUS_NAMES[status],
+                    'wall_time': wall,
+                    'cpu_time': cpu,
+                    'decisions': stats['decisions'],
+                    'prunings': stats['prunings']}
+
+    tracemalloc.start()
+    try:
+        engine.run(spec, max_decisions)
+        best['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best
+
+
+def run_benchmarks(corpus, engines, max_decisions=20000, repeat=3,
+                   log=sys.stderr):
+    """
+    :param corpus: Puzzle specs
+    :type corpus: list[dict]
+    :param engines: Names of the engines to run (see ENGINES)
+    :type engines: list[str]
+    :return: One result record per (puzzle, engine)
+    :rtype: list[dict]
+    """
+    results = []
+    for spec in corpus:
+        dim = spec.get('dim', 3)
+        for name in engines:
+            engine = ENGINES[name]
+            if dim * dim > engine.max_cells:
+                continue
+            result = {'puzzle': spec['id'], 'engine': name,
+                      'expect': spec.get('expect')}
+            result.update(measure(engine, spec, max_decisions, repeat))
+            results.append(result)
+            if log:
+                print("{puzzle:20} {engine:5} {status:6} "
+                      "{wall_time:9.4f}s {decisions:8} decisions".format(
+                          **result), file=log)
+    return results
+
+
+def check_counts(corpus, max_decisions=20000, log=sys.stderr):
+    """
+    Count the solutions of each puzzle of at most COUNT_MAX_CELLS cells on
+    every board model (models whose count is abandoned after max_decisions
+    are left out).
+
+    :param corpus: Puzzle specs
+    :type corpus: list[dict]
+    :return: Descriptions of the puzzles whose counts differ by model
+    :rtype: list[str]
+    """
+    failures = []
+    for spec in corpus:
+        dim = spec.get('dim', 3)
+        if dim * dim > COUNT_MAX_CELLS:
+            continue
+        counts = {}
+        for model in MODELS:
+            result = count_spec(dict(spec, model=model,
+                                     max_decisions=max_decisions))
+            if result['status'] == 'error':
+                counts[model] = result['error']
+            elif result['count'] is not None:
+                counts[model] = result['count']
+        if log:
+            print("{:20} count {}".format(spec['id'], " ".join(
+                "{}={}".format(m, c) for m, c in counts.items())), file=log)
+        if len(set(map(str, counts.values()))) > 1:
+            failures.append("{}: counts differ by model ({})".format(
+                spec['id'], ", ".join("{} {}".format(m, c)
+                                      for m, c in counts.items())))
+    return failures
+
+
+def compare(results, baseline, tolerance, metrics=COUNTS):
+    """
+    Compare results against baseline results.
+
+    :param tolerance: Relative increase allowed in each measurement
+    :type tolerance: float
+    :param metrics: Measurements to compare, with their absolute slack (see
+        COUNTS and TIMINGS); those missing from a baseline record are
+        skipped
+    :type metrics: dict[str, float]
+    :return: Descriptions of all failures (wrong answers and regressions)
+    :rtype: list[str]
+    """
+    failures = []
+    base = {(r['puzzle'], r['engine']): r for r in baseline}
+    for r in results:
+        key = "{} [{}]".format(r['puzzle'], r['engine'])
+        if r['expect'] and r['status'] not in (r['expect'], 'limit'):
+            failures.append("{}: wrong answer {} (expected {})".format(
+                key, r['status'], r['expect']))
+        b = base.get((r['puzzle'], r['engine']))
+        if b is None:
+            continue
+        if b['status'] != 'limit' and r['status'] == 'limit':
+            failures.append("{}: no longer finishes (was {})".format(
+                key, b['status']))
+            continue
+        if b['status'] == 'limit' and r['status'] != 'limit':
+            # Newly in reach: nothing comparable
+            continue
+        for metric, slack in metrics.items():
+            if metric not in b:
+                continue
+            limit = b[metric] * (1 + tolerance) + slack
+            if r[metric] > limit:
+                failures.append("{}: {} regressed from {} to {}".format(
+                    key, metric, b[metric], r[metric]))
+    return failures
+
+
+def load_results(path):
+    """
+    :return: Result records stored at path (none if there is no such file)
+    :rtype: list[dict]
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def store_results(path, meta, results, metrics):
+    """
+    Store the given measurements of results at path, keeping the stored
+    records of the (puzzle, engine) pairs which weren't rerun
+
+    :type metrics: dict[str, float]
+    """
+    fields = ('puzzle', 'engine', 'expect', 'status') + tuple(metrics)
+    rerun = {(r['puzzle'], r['engine']) for r in results}
+    stored = [r for r in load_results(path)
+              if (r['puzzle'], r['engine']) not in rerun]
+    with open(path, 'w') as f:
+        json.dump({'meta': meta,
+                   'results': stored + [{field: r[field] for field in fields}
+                                        for r in results]}, f, indent=1)
+    print("Baseline updated: {}".format(path), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tile solvers")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--timings', default=DEFAULT_TIMINGS,
+                        help="Local baseline of timings (see --check-times)")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Write results as JSON to this file")
+    parser.add_argument('-e', '--engines', default=",".join(ENGINES),
+                        help="Comma separated engine names")
+    parser.add_argument('-f', '--filter', default=None,
+                        help="Only run puzzles whose id contains this string")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--max-decisions', type=int, default=20000)
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help="Relative regression tolerance (default: 0.25)")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Store these results as the new baseline (and "
+                             "their timings as the new local timings)")
+    parser.add_argument('--check-times', action='store_true',
+                        help="Also fail on regressions of the timings and "
+                             "peak memory against the local timings")
+    args = parser.parse_args(argv)
+
+    engines = args.engines.split(",")
+    for name in engines:
+        if name not in ENGINES:
+            parser.error("Unknown engine {} (choose from {})".format(
+                name, ", ".join(ENGINES)))
+    corpus = [spec for spec in load_corpus(args.corpus)
+              if args.filter is None or args.filter in spec['id']]
+
+    results = run_benchmarks(corpus, engines, args.max_decisions,
+                             args.repeat)
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'max_decisions': args.max_decisions,
+                       'repeat': args.repeat},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.update_baseline:
+        store_results(args.baseline, report['meta'], results, COUNTS)
+        store_results(args.timings, report['meta'], results, TIMINGS)
+
+    baseline = load_results(args.baseline)
+    metrics = COUNTS
+    if args.check_times:
+        timings = {(r['puzzle'], r['engine']): r
+                   for r in load_results(args.timings)}
+        baseline = [dict(timings.get((r['puzzle'], r['engine']), {}), **r)
+                    for r in baseline]
+        metrics = dict(COUNTS, **TIMINGS)
+    failures = compare(results, baseline, args.tolerance, metrics)
+    failures += check_counts(corpus, args.max_decisions)
+    for failure in failures:
+        print("FAIL " + failure, file=sys.stderr)
+    print("{} measurements, {} failures".format(len(results), len(failures)),
+          file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
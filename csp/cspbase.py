@@ -9,9 +9,10 @@ Constraint Satisfaction Routines
       added but NOT deleted from.
       
       To support constraint propagation, the class also maintains a
-      set of flags to indicate if a value is still in its current domain.
+      bit mask to indicate if a value is still in its current domain.
       So one can remove values, add them back, and query if they are 
-      still current. 
+      still current. The values themselves are kept in a ValueTable,
+      which variables with the same values share.
 
     B) class constraint
 
@@ -38,18 +39,77 @@ import itertools
 import sys
 
 
+class ValueTable:
+    """
+    Ordered values, each with its own bit, so that a set of them can be held
+    as an int bit mask. Variables whose domains are drawn from the same values
+    (e.g. the cells of a board) share one table rather than each holding its
+    own containers. Tables are never changed once built.
+
+    Attributes:
+
+        values: tuple of the values, in order (value i has bit 1 << i)
+        bits:   dict of each value to its bit
+    """
+    __slots__ = ('values', 'bits')
+
+    def __init__(self, values=()):
+        self.values = tuple(dict.fromkeys(values))
+        self.bits = {val: 1 << i for i, val in enumerate(self.values)}
+
+    def mask(self, values):
+        """
+        :param values: Values of the table (others are ignored)
+        :return: Bit mask of the given values
+        :rtype: int
+        """
+        bits = self.bits
+        mask = 0
+        for val in values:
+            mask |= bits.get(val, 0)
+        return mask
+
+    def values_in(self, mask):
+        """
+        :param mask: Bit mask of values of the table
+        :type mask: int
+        :return: The values in mask, in order
+        :rtype: list
+        """
+        # Reversed binary digits as bytes of 0 and 1, to select values in C
+        flags = format(mask, 'b')[::-1].encode().translate(_BIT_FLAGS)
+        return list(itertools.compress(self.values, flags))
+
+    def extended(self, values):
+        """
+        :return: A new table with the values of this one (same bits) followed
+            by any new values
+        :rtype: ValueTable
+        """
+        return ValueTable(self.values + tuple(values))
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Translation of binary digits to selector bytes (see ValueTable.values_in)
+_BIT_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+
+
 class Variable:
     """
     Class for defining CSP variables.  On initialization the
     variable object should be given a name, and optionally a list of
     domain values. Later on more domain values an be added...but
-    domain values can never be removed.
+    domain values can only be removed outside of search (by presolving,
+    see remove_domain_values).
 
     The variable object offers two types of functionality to support
     search.
 
-    (a) It has a current domain, implemented as a set of flags
-       determining which domain values are "current", i.e., un-pruned.
+    (a) It has a current domain, implemented as a bit mask over a
+       ValueTable determining which domain values are "current", i.e.,
+       un-pruned.
        - you can prune a value, and restore it.
        - you can obtain a list of values in the current domain, or count
          how many are still there
@@ -75,11 +135,14 @@ class Variable:
        flags are not changed so that pruning and un-pruning can
        work independently of assignment and un-assignment.
     """
+    __slots__ = ('name', 'table', 'domain_mask', 'cur_mask', 'assignedValue',
+                 'cur_domain_flag', 'cur_domain_cache', 'constraints',
+                 'checks')
 
     #
     # set up and info methods
     #
-    def __init__(self, name, domain=set()):
+    def __init__(self, name, domain=(), table=None):
         """
         Create a variable object, specifying its name (a string).
         Optionally specify the initial domain.
@@ -87,15 +150,28 @@ class Variable:
         :param name: Variable name
         :type name: str
         :param domain: Optional domain of CSP
-        :type domain: set
+        :type domain: Iterable
+        :param table: (Optional) Shared table holding (at least) the domain's
+            values; by default the variable builds its own
+        :type table: ValueTable
         :return: None
         """
         self.name = name  # text name for variable
-        self.domain = set(domain)  # Make a copy of passed domain
-        self.cur_domain = {val: True for val in self.domain}  # using list
+        domain = tuple(domain)  # Iterated twice below
+        # Current domain keeps the order of the table (by default, of the
+        # passed domain)
+        self.table = table if table is not None else ValueTable(domain)
+        self.domain_mask = self.table.mask(domain)
+        self.cur_mask = self.domain_mask
         self.assignedValue = None
         self.cur_domain_flag = True
-        self.cur_domain_cache = self.get_cur_domain()
+        self.cur_domain_cache = None
+        # Constraints whose unassigned counters track this variable (set when
+        # its CSP is frozen, see CSP.freeze)
+        self.constraints = ()
+        # Stateful incremental checks to notify of assignments (set when its
+        # CSP is frozen, see IncrementalCheck)
+        self.checks = ()
 
     def add_domain_values(self, values):
         """
@@ -104,9 +180,27 @@ class Variable:
 
         :type values: list
         """
-        for val in values:
-            self.domain.add(val)
-            self.cur_domain[val] = True
+        values = list(values)
+        new_values = [val for val in values if val not in self.table.bits]
+        if new_values:
+            # Shared tables are never changed: this variable gets its own
+            self.table = self.table.extended(new_values)
+        mask = self.table.mask(values)
+        self.domain_mask |= mask
+        self.cur_mask |= mask
+        self.cur_domain_flag = True
+
+    def remove_domain_values(self, values):
+        """
+        Remove values from the (permanent) domain, e.g. values which a
+        presolve has proven cannot be part of any solution. Must not be
+        called during search: removed values are never restored.
+
+        :type values: Iterable
+        """
+        mask = self.table.mask(values)
+        self.domain_mask &= ~mask
+        self.cur_mask &= ~mask
         self.cur_domain_flag = True
 
     def domain_size(self):
@@ -114,14 +208,14 @@ class Variable:
         :return: The size of the (permanent) domain
         :rtype: int
         """
-        return len(self.domain)
+        return bin(self.domain_mask).count("1")
 
     def domain(self):
         """
-        :return: the variable's (permanent) domain
-        :rtype: set
+        :return: the variable's (permanent) domain, in order
+        :rtype: list
         """
-        return set(self.domain)
+        return self.table.values_in(self.domain_mask)
 
     #
     # methods for current domain (pruning and unpruning)
@@ -130,26 +224,25 @@ class Variable:
         """Remove value from CURRENT domain"""
         if self.is_assigned() and self.get_assigned_value() is value:
             self.unassign()
-        self.cur_domain[value] = False
+        self.cur_mask &= ~self.table.bits[value]
         self.cur_domain_flag = True
 
     def unprune_value(self, value):
         """Restore value to CURRENT domain"""
-        self.cur_domain[value] = True
+        self.cur_mask |= self.table.bits[value]
         self.cur_domain_flag = True
 
     def get_cur_domain(self):
         """
         :return: List of values in CURRENT domain (if assigned,
             only assigned value is viewed as being in current domain)
-        :rtype: set
+        :rtype: list
         """
         if self.is_assigned():
             return [self.get_assigned_value()]
         if not self.cur_domain_flag:
             return self.cur_domain_cache
-        self.cur_domain_cache = \
-            list(filter(self.cur_domain.get, self.cur_domain.keys()))
+        self.cur_domain_cache = self.table.values_in(self.cur_mask)
         self.cur_domain_flag = False
         return self.cur_domain_cache
 
@@ -162,8 +255,8 @@ class Variable:
         :return: True iff value is in current domain
         :rtype: bool
         """
-        return self.cur_domain[value] if not self.is_assigned() else \
-            value == self.get_assigned_value()
+        return bool(self.cur_mask & self.table.bits.get(value, 0)) if not \
+            self.is_assigned() else value == self.get_assigned_value()
 
     def get_cur_domain_size(self):
         """
@@ -178,8 +271,7 @@ class Variable:
         """
         return all values back into CURRENT domain
         """
-        for val in self.domain:
-            self.cur_domain[val] = True
+        self.cur_mask = self.domain_mask
         self.cur_domain_flag = True
 
     #
@@ -202,6 +294,10 @@ class Variable:
             return
         self.assignedValue = value
         self.cur_domain_flag = True
+        for c in self.constraints:
+            c.num_unassigned -= 1
+        for check in self.checks:
+            check.assigned(self, value)
 
     def unassign(self):
         """
@@ -212,8 +308,13 @@ class Variable:
             print(msg.format(self), file=sys.stderr)
             return
 
+        value = self.assignedValue
         self.assignedValue = None
         self.cur_domain_flag = True
+        for c in self.constraints:
+            c.num_unassigned += 1
+        for check in self.checks:
+            check.unassigned(self, value)
 
     def get_assigned_value(self):
         """return assigned value...returns None if is unassigned"""
@@ -223,14 +324,46 @@ class Variable:
     # internal methods
     #
     def __repr__(self):
-        return "Var--\"{}\": Dom = {}, CurDom = {}".format(self.name,
-                                                           self.domain,
-                                                           self.cur_domain)
+        return "Var--\"{}\": Dom = {}, CurDom = {}".format(
+            self.name, self.domain(), self.table.values_in(self.cur_mask))
 
     def __str__(self):
         return "Var--{}".format(self.name)
 
 
+class IncrementalCheck:
+    """
+    Fast check of a constraint as the last unassigned variable of its scope
+    is assigned (see Constraint.check_last), which prop_BT and prop_fc use
+    instead of building the map of the whole scope's assignment. A stateful
+    check keeps state about the scope's assignment (e.g. the values already
+    used, for an all-diff constraint) which the variables update as they
+    are assigned and unassigned, once the CSP is frozen (see CSP.freeze);
+    the check itself then costs no more than the state it looks at.
+    """
+    __slots__ = ()
+    # True iff the variables of the scope must report their assignments
+    stateful = False
+
+    def reset(self):
+        """ Forget the assignments reported so far """
+
+    def assigned(self, var, value):
+        """ var, in the scope, has been assigned value """
+
+    def unassigned(self, var, value):
+        """ var, in the scope, has been unassigned (from value) """
+
+    def check(self, var):
+        """
+        :param var: The variable of the scope which was assigned last
+        :return: True iff the assignment of the scope satisfies the
+            constraint
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+
 class Constraint:
     """
     Class for defining constraints variable objects specifies an
@@ -238,8 +371,10 @@ class Constraint:
     the satisfied function which tests if an assignment to the
     variables in the constraint's scope satisfies the constraint
     """
+    __slots__ = ('scope_vars', 'name', 'kind', 'constraint_function',
+                 'sat_mappings', 'num_unassigned', 'incremental')
 
-    def __init__(self, name, scope, function):
+    def __init__(self, name, scope, function, kind=None, incremental=None):
         """
         Create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable objects).
@@ -252,19 +387,42 @@ class Constraint:
         :type name: str
         :param scope: An ORDERED list of variable objects
         :type scope: iterable[Variable]
+        :param kind: (Optional) Category of the constraint (e.g. "all-diff"),
+            used to aggregate statistics
+        :type kind: str
+        :param incremental: (Optional) Fast check of the constraint, used
+            by check_last
+        :type incremental: IncrementalCheck
         :return: None
         """
-        self.scope = set(scope)
+        # Read-only view of the scope (in the order given)
+        self.scope_vars = tuple(dict.fromkeys(scope))
         self.name = name
+        self.kind = kind
         self.constraint_function = function
-        self.sat_mappings = set()
+        # Satisfying assignments found by has_support (None until needed)
+        self.sat_mappings = None
+        # Number of unassigned variables in scope, maintained by the variables
+        # once the CSP is frozen (None until then, see CSP.freeze)
+        self.num_unassigned = None
+        self.incremental = incremental
+
+    @property
+    def scope(self):
+        """
+        :return: The set of variables that the constraint is over (built on
+            each call, prefer scope_vars)
+        :rtype: frozenset[Variable]
+        """
+        return frozenset(self.scope_vars)
 
     def get_scope(self):
         """
-        :return: all variables that the constraint is over
-        :rtype: set[Variable]
+        :return: all variables that the constraint is over (a read-only
+            view, not a copy)
+        :rtype: tuple[Variable]
         """
-        return set(self.scope)
+        return self.scope_vars
 
     def check(self):
         """
@@ -274,21 +432,47 @@ class Constraint:
         :rtype: bool
         """
         return self.constraint_function(
-            {var: var.get_assigned_value() for var in self.scope})
+            {var: var.get_assigned_value() for var in self.scope_vars})
+
+    def check_last(self, var):
+        """
+        Check the constraint just after var, the last unassigned variable of
+        its scope, was assigned: with its IncrementalCheck once the CSP is
+        frozen (if it has one), otherwise as check
+
+        :rtype: bool
+        """
+        if self.incremental is not None and self.num_unassigned is not None:
+            return self.incremental.check(var)
+        return self.check()
 
     def get_num_unassigned(self):
         """
         return the number of unassigned variables in the constraint's scope
+        (O(1) once the CSP is frozen)
         """
-        return sum(map(lambda v: not v.is_assigned(), self.scope))
+        if self.num_unassigned is not None:
+            return self.num_unassigned
+        return sum(map(lambda v: not v.is_assigned(), self.scope_vars))
 
     def get_unassigned_vars(self):
         """
         :return: All unassigned variables in constraint's scope. Note that it is
-           more expensive to get the list than to then number
-        :rtype: set[Variable]
+           more expensive to get the variables than to get their number
+        :rtype: tuple[Variable]
+        """
+        return tuple(v for v in self.scope_vars if not v.is_assigned())
+
+    def get_unassigned_var(self):
+        """
+        :return: The first unassigned variable in the constraint's scope (None
+            if all are assigned), without building a collection
+        :rtype: Variable
         """
-        return set(filter(lambda v: not v.is_assigned(), self.scope))
+        for v in self.scope_vars:
+            if not v.is_assigned():
+                return v
+        return None
 
     def has_support(self, var, val):
         """
@@ -298,16 +482,18 @@ class Constraint:
 
         :rtype: bool
         """
-        print("Var: {}\t\tVal: {}".format(var, val))
-        if var not in self.scope:
+        if var not in self.scope_vars:
             return True
 
-        if len(self.scope) == 1:
+        if len(self.scope_vars) == 1:
             return self.constraint_function({var: val})
 
+        if self.sat_mappings is None:
+            self.sat_mappings = set()
+
         # Sequence of 2-tuples with variables and respective current domains
         var_to_cur_domain = ((variable, variable.get_cur_domain()) for
-                             variable in self.scope)
+                             variable in self.scope_vars)
 
         variables, cur_domains = zip(*var_to_cur_domain)
 
@@ -323,14 +509,22 @@ class Constraint:
         ))
 
     def __str__(self):
-        return "{}({})".format(self.name, [var.name for var in self.scope])
+        return "{}({})".format(self.name,
+                               [var.name for var in self.scope_vars])
 
 
 class CSP:
     """Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
        The variables of the CSP can be added later or on initialization.
-       The constraints must be added later"""
+       The constraints must be added later.
+
+       Once the model is complete, freeze() fixes it (search does this
+       itself): the accessors then return read-only tuples instead of
+       copies, and each constraint keeps a count of its unassigned
+       variables (and the state of its IncrementalCheck, if any),
+       maintained on assign/unassign. A variable must belong to only one
+       frozen CSP."""
 
     def __init__(self, name, variables=set()):
         """
@@ -345,21 +539,32 @@ class CSP:
         """
 
         self.name = name
-        self.vars = set()
-        self.cons = set()
+        self.vars = list()
+        self.cons = list()
         self.vars_to_cons = dict()
+        # Set (to a description) when the CSP is known to have no solution
+        self.infeasible_reason = None
+        # Read-only views, set by freeze
+        self.frozen = False
+        self._vars_view = None
+        self._cons_view = None
+        self._cons_by_var = None
         for v in variables:
             self.add_var(v)
 
     def add_var(self, v):
         """Add variable object to CSP while setting up an index
            to obtain the constraints over this variable"""
+        if self.frozen:
+            raise RuntimeError(
+                "Trying to add variable {} to frozen CSP {}".format(
+                    v, self.name))
         if v in self.vars_to_cons:
             print("Trying to add variable", v,
                   "to CSP object that already has it", file=sys.stderr)
             return
-        self.vars.add(v)
-        self.vars_to_cons[v] = set()
+        self.vars.append(v)
+        self.vars_to_cons[v] = list()
 
     def add_constraint(self, c):
         """Add constraint to CSP. Note that all variables in the
@@ -367,40 +572,78 @@ class CSP:
         if not type(c) is Constraint:
             raise TypeError(
                 "Trying to add non constraint {} to CSP object".format(c))
-        if any((v not in self.vars_to_cons for v in c.scope)):
+        if self.frozen:
+            raise RuntimeError(
+                "Trying to add constraint {} to frozen CSP {}".format(
+                    c, self.name))
+        if any((v not in self.vars_to_cons for v in c.scope_vars)):
             print("Trying to add constraint", c,
                   "with unknown variables to CSP object", file=sys.stderr)
             return
 
-        for v in c.scope:
-            self.vars_to_cons[v].add(c)
-        self.cons.add(c)
+        for v in c.scope_vars:
+            self.vars_to_cons[v].append(c)
+        self.cons.append(c)
+
+    def freeze(self):
+        """
+        Fix the variables and constraints of the CSP (see class description).
+        Does nothing if the CSP is already frozen.
+        """
+        if self.frozen:
+            return
+        self._vars_view = tuple(self.vars)
+        self._cons_view = tuple(self.cons)
+        self._cons_by_var = {v: tuple(cons)
+                             for v, cons in self.vars_to_cons.items()}
+        checks = {}
+        for c in self.cons:
+            c.num_unassigned = sum(not v.is_assigned() for v in c.scope_vars)
+            if c.incremental is not None and c.incremental.stateful:
+                c.incremental.reset()
+                for v in c.scope_vars:
+                    checks.setdefault(v, []).append(c.incremental)
+                    if v.is_assigned():
+                        c.incremental.assigned(v, v.get_assigned_value())
+        for v in self.vars:
+            v.constraints = self._cons_by_var[v]
+            v.checks = tuple(checks.get(v, ()))
+        self.frozen = True
 
     def get_all_cons(self):
         """
-        return list of all constraints in the CSP
+        return all constraints in the CSP (a read-only view once frozen)
 
-        :rtype: set[Constraint]
+        :rtype: tuple[Constraint]
         """
-        return set(self.cons)
+        return self._cons_view if self.frozen else tuple(self.cons)
 
     def get_cons_with_var(self, var):
         """
-        return list of constraints that include var in their scope
+        return constraints that include var in their scope (a read-only view
+        once frozen)
 
-        :rtype: set[Constraint]
+        :rtype: tuple[Constraint]
         """
-        return set(self.vars_to_cons[var])
+        return self._cons_by_var[var] if self.frozen else \
+            tuple(self.vars_to_cons[var])
+
+    def is_feasible(self):
+        """
+        :return: False iff the CSP is already known to have no solution (see
+            infeasible_reason)
+        :rtype: bool
+        """
+        return self.infeasible_reason is None
 
     def get_all_vars(self):
         """
         Get all the variables in the CSP
 
-        :return: List of variables in the CSP
-        :rtype: list[Variable]
+        :return: Variables in the CSP (a read-only view once frozen)
+        :rtype: tuple[Variable]
         """
-
-        return list(self.vars)
+        return self._vars_view if self.frozen else tuple(self.vars)
 
     def __str__(self):
         return "CSP {}\n".format(self.name) + \
@@ -62,6 +62,7 @@ propagator == a function with the following template
             V.
 """
 
+import functools
 # Used for type contracts in reStructuredText docstrings
 from collections.abc import Iterable, Sequence
 
@@ -91,7 +92,7 @@ def prop_BT(csp, new_var=None):
             # vals = []
             # for var in c.get_scope():
             #     vals.append(var.get_assigned_value())
-            if not c.check():
+            if not c.check_last(new_var):
                 return False, []
 
     return True, []
@@ -142,25 +143,19 @@ def prop_fc(csp, new_var=None):
     constraints = \
         csp.get_cons_with_var(new_var) if new_var else csp.get_all_cons()
 
-    # Filter accepts constraints with 1 un-instantiated variable
+    # Keep constraints with 1 un-instantiated variable (paired with it)
     # Sort constraints in increasing order of the current domain size of the
     # un-instantiated variable
-    filtered_constraints = \
-        sorted(
-            filter(
-                lambda c: c.get_num_unassigned() == 1,
-                constraints),
-            key=lambda c: list(c.get_unassigned_vars())[0].get_cur_domain_size()
-        )
-    """ :type: filter[Constraint] """
-
-    for constraint in filtered_constraints:
-        var = constraint.get_unassigned_vars().pop()
-        ''' :type: Variable '''
+    filtered_constraints = [(constraint, constraint.get_unassigned_var())
+                            for constraint in constraints
+                            if constraint.get_num_unassigned() == 1]
+    filtered_constraints.sort(key=lambda pair: pair[1].get_cur_domain_size())
+
+    for constraint, var in filtered_constraints:
         for value in var.get_cur_domain():
             var.assign(value)
             # Begin FCCheck
-            if not constraint.check():
+            if not constraint.check_last(var):
             # if not constraint.check(map(
             #         lambda v: v.get_assigned_value(),
             #         constraint.get_scope())):
@@ -341,5 +336,29 @@ def prop_gac(csp, new_var=None):
     return True, pruned
 
 
+def _run_chained(propagators, csp, new_var=None):
+    pruned = []
+    for propagator in propagators:
+        status, prunings = propagator(csp, new_var)
+        pruned.extend(prunings)
+        if not status:
+            return False, pruned
+    return True, pruned
+
+
+def chain_propagators(*propagators):
+    """
+    Combine propagators into one propagator which runs each of them in turn
+    (stopping at the first dead-end) and returns all of their prunings. The
+    combined propagator can be pickled if all of the propagators can.
+
+    :param propagators: Propagators, in the order they should be run
+    :return: Combined propagator
+    """
+    chained = functools.partial(_run_chained, propagators)
+    chained.__name__ = "+".join(p.__name__ for p in propagators)
+    return chained
+
+
 prop_GAC = prop_gac  # Aliased to comply with A2 API
 prop_FC = prop_fc  # Aliased to comply with A2 API
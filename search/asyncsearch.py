@@ -0,0 +1,342 @@
+"""
+Asynchronous facade for BacktrackingSearch, for use within asyncio services.
+
+A search is run in an executor (a thread pool by default, or a process pool)
+so it never blocks the event loop. While it runs, the search reports
+ProgressEvents (at most every progress_interval seconds) and checks whether
+it has been cancelled (at most every poll_interval seconds, between
+decisions): a cancelled search stops at its next decision, i.e. within
+milliseconds unless a single propagation takes longer. Nothing is printed;
+the outcome is returned as a SearchResult.
+
+    solver = AsyncSolver()
+    task = solver.submit(board, prop_fc, encode=encode_solution)
+    async for event in task.events():
+        print(event.decisions, event.depth, event.prunings_per_second)
+    result = await task
+    if result.status == 'solved':
+        ...  # result.solution
+
+task.cancel() (or cancelling the coroutine awaiting the task) stops the
+search, whose result then has status 'cancelled'. With count=True the
+solutions are counted instead (see BacktrackingSearch.bt_count) and the
+result's solution is their number.
+
+With a ProcessPoolExecutor, the CSP, propagator, value_key and encode
+function are sent to the worker process, so they must be picklable
+(module-level functions); the caller's CSP is left untouched. With a thread
+pool the search runs on the CSP itself (so a CSP must not be searched by two
+tasks at once), and the solution is left assigned to its variables.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from search.btsearch import BacktrackingSearch, SearchInterrupted
+
+ProgressEvent = collections.namedtuple(
+    'ProgressEvent',
+    'decisions prunings depth max_depth elapsed decisions_per_second '
+    'prunings_per_second')
+ProgressEvent.__doc__ = """
+Progress of a running search.
+
+    decisions:              number of variable assignments so far
+    prunings:               number of values pruned so far
+    depth:                  current depth of the search
+    max_depth:              deepest level reached so far
+    elapsed:                wall time since the search started, in seconds
+    decisions_per_second:   decisions per second since the previous event
+    prunings_per_second:    prunings per second since the previous event
+"""
+
+SearchResult = collections.namedtuple('SearchResult',
+                                      'status solution stats')
+SearchResult.__doc__ = """
+Outcome of a search.
+
+    status:     "solved", "unsolvable", "counted", "interrupted" (after
+                max_decisions) or "cancelled"
+    solution:   the solution as encoded by the task's encode function if
+                solved; the number of solutions if counted; None otherwise
+    stats:      dict of decisions, prunings, cpu_time and wall_time
+"""
+
+
+def encode_assignments(csp):
+    """
+    :return: Value (as a string) assigned to each variable, by name
+    :rtype: dict[str, str]
+    """
+    return {var.name: str(var.get_assigned_value()) for var in csp.vars}
+
+
+class SearchMonitor:
+    """
+    Monitors a search (as BacktrackingSearch.monitor): reports progress and
+    abandons the search once should_stop() returns True.
+    """
+
+    def __init__(self, should_stop=None, on_progress=None,
+                 progress_interval=0.1, poll_interval=0.002):
+        """
+        :param should_stop: (Optional) Callable returning True once the
+            search should be abandoned
+        :param on_progress: (Optional) Callable taking a ProgressEvent
+        :param progress_interval: Minimum number of seconds between events
+        :type progress_interval: float
+        :param poll_interval: Minimum number of seconds between calls to
+            should_stop (which may be slow, e.g. across processes)
+        :type poll_interval: float
+        """
+        self.should_stop = should_stop
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.poll_interval = poll_interval
+        self.stopped = False
+        self.max_depth = 0
+        self.start = self.last_poll = self.last_event = time.perf_counter()
+        self.last_counts = (0, 0)
+
+    def node(self, solver, level):
+        """
+        Record a search node at depth level.
+
+        :type solver: BacktrackingSearch
+        :raises SearchInterrupted: if the search should stop
+        """
+        if level > self.max_depth:
+            self.max_depth = level
+        now = time.perf_counter()
+        if self.should_stop is not None and \
+                now - self.last_poll >= self.poll_interval:
+            self.last_poll = now
+            if self.should_stop():
+                self.stopped = True
+                raise SearchInterrupted("cancelled")
+        if self.on_progress is not None and \
+                now - self.last_event >= self.progress_interval:
+            self.report(solver, level, now)
+
+    def report(self, solver, level, now=None):
+        """ Send a ProgressEvent for the current state of solver """
+        if now is None:
+            now = time.perf_counter()
+        interval = now - self.last_event
+        decisions, prunings = solver.num_decisions, solver.num_prunings
+        last_decisions, last_prunings = self.last_counts
+        self.on_progress(ProgressEvent(
+            decisions, prunings, level, self.max_depth, now - self.start,
+            (decisions - last_decisions) / interval if interval else 0.0,
+            (prunings - last_prunings) / interval if interval else 0.0))
+        self.last_event = now
+        self.last_counts = (decisions, prunings)
+
+
+def run_search(csp, propagator, max_decisions=None, count=False,
+               value_key=None, encode=encode_assignments, should_stop=None,
+               on_progress=None, progress_interval=0.1, poll_interval=0.002):
+    """
+    Search csp (executed in a worker thread or process).
+
+    :param count: Count the solutions instead of finding one
+    :type count: bool
+    :param value_key: (Optional) Key of interchangeable values when counting
+    :param encode: Function returning the (picklable) solution of the solved
+        CSP
+    :param should_stop: (Optional) Callable returning True once the search
+        should be abandoned
+    :param on_progress: (Optional) Callable taking a ProgressEvent
+    :param progress_interval: Minimum number of seconds between events
+    :param poll_interval: Minimum number of seconds between calls to
+        should_stop
+    :rtype: SearchResult
+    """
+    start = time.perf_counter()
+    solver = BacktrackingSearch(csp, logging.WARNING, verbose=False)
+    monitor = SearchMonitor(should_stop, on_progress, progress_interval,
+                            poll_interval)
+    solver.monitor = monitor
+    solution = None
+    if count:
+        solution = solver.bt_count(propagator, max_decisions, value_key)
+        status = 'counted' if solution is not None else None
+    else:
+        status = solver.bt_search(propagator, max_decisions)
+        if status:
+            status, solution = 'solved', encode(csp)
+        elif status is not None:
+            status = 'unsolvable'
+    if status is None:
+        status = 'cancelled' if monitor.stopped else 'interrupted'
+    if on_progress is not None:
+        monitor.report(solver, 0)
+    stats = solver.get_stats()
+    stats['wall_time'] = time.perf_counter() - start
+    return SearchResult(status, solution, stats)
+
+
+class SearchTask:
+    """
+    A search submitted to an AsyncSolver. Await it for its SearchResult.
+    """
+
+    def __init__(self, future, stop_event, events):
+        """
+        :type future: asyncio.Future
+        :param stop_event: Event set to cancel the search
+        :param events: Queue of ProgressEvents (None once the search is done)
+        :type events: asyncio.Queue
+        """
+        self.future = future
+        self.stop_event = stop_event
+        self._events = events
+
+    def cancel(self):
+        """ Ask the search to stop (its result will be "cancelled") """
+        self.stop_event.set()
+
+    def done(self):
+        return self.future.done()
+
+    async def result(self):
+        """
+        :rtype: SearchResult
+        """
+        try:
+            return await asyncio.shield(self.future)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    def __await__(self):
+        return self.result().__await__()
+
+    async def events(self):
+        """
+        Iterate over the search's ProgressEvents until it is done (the last
+        event has the final counts). Only one consumer may iterate.
+        """
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+
+class AsyncSolver:
+    """
+    Runs searches in an executor without blocking the event loop (see module
+    description).
+    """
+
+    def __init__(self, executor=None, progress_interval=0.1,
+                 poll_interval=0.002):
+        """
+        :param executor: (Optional) Executor to run searches in (default: a
+            thread pool owned by the solver)
+        :type executor: concurrent.futures.Executor
+        :param progress_interval: Minimum number of seconds between progress
+            events of each search
+        :type progress_interval: float
+        :param poll_interval: Minimum number of seconds between checks for
+            cancellation (each check is a round trip to a manager process if
+            executor is a process pool)
+        :type poll_interval: float
+        """
+        self._owns_executor = executor is None
+        self.executor = executor if executor is not None else \
+            concurrent.futures.ThreadPoolExecutor()
+        self.in_process = isinstance(executor,
+                                     concurrent.futures.ProcessPoolExecutor)
+        self.progress_interval = progress_interval
+        self.poll_interval = poll_interval
+        self._manager = None
+
+    def submit(self, csp, propagator, max_decisions=None, count=False,
+               value_key=None, encode=encode_assignments):
+        """
+        Start searching csp (see run_search). Must be called from a running
+        event loop.
+
+        :rtype: SearchTask
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        search = functools.partial(
+            run_search, csp, propagator, max_decisions, count, value_key,
+            encode, progress_interval=self.progress_interval,
+            poll_interval=self.poll_interval)
+        if not self.in_process:
+            stop_event = threading.Event()
+            future = loop.run_in_executor(
+                self.executor, functools.partial(
+                    search, should_stop=stop_event.is_set,
+                    on_progress=functools.partial(loop.call_soon_threadsafe,
+                                                  events.put_nowait)))
+            future.add_done_callback(lambda f: events.put_nowait(None))
+            return SearchTask(future, stop_event, events)
+
+        # Cross-process cancellation and progress, through a manager
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        stop_event = self._manager.Event()
+        remote_events = self._manager.Queue()
+        future = loop.run_in_executor(
+            self.executor, functools.partial(
+                search, should_stop=stop_event.is_set,
+                on_progress=remote_events.put))
+        loop.create_task(self._relay(future, remote_events, events))
+        return SearchTask(future, stop_event, events)
+
+    async def _relay(self, future, remote_events, events):
+        """ Copy progress events from a worker process's queue """
+        loop = asyncio.get_running_loop()
+        get = functools.partial(remote_events.get, True,
+                                self.progress_interval)
+        getter = None
+        while not future.done() or getter is not None:
+            if getter is None and not future.done():
+                getter = loop.run_in_executor(None, get)
+            await asyncio.wait((getter, future),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                try:
+                    events.put_nowait(getter.result())
+                except queue.Empty:
+                    pass
+                getter = None
+        # The final event was sent before the search returned
+        try:
+            while True:
+                events.put_nowait(remote_events.get_nowait())
+        except queue.Empty:
+            pass
+        events.put_nowait(None)
+
+    async def solve(self, csp, propagator, on_progress=None, **kwargs):
+        """
+        Search csp and return its SearchResult, calling on_progress (if
+        given) with each ProgressEvent. See submit for the other arguments.
+
+        :rtype: SearchResult
+        """
+        task = self.submit(csp, propagator, **kwargs)
+        async for event in task.events():
+            if on_progress is not None:
+                on_progress(event)
+        return await task
+
+    def shutdown(self):
+        """ Shut down the executor (if owned) and manager """
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
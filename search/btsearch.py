@@ -1,5 +1,57 @@
 from csp.cspbase import *
-import logging, time
+from search.profiling import SearchProfiler
+from search.transposition import TranspositionTable
+import collections, logging, time
+
+
+class SearchInterrupted(Exception):
+    """ Raised within bt_recurse to abandon a search """
+
+
+def prune_same_id(csp, val):
+    """
+    Prune values with same Tile ID as `val` from all unassigned variables of
+    csp (values without an ID, e.g. of road variables, are left alone)
+
+    :return: List of variable/value pairs which were pruned
+    :rtype: list[(Variable, object)]
+    """
+    id_prunings = []
+    val_id = getattr(val, 'id', None)
+    if val_id is None:
+        return id_prunings
+    for var in csp.get_all_vars():
+        if var.is_assigned():
+            continue
+        for dom_val in var.get_cur_domain():
+            if getattr(dom_val, 'id', None) == val_id:
+                var.prune_value(dom_val)
+                id_prunings.append((var, dom_val))
+    return id_prunings
+
+
+def convolve_usage(counts_a, counts_b, limits):
+    """
+    Combine the counts of solutions of two independent parts of a CSP, by the
+    number of each (shared) item they use.
+
+    :param counts_a: Number of solutions of one part, by usage of each item
+    :type counts_a: dict[tuple[int], int]
+    :param counts_b: Number of solutions of the other part, by usage
+    :type counts_b: dict[tuple[int], int]
+    :param limits: Number of each item available to both parts
+    :type limits: tuple[int]
+    :return: Number of solutions of both parts, by combined usage (within
+        limits)
+    :rtype: dict[tuple[int], int]
+    """
+    combined = collections.defaultdict(int)
+    for usage_a, count_a in counts_a.items():
+        for usage_b, count_b in counts_b.items():
+            usage = tuple(map(int.__add__, usage_a, usage_b))
+            if all(map(int.__le__, usage, limits)):
+                combined[usage] += count_a * count_b
+    return combined
 
 
 class BacktrackingSearch:
@@ -7,12 +59,15 @@ class BacktrackingSearch:
     Encapsulates statistics and bookkeeping for backtracking search.
     """
 
-    def __init__(self, csp, logLevel):
+    def __init__(self, csp, logLevel, verbose=True):
         '''
         csp == CSP object specifying the CSP to be solved
+        verbose == print search outcome and statistics to stdout
         '''
 
         self.csp = csp
+        # Fix the model: cheaper accessors and unassigned counts
+        csp.freeze()
 
         # the number of variable assignments made during search
         self.num_decisions = 0
@@ -25,7 +80,19 @@ class BacktrackingSearch:
         self.logger = logging.getLogger('btLogger')
         self.logger.setLevel(logLevel)
         self.TRACE = False
+        self.verbose = verbose
         self.runtime = 0
+        self.max_decisions = None
+        self.profiler = None
+        # Called at every decision as monitor.node(self, level); may raise
+        # SearchInterrupted to abandon the search (see search.asyncsearch)
+        self.monitor = None
+        # Transposition table and state function of the last count (see
+        # bt_count)
+        self.table = None
+        self.state_key = None
+        # Splits the unassigned variables into components (see bt_count)
+        self.decompose = None
 
     def trace_on(self):
         '''Turn search trace on'''
@@ -35,11 +102,37 @@ class BacktrackingSearch:
         '''Turn search trace off'''
         self.TRACE = False
 
+    def enable_profiling(self, profiler=None):
+        '''
+        Collect profiling counters during subsequent searches
+
+        :type profiler: SearchProfiler
+        :rtype: SearchProfiler
+        '''
+        self.profiler = profiler if profiler is not None else SearchProfiler()
+        return self.profiler
+
+    def disable_profiling(self):
+        '''Stop collecting profiling counters'''
+        self.profiler = None
+
     def clear_stats(self):
         '''Initialize counters'''
         self.num_decisions = 0
         self.num_prunings = 0
         self.runtime = 0
+        self.table = None
+        self.state_key = None
+        self.decompose = None
+
+    def get_stats(self):
+        '''Return search statistics as a dictionary'''
+        stats = {'decisions': self.num_decisions,
+                 'prunings': self.num_prunings,
+                 'cpu_time': self.runtime}
+        if self.table is not None:
+            stats['table'] = self.table.stats()
+        return stats
 
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
@@ -80,7 +173,7 @@ class BacktrackingSearch:
         '''Add variable back to list of unassigned vars'''
         self.unasgn_vars.append(var)
 
-    def bt_search(self, propagator):
+    def bt_search(self, propagator, max_decisions=None):
         """
         Try to solve the CSP using specified propagator routine
 
@@ -112,11 +205,29 @@ class BacktrackingSearch:
 
         NOTE propagator SHOULD NOT prune a value that has already been
         pruned! Nor should it prune a value twice
+
+        Returns True iff a solution was found (the solution is left assigned
+        to the CSP's variables), False if there is no solution (at once, if the
+        CSP is known to be infeasible, see CSP.infeasible_reason), or None if
+        the search was abandoned after max_decisions variable assignments.
         """
 
         # TODO: Re-implement
 
         self.clear_stats()
+        self.max_decisions = max_decisions
+        if self.profiler is not None:
+            self.profiler.instrument(self.csp)
+            propagator = self.profiler.wrap_propagator(propagator)
+            self.profiler.start()
+        try:
+            return self._bt_search(propagator)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+                self.profiler.restore()
+
+    def _bt_search(self, propagator):
         stime = time.process_time()
 
         self.restore_all_variable_domains()
@@ -126,41 +237,238 @@ class BacktrackingSearch:
             if not v.is_assigned():
                 self.unasgn_vars.append(v)
 
-        status, prunings = propagator(self.csp)  # initial propagate no assigned variables.
+        if not self.csp.is_feasible():
+            # Rejected when the CSP was built: no need to propagate
+            self.logger.info("CSP %s is infeasible: %s", self.csp.name,
+                             self.csp.infeasible_reason)
+            status, prunings = False, []
+        else:
+            status, prunings = propagator(self.csp)  # initial propagate no assigned variables.
         self.num_prunings = self.num_prunings + len(prunings)
 
-        self.logger.info(len(self.unasgn_vars), " unassigned variables at start of search")
-        self.logger.info("Root Prunings: ", prunings)
+        self.logger.info("%d unassigned variables at start of search",
+                         len(self.unasgn_vars))
+        self.logger.debug("Root Prunings: %s", prunings)
 
         if status == False:
             self.logger.info("CSP{} detected contradiction at root".format(
                 self.csp.name))
         else:
-            status = self.bt_recurse(propagator, 1)   # now do recursive search
-
+            try:
+                status = self.bt_recurse(propagator, 1)   # now do recursive search
+            except SearchInterrupted as e:
+                self.logger.info("CSP {} search abandoned: {}".format(
+                    self.csp.name, e))
+                self.restore_all_variable_domains()
+                status = None
 
         self.restoreValues(prunings)
-        if status == False:
+        self.runtime = time.process_time() - stime
+        if status == False and self.verbose:
             print("CSP{} unsolved. Has no solutions".format(self.csp.name))
         if status == True:
             self.logger.info("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
+                                                             self.runtime))
             self.csp.solution_str()
 
-        print("bt_search finished")
-        self.print_stats()
+        if self.verbose:
+            print("bt_search finished")
+            self.print_stats()
+        return status
+
+    def bt_count(self, propagator, max_decisions=None, value_key=None,
+                 state_key=None, table=None, decompose=None):
+        """
+        Count the solutions of the CSP, searching with the specified
+        propagator routine (see bt_search).
+
+        value_key (optional) identifies interchangeable values: at each node,
+        of the values with the same key only the first is tried, so solutions
+        which only differ in interchangeable values are counted once (e.g.
+        identical tiles, see tilecsp.tileboard.layout_key).
+
+        state_key (optional) describes the state at each node as a (Zobrist
+        hash, signature) pair, such that nodes with the same state have the
+        same number of solutions below them (e.g.
+        tilecsp.tileboard.FrontierKey); the count below each state is then
+        kept in table (a search.transposition.TranspositionTable, by default
+        a new one) and not counted again. The propagator must only prune
+        values which are in no solution.
+
+        decompose (optional) splits the unassigned variables at a node into
+        components which only interact through a shared inventory of items
+        (e.g. tilecsp.tileboard.BoardComponents): decompose(csp, variables)
+        returns None if they don't split, or (components, resource, limits),
+        with the components as lists of variables, resource(value) the index
+        of the item a value uses, and limits the number of each item left.
+        The solutions of each component are then counted by the items they
+        use (see count_by_usage), and the counts combined by convolution
+        within the limits (see convolve_usage), so the components' subtrees
+        are searched one after the other rather than one within the other.
+        Again, the propagator must only prune values which are in no
+        solution.
+
+        Returns the number of solutions, or None if the search was abandoned
+        after max_decisions variable assignments. No variables are left
+        assigned.
+        """
+        self.clear_stats()
+        self.max_decisions = max_decisions
+        if self.profiler is not None:
+            self.profiler.instrument(self.csp)
+            propagator = self.profiler.wrap_propagator(propagator)
+            self.profiler.start()
+        try:
+            return self._bt_count(propagator, value_key, state_key, table,
+                                  decompose)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+                self.profiler.restore()
+
+    def _bt_count(self, propagator, value_key, state_key, table, decompose):
+        stime = time.process_time()
+        self.restore_all_variable_domains()
+        self.unasgn_vars = [v for v in self.csp.vars if not v.is_assigned()]
+        if state_key is not None:
+            self.state_key = state_key
+            self.table = table if table is not None else TranspositionTable()
+        self.decompose = decompose
+
+        count = 0
+        if self.csp.is_feasible():
+            status, prunings = propagator(self.csp)
+            self.num_prunings = self.num_prunings + len(prunings)
+            if status:
+                try:
+                    count = self.bt_count_recurse(propagator, 1, value_key)
+                except SearchInterrupted as e:
+                    self.logger.info("CSP %s count abandoned: %s",
+                                     self.csp.name, e)
+                    self.restore_all_variable_domains()
+                    count = None
+            self.restoreValues(prunings)
+        self.runtime = time.process_time() - stime
+        self.logger.info("CSP %s has %s solutions. CPU Time used = %s",
+                         self.csp.name, count, self.runtime)
+        if self.verbose:
+            print("bt_count finished: {} solutions".format(count))
+            self.print_stats()
+        return count
+
+    def bt_count_recurse(self, propagator, level, value_key=None):
+        """
+        Return the number of solutions below the current node (see bt_count)
+        """
+        if not self.unasgn_vars:
+            return 1
+        if self.table is not None:
+            state, signature = self.state_key(self.csp)
+            count = self.table.lookup(state, signature)
+            if count is not None:
+                return count
+        split = None if self.decompose is None else \
+            self.decompose(self.csp, self.unasgn_vars)
+        if split is not None:
+            count = sum(self._count_components(propagator, level, value_key,
+                                               *split).values())
+        else:
+            var = self.extract_mr_var()
+            count = 0
+            for val in self._branches(var, propagator, level, value_key):
+                count += self.bt_count_recurse(propagator, level + 1,
+                                               value_key)
+            self.restoreUnasgnVar(var)
+        if self.table is not None:
+            self.table.store(state, signature, count, level)
+        return count
+
+    def count_by_usage(self, propagator, level, value_key, resource, width):
+        """
+        Count the solutions below the current node by the number of each item
+        they use (see bt_count's decompose)
+
+        :param resource: Index of the item a value uses
+        :param width: Number of items
+        :rtype: dict[tuple[int], int]
+        """
+        if not self.unasgn_vars:
+            return {(0,) * width: 1}
+        split = None if self.decompose is None else \
+            self.decompose(self.csp, self.unasgn_vars)
+        if split is not None:
+            return self._count_components(propagator, level, value_key,
+                                          *split)
+        var = self.extract_mr_var()
+        counts = collections.defaultdict(int)
+        for val in self._branches(var, propagator, level, value_key):
+            i = resource(val)
+            for usage, count in self.count_by_usage(
+                    propagator, level + 1, value_key, resource,
+                    width).items():
+                counts[usage[:i] + (usage[i] + 1,) + usage[i + 1:]] += count
+        self.restoreUnasgnVar(var)
+        return counts
+
+    def _count_components(self, propagator, level, value_key, components,
+                          resource, limits):
+        """
+        Count the solutions of each component in turn (the others being left
+        unassigned), and combine them by usage (see bt_count's decompose)
+
+        :rtype: dict[tuple[int], int]
+        """
+        unasgn_vars = self.unasgn_vars
+        combined = {(0,) * len(limits): 1}
+        try:
+            for component in components:
+                self.unasgn_vars = list(component)
+                counts = self.count_by_usage(propagator, level, value_key,
+                                             resource, len(limits))
+                combined = convolve_usage(combined, counts, limits)
+                if not combined:
+                    break
+        finally:
+            self.unasgn_vars = unasgn_vars
+        return combined
+
+    def _branches(self, var, propagator, level, value_key):
+        """
+        Assign each value of var in turn (only the first of the values with
+        the same value_key), yielding the values which propagate without a
+        dead-end; each assignment is undone when the next value is tried.
+        """
+        tried = set()
+        for val in var.get_cur_domain():
+            if value_key is not None:
+                key = value_key(val)
+                if key in tried:
+                    continue
+                tried.add(key)
+
+            var.assign(val)
+            if self.profiler is not None:
+                self.profiler.node(level)
+            id_prunings = self.prune_same_id(val)
+            self.num_decisions = self.num_decisions + 1
+            if self.max_decisions is not None and \
+                    self.num_decisions > self.max_decisions:
+                raise SearchInterrupted(
+                    "exceeded {} decisions".format(self.max_decisions))
+            if self.monitor is not None:
+                self.monitor.node(self, level)
+
+            status, prunings = propagator(self.csp, var)
+            self.num_prunings = self.num_prunings + len(prunings)
+            prunings.extend(id_prunings)
+            if status:
+                yield val
+            self.restoreValues(prunings)
+            var.unassign()
 
     def prune_same_id(self, val):
         """ Prune values with same Tile ID as `val` from all variables """
-        id_prunings = []
-        for var in self.csp.get_all_vars():
-            if var.is_assigned():
-                continue
-            for dom_val in var.get_cur_domain():
-                if val.id == dom_val.id:
-                    var.prune_value(dom_val)
-                    id_prunings.append((var, dom_val))
-        return id_prunings
+        return prune_same_id(self.csp, val)
 
     def bt_recurse(self, propagator, level):
         """
@@ -184,11 +492,19 @@ class BacktrackingSearch:
                 #print('  ' * level, "bt_recurse trying", var, "=", val)
 
                 var.assign(val)
+                if self.profiler is not None:
+                    self.profiler.node(level)
 
                 # Prune values with same Tile ID as `val` from all variables
                 id_prunings = self.prune_same_id(val)
 
                 self.num_decisions = self.num_decisions + 1
+                if self.max_decisions is not None and \
+                        self.num_decisions > self.max_decisions:
+                    raise SearchInterrupted(
+                        "exceeded {} decisions".format(self.max_decisions))
+                if self.monitor is not None:
+                    self.monitor.node(self, level)
 
                 status, prunings = propagator(self.csp, var)
                 self.num_prunings = self.num_prunings + len(prunings)
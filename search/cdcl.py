@@ -0,0 +1,474 @@
+"""
+Conflict-driven clause learning (CDCL) SAT solver.
+
+A small, dependency free solver for the CNF encodings of tile boards (see
+tilecsp.satboard), or any CNF given in DIMACS format. Where
+BacktrackingSearch backtracks chronologically, and so may refute the same
+conflict again under every unrelated decision above it, the solver learns
+a clause from each conflict and jumps back to the decision which caused it:
+
+    - unit propagation with two watched literals per clause
+    - first-UIP conflict analysis, with learned clause minimization
+    - VSIDS decision heuristic (decaying variable activities) with phase
+      saving
+    - Luby restarts
+    - learned clause database reduction, keeping clauses of low literal
+      block distance (LBD)
+
+Variables are numbered from 1, and literals are given as in DIMACS: v for
+variable v being true, -v for it being false.
+
+    solver = SATSolver()
+    solver.add_clause([1, -2])
+    solver.add_clause([2, 3])
+    if solver.solve():
+        print(solver.model)  # model[v] is the value of variable v
+
+    with open("board.cnf") as f:
+        num_vars, clauses = read_dimacs(f)
+"""
+import heapq
+import time
+
+# Literal values (indexed by internal literal, see SATSolver)
+_TRUE, _FALSE, _UNASSIGNED = 1, 0, -1
+
+# Conflicts between restarts (times the Luby sequence)
+RESTART_BASE = 100
+
+# Variable activity decay
+VAR_DECAY = 0.95
+
+# Learned clauses kept before the database is first reduced, and the
+# increase after each reduction
+LEARNT_BASE = 2000
+LEARNT_INCREMENT = 300
+
+
+def luby(i):
+    """
+    :return: The i-th element (from 1) of the Luby sequence 1, 1, 2, 1, 1,
+        2, 4, 1, ...
+    :rtype: int
+    """
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+
+class SATSolver:
+    """
+    CDCL SAT solver (see module description).
+
+    Internally, the literal v is 2 * v and -v is 2 * v + 1, so a literal's
+    negation is lit ^ 1. Clauses are lists of internal literals, whose first
+    two literals are watched.
+
+    Attributes:
+
+        num_vars:   int, number of variables
+        model:      after a satisfiable solve, list of the value of each
+                    variable (model[0] is unused)
+        stats:      dict of counters (decisions, conflicts, propagations,
+                    restarts, learned and deleted clauses)
+    """
+
+    def __init__(self, num_vars=0):
+        self.num_vars = 0
+        self.values = [_UNASSIGNED, _UNASSIGNED]
+        self.levels = [0]
+        self.reasons = [None]
+        self.activity = [0.0]
+        self.phase = [False]
+        self.watches = [[], []]
+        self.clauses = []
+        self.learnts = []
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.heap = []
+        self.var_inc = 1.0
+        self.ok = True
+        self.model = None
+        self.stats = {'decisions': 0, 'conflicts': 0, 'propagations': 0,
+                      'restarts': 0, 'learned': 0, 'deleted': 0}
+        self.ensure_vars(num_vars)
+
+    #
+    # Building the problem
+    #
+    def ensure_vars(self, num_vars):
+        """ Make sure variables 1 to num_vars exist """
+        while self.num_vars < num_vars:
+            self.num_vars += 1
+            self.values += [_UNASSIGNED, _UNASSIGNED]
+            self.levels.append(0)
+            self.reasons.append(None)
+            self.activity.append(0.0)
+            self.phase.append(False)
+            self.watches += [[], []]
+            heapq.heappush(self.heap, (0.0, self.num_vars))
+
+    def new_var(self):
+        """
+        :return: A new variable
+        :rtype: int
+        """
+        self.ensure_vars(self.num_vars + 1)
+        return self.num_vars
+
+    def add_clause(self, literals):
+        """
+        Add a clause (a disjunction of DIMACS literals). Must be called
+        before solving, or between solves.
+
+        :type literals: Iterable[int]
+        :return: False iff the problem is now known to be unsatisfiable
+        :rtype: bool
+        """
+        if not self.ok:
+            return False
+        self._backtrack(0)
+        clause = []
+        for literal in literals:
+            var = abs(literal)
+            self.ensure_vars(var)
+            lit = 2 * var + (literal < 0)
+            value = self.values[lit]
+            if value == _TRUE or lit ^ 1 in clause:
+                return True  # Satisfied, or a tautology
+            if value == _UNASSIGNED and lit not in clause:
+                clause.append(lit)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self._enqueue(clause[0], None)
+            self.ok = self._propagate() is None
+        else:
+            self._attach(clause)
+            self.clauses.append(clause)
+        return self.ok
+
+    #
+    # Search
+    #
+    def solve(self, max_conflicts=None, max_decisions=None, time_limit=None):
+        """
+        Solve the problem.
+
+        :param max_conflicts: (Optional) give up after this many conflicts
+        :param max_decisions: (Optional) give up after this many decisions
+        :param time_limit: (Optional) give up after this many seconds
+            (checked at restarts)
+        :return: True if satisfiable (see model), False if unsatisfiable,
+            None if the solver gave up
+        :rtype: bool
+        """
+        self.model = None
+        if not self.ok:
+            return False
+        stats = self.stats
+        deadline = None if time_limit is None else \
+            time.perf_counter() + time_limit
+        conflict_limit = None if max_conflicts is None else \
+            stats['conflicts'] + max_conflicts
+        decision_limit = None if max_decisions is None else \
+            stats['decisions'] + max_decisions
+        max_learnts = max(LEARNT_BASE, len(self.clauses) // 3)
+        restart = 1
+        while True:
+            budget = luby(restart) * RESTART_BASE
+            if conflict_limit is not None:
+                budget = min(budget, conflict_limit - stats['conflicts'])
+            status = self._search(budget, max_learnts, decision_limit)
+            if status is not None or \
+                    conflict_limit is not None and \
+                    stats['conflicts'] >= conflict_limit or \
+                    decision_limit is not None and \
+                    stats['decisions'] >= decision_limit or \
+                    deadline is not None and time.perf_counter() > deadline:
+                break
+            max_learnts += LEARNT_INCREMENT
+            restart += 1
+            stats['restarts'] += 1
+        if status:
+            values = self.values
+            self.model = [False] + [values[2 * v] == _TRUE
+                                    for v in range(1, self.num_vars + 1)]
+        elif status is False:
+            self.ok = False
+        self._backtrack(0)
+        return status
+
+    def _search(self, budget, max_learnts, decision_limit=None):
+        """
+        Search until a solution, a refutation, budget conflicts (then
+        restart) or decision_limit decisions in all
+
+        :return: True, False, or None on a restart
+        """
+        stats = self.stats
+        conflicts = 0
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                stats['conflicts'] += 1
+                conflicts += 1
+                if not self.trail_lim:
+                    return False
+                learnt, level, lbd = self._analyze(conflict)
+                self._backtrack(level)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self._attach(learnt)
+                    self.learnts.append((lbd, learnt))
+                    self._enqueue(learnt[0], learnt)
+                stats['learned'] += 1
+                self.var_inc /= VAR_DECAY
+                continue
+
+            if conflicts >= budget or decision_limit is not None and \
+                    stats['decisions'] >= decision_limit:
+                self._backtrack(0)
+                return None
+            if len(self.learnts) - len(self.trail) >= max_learnts:
+                self._reduce_learnts()
+            var = self._pick_var()
+            if var is None:
+                return True
+            stats['decisions'] += 1
+            self.trail_lim.append(len(self.trail))
+            self._enqueue(2 * var + (not self.phase[var]), None)
+
+    def _enqueue(self, lit, reason):
+        var = lit >> 1
+        self.values[lit] = _TRUE
+        self.values[lit ^ 1] = _FALSE
+        self.levels[var] = len(self.trail_lim)
+        self.reasons[var] = reason
+        self.trail.append(lit)
+
+    def _attach(self, clause):
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+
+    def _propagate(self):
+        """
+        Unit propagation of the literals on the trail since qhead
+
+        :return: A conflicting clause, or None
+        """
+        values = self.values
+        watches = self.watches
+        trail = self.trail
+        enqueue = self._enqueue
+        propagations = 0
+        while self.qhead < len(trail):
+            false_lit = trail[self.qhead] ^ 1
+            self.qhead += 1
+            propagations += 1
+            watching = watches[false_lit]
+            watches[false_lit] = kept = []
+            i, n = 0, len(watching)
+            while i < n:
+                clause = watching[i]
+                i += 1
+                if not clause:
+                    continue  # Deleted
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+                first = clause[0]
+                if values[first] == _TRUE:
+                    kept.append(clause)
+                    continue
+                for k in range(2, len(clause)):
+                    lit = clause[k]
+                    if values[lit] != _FALSE:
+                        clause[1], clause[k] = lit, false_lit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if values[first] == _FALSE:
+                        kept.extend(watching[i:])
+                        self.qhead = len(trail)
+                        self.stats['propagations'] += propagations
+                        return clause
+                    enqueue(first, clause)
+        self.stats['propagations'] += propagations
+        return None
+
+    def _analyze(self, conflict):
+        """
+        First-UIP conflict analysis
+
+        :return: Learned clause (asserting literal first, then a literal of
+            the backjump level), backjump level and LBD of the clause
+        """
+        levels = self.levels
+        reasons = self.reasons
+        trail = self.trail
+        level = len(self.trail_lim)
+        seen = set()
+        learnt = [None]
+        pending = 0
+        lit = None
+        index = len(trail) - 1
+        clause = conflict
+        while True:
+            for q in clause if lit is None else clause[1:]:
+                var = q >> 1
+                if var in seen or not levels[var]:
+                    continue
+                seen.add(var)
+                self._bump(var)
+                if levels[var] == level:
+                    pending += 1
+                else:
+                    learnt.append(q)
+            while trail[index] >> 1 not in seen:
+                index -= 1
+            lit = trail[index]
+            index -= 1
+            pending -= 1
+            if not pending:
+                break
+            clause = reasons[lit >> 1]
+            seen.discard(lit >> 1)
+        learnt[0] = lit ^ 1
+
+        # Minimization: drop literals implied by the rest of the clause
+        in_learnt = {q >> 1 for q in learnt}
+        learnt = [learnt[0]] + [
+            q for q in learnt[1:]
+            if reasons[q >> 1] is None or any(
+                r >> 1 not in in_learnt and levels[r >> 1]
+                for r in reasons[q >> 1][1:])]
+
+        if len(learnt) == 1:
+            return learnt, 0, 1
+        # Watch a literal of the highest level among the others
+        best = max(range(1, len(learnt)), key=lambda i: levels[learnt[i] >> 1])
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        lbd = len({levels[q >> 1] for q in learnt})
+        return learnt, levels[learnt[1] >> 1], lbd
+
+    def _bump(self, var):
+        self.activity[var] += self.var_inc
+        if self.activity[var] > 1e100:
+            self.var_inc *= 1e-100
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.heap = [(-self.activity[v], v)
+                         for v in range(1, self.num_vars + 1)
+                         if self.values[2 * v] == _UNASSIGNED]
+            heapq.heapify(self.heap)
+        elif self.values[2 * var] == _UNASSIGNED:
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def _pick_var(self):
+        """ :return: The unassigned variable of highest activity, or None """
+        heap = self.heap
+        values = self.values
+        activity = self.activity
+        while heap:
+            priority, var = heapq.heappop(heap)
+            if values[2 * var] == _UNASSIGNED and \
+                    -priority == activity[var]:
+                return var
+        # Stale entries only: any unassigned variable left?
+        for var in range(1, self.num_vars + 1):
+            if values[2 * var] == _UNASSIGNED:
+                return var
+        return None
+
+    def _backtrack(self, level):
+        """ Undo all assignments above level (saving their phases) """
+        if len(self.trail_lim) <= level:
+            return
+        values = self.values
+        start = self.trail_lim[level]
+        heap = self.heap
+        for lit in self.trail[start:]:
+            var = lit >> 1
+            values[lit] = values[lit ^ 1] = _UNASSIGNED
+            self.reasons[var] = None
+            self.phase[var] = not lit & 1
+            heapq.heappush(heap, (-self.activity[var], var))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = start
+        if len(heap) > 4 * self.num_vars + 1000:
+            # Drop stale entries
+            self.heap = [(-self.activity[v], v)
+                         for v in range(1, self.num_vars + 1)
+                         if values[2 * v] == _UNASSIGNED]
+            heapq.heapify(self.heap)
+
+    def _reduce_learnts(self):
+        """ Delete the half of the learned clauses of highest LBD """
+        reasons = self.reasons
+        self.learnts.sort(key=lambda entry: entry[0])
+        keep = len(self.learnts) // 2
+        kept = self.learnts[:keep]
+        for lbd, clause in self.learnts[keep:]:
+            if lbd <= 2 or reasons[clause[0] >> 1] is clause:
+                kept.append((lbd, clause))
+            else:
+                clause.clear()  # Dropped from watch lists when next visited
+                self.stats['deleted'] += 1
+        self.learnts = kept
+
+
+def read_dimacs(f):
+    """
+    Read a CNF in DIMACS format
+
+    :param f: Text file
+    :return: Number of variables and the clauses (lists of literals)
+    :rtype: (int, list[list[int]])
+    """
+    num_vars = 0
+    clauses = []
+    clause = []
+    for line in f:
+        line = line.strip()
+        if not line or line[0] in 'c%':
+            continue
+        if line[0] == 'p':
+            num_vars = int(line.split()[2])
+            continue
+        for token in line.split():
+            literal = int(token)
+            if literal:
+                clause.append(literal)
+                num_vars = max(num_vars, abs(literal))
+            else:
+                clauses.append(clause)
+                clause = []
+    if clause:
+        clauses.append(clause)
+    return num_vars, clauses
+
+
+def write_dimacs(f, num_vars, clauses, comments=()):
+    """
+    Write a CNF in DIMACS format
+
+    :param f: Text file
+    :type num_vars: int
+    :type clauses: Sequence[Sequence[int]]
+    :param comments: Lines of comments to write first
+    :type comments: Iterable[str]
+    """
+    for comment in comments:
+        f.write("c {}\n".format(comment))
+    f.write("p cnf {} {}\n".format(num_vars, len(clauses)))
+    for clause in clauses:
+        f.write(" ".join(map(str, clause)) + " 0\n")
@@ -0,0 +1,141 @@
+"""
+Knuth's estimator of the size of a backtracking search tree.
+
+Each probe walks one random path down the tree that BacktrackingSearch
+would explore with the given propagator: at each node the variable is
+chosen as the search chooses it (minimum remaining values), and one of its
+d current values is picked at random and propagated. A path ends at a
+dead-end or a solution. With d_1, d_2, ... the number of values at each
+level of the path, the probe's estimate of the number of decisions is
+
+    d_1 + d_1 * d_2 + d_1 * d_2 * d_3 + ...
+
+which is an unbiased estimate of the decisions made by a search over the
+whole tree (i.e. of an unsatisfiable puzzle; a satisfiable puzzle stops at
+its first solution, so the estimate is an upper bound). The mean over many
+probes is reported with a normal-approximation confidence interval; tree
+sizes are heavy tailed, so the interval is only a rough guide with few
+probes. Runtime is predicted from the time per node measured while probing.
+
+For satisfiable puzzles, the share of probes that end at a solution gives a
+second (heuristic) estimate: the number of nodes a randomised dive search
+would visit before finding a solution, i.e. the nodes per probe divided by
+the share of successful probes.
+
+    estimate = estimate_search(board, prop_fc, probes=200, seed=1)
+    if estimate.seconds > 1.0:
+        ...  # route to the slow queue
+"""
+import collections
+import logging
+import math
+import random
+import time
+
+from search.btsearch import BacktrackingSearch
+
+SearchEstimate = collections.namedtuple(
+    'SearchEstimate',
+    'nodes nodes_low nodes_high seconds seconds_low seconds_high probes '
+    'solutions nodes_to_solution')
+SearchEstimate.__doc__ = """
+Predicted cost of a search.
+
+    nodes:          estimated number of decisions (variable assignments)
+    nodes_low:      lower bound of the confidence interval on nodes
+    nodes_high:     upper bound of the confidence interval on nodes
+    seconds:        estimated search time, in seconds
+    seconds_low:    lower bound of the confidence interval on seconds
+    seconds_high:   upper bound of the confidence interval on seconds
+    probes:         number of probes made
+    solutions:      number of probes which ended at a solution
+    nodes_to_solution:
+                    estimated number of decisions until a solution is found
+                    (None if no probe found one)
+"""
+
+
+def probe_path(solver, propagator, rng):
+    """
+    Walk one random path down the search tree of solver's CSP, then undo all
+    assignments and prunings.
+
+    :type solver: BacktrackingSearch
+    :type rng: random.Random
+    :return: Knuth estimate of the number of decisions; number of nodes
+        visited; True iff the path ended at a solution
+    :rtype: (float, int, bool)
+    """
+    csp = solver.csp
+    solver.unasgn_vars = [v for v in csp.get_all_vars()
+                          if not v.is_assigned()]
+    status, root_prunings = propagator(csp)
+    trail = []
+    estimate, weight, visited = 0.0, 1, 0
+    solved = False
+    while status:
+        if not solver.unasgn_vars:
+            solved = True
+            break
+        var = solver.extract_mr_var()
+        values = var.get_cur_domain()
+        if not values:
+            # Wiped out by same-ID pruning: no children
+            break
+        weight *= len(values)
+        estimate += weight
+        visited += 1
+        val = rng.choice(values)
+        var.assign(val)
+        prunings = solver.prune_same_id(val)
+        status, more_prunings = propagator(csp, var)
+        prunings.extend(more_prunings)
+        trail.append((var, prunings))
+    for var, prunings in reversed(trail):
+        solver.restoreValues(prunings)
+        if var.is_assigned():
+            var.unassign()
+    solver.restoreValues(root_prunings)
+    return estimate, visited, solved
+
+
+def estimate_search(csp, propagator, probes=100, seed=None, confidence=1.96):
+    """
+    Estimate the cost of BacktrackingSearch.bt_search(propagator) on csp (see
+    module description). Must be called with no variables assigned.
+
+    :type csp: CSP
+    :param probes: Number of random paths to walk
+    :type probes: int
+    :param seed: (Optional) Seed of the random number generator
+    :param confidence: Width of the confidence interval, in standard errors
+        (default: 95%)
+    :type confidence: float
+    :rtype: SearchEstimate
+    """
+    if probes < 1:
+        raise ValueError("An estimate needs at least one probe")
+    if not csp.is_feasible():
+        return SearchEstimate(0, 0, 0, 0.0, 0.0, 0.0, 0, 0, None)
+    rng = random.Random(seed)
+    solver = BacktrackingSearch(csp, logging.WARNING, verbose=False)
+    estimates = []
+    visited = solutions = 0
+    start = time.process_time()
+    for _ in range(probes):
+        estimate, num_visited, solved = probe_path(solver, propagator, rng)
+        estimates.append(estimate)
+        visited += num_visited
+        solutions += solved
+    elapsed = time.process_time() - start
+
+    mean = sum(estimates) / probes
+    variance = sum((e - mean) ** 2 for e in estimates) / (probes - 1) \
+        if probes > 1 else 0.0
+    margin = confidence * math.sqrt(variance / probes)
+    low, high = max(mean - margin, 0.0), mean + margin
+    per_node = elapsed / visited if visited else 0.0
+    return SearchEstimate(mean, low, high,
+                          mean * per_node, low * per_node, high * per_node,
+                          probes, solutions,
+                          visited / solutions if solutions else None)
@@ -0,0 +1,246 @@
+"""
+Singleton arc consistency (failed-value probing) as an optional presolve.
+
+Each value of each variable is probed: tentatively assigned as a search node
+would assign it (pruning values with the same tile ID, see prune_same_id)
+and propagated with the given propagator. A value whose probe fails cannot be
+part of any solution, so it is removed from its variable's domain for good
+(Variable.remove_domain_values). Removals can make other probes fail, so
+probing repeats until a round removes nothing (or the time limit is
+reached; everything removed until then stays removed).
+
+Probing is incremental: the prunings made by each successful probe are
+kept, and a probe is only repeated once a value which survived it has since
+been removed. Rounds after the first are therefore much cheaper.
+
+With workers > 0, the probes of each round are spread over a process pool.
+Each worker keeps its own copy of the CSP (sent once) and is sent the
+removals made since, so the CSP and the propagator must be picklable.
+
+    result = probe(board, prop_fc, time_limit=2.0)
+    if board.is_feasible():
+        solver.bt_search(prop_fc)
+"""
+import collections
+import concurrent.futures
+import pickle
+import time
+
+from csp.propagators import prop_fc
+from search.btsearch import prune_same_id
+
+ProbeResult = collections.namedtuple('ProbeResult',
+                                     'removed probes rounds time complete')
+ProbeResult.__doc__ = """
+Outcome of probing a CSP.
+
+    removed:    number of values removed from the variables' domains
+    probes:     number of values probed
+    rounds:     number of rounds over the variables
+    time:       wall time, in seconds
+    complete:   False if probing stopped at the time limit (before the
+                fixpoint was reached)
+"""
+
+
+def probe_value(csp, var, value, propagator):
+    """
+    Tentatively assign value to var and propagate, then undo everything.
+
+    :type var: Variable
+    :return: True iff no dead-end was detected; List of variable/value pairs
+        which were pruned
+    :rtype: bool, list[(Variable, object)]
+    """
+    var.assign(value)
+    pruned = prune_same_id(csp, value)
+    status, prunings = propagator(csp, var)
+    pruned.extend(prunings)
+    for v, val in pruned:
+        v.unprune_value(val)
+    if var.is_assigned():
+        var.unassign()
+    return status, pruned
+
+
+class _Prober:
+    """
+    Probes values of a CSP, identified by (variable index, value index) in
+    the order of the variables and of their domains when probing began.
+    """
+
+    def __init__(self, csp, propagator):
+        self.csp = csp
+        self.propagator = propagator
+        self.values = [var.domain() for var in csp.vars]
+        self.value_index = [{value: j for j, value in enumerate(values)}
+                            for values in self.values]
+        self.var_index = {var: i for i, var in enumerate(csp.vars)}
+        # Number of (shared) removals applied to this copy of the CSP
+        self.applied = 0
+
+    def encode(self, pairs):
+        return frozenset((self.var_index[var], self.value_index[i][value])
+                         for var, value in pairs
+                         for i in (self.var_index[var],))
+
+    def root(self):
+        """
+        Initial propagation.
+
+        :return: False if a dead-end was detected; Encoded prunings
+        """
+        status, prunings = self.propagator(self.csp)
+        for var, value in prunings:
+            var.unprune_value(value)
+        return status, self.encode(prunings)
+
+    def apply(self, removals):
+        """ Remove the values in removals[self.applied:] """
+        for i, j in removals[self.applied:]:
+            self.csp.vars[i].remove_domain_values((self.values[i][j],))
+        self.applied = len(removals)
+
+    def probe(self, i, j):
+        """
+        :return: True iff the probe succeeded; Encoded prunings
+        """
+        status, pruned = probe_value(self.csp, self.csp.vars[i],
+                                     self.values[i][j], self.propagator)
+        return status, self.encode(pruned)
+
+
+_worker_prober = None
+
+
+def _init_worker(state):
+    global _worker_prober
+    _worker_prober = _Prober(*pickle.loads(state))
+    _worker_prober.root()
+
+
+def _probe_chunk(tasks, removals, deadline):
+    """
+    Probe values in a worker process, after applying the removals made so
+    far. Stops at the deadline (time.time()).
+
+    :return: (variable index, value index, status, encoded prunings) of each
+        value probed
+    """
+    _worker_prober.apply(removals)
+    results = []
+    for i, j in tasks:
+        if deadline is not None and time.time() > deadline:
+            break
+        status, pruned = _worker_prober.probe(i, j)
+        results.append((i, j, status, pruned))
+    return results
+
+
+def _probe_parallel(executor, workers, tasks, removals, deadline):
+    """ Probe tasks over the worker processes of executor """
+    chunksize = max(1, len(tasks) // (4 * workers))
+    futures = [executor.submit(_probe_chunk, tasks[k:k + chunksize],
+                               removals, deadline)
+               for k in range(0, len(tasks), chunksize)]
+    for future in futures:
+        yield from future.result()
+
+
+def probe(csp, propagator=prop_fc, time_limit=None, workers=0):
+    """
+    Remove values which fail probing from the variables' domains, until a
+    fixpoint (see module description). Must be called before search, with no
+    variables assigned. If a variable loses every value, the CSP's
+    infeasible_reason is set.
+
+    :type csp: CSP
+    :param propagator: Propagator run after each tentative assignment
+    :param time_limit: (Optional) Maximum number of seconds to probe for
+    :type time_limit: float
+    :param workers: Number of worker processes (0 = probe in this process)
+    :type workers: int
+    :rtype: ProbeResult
+    """
+    start = time.time()
+    deadline = None if time_limit is None else start + time_limit
+    csp.freeze()
+    prober = _Prober(csp, propagator)
+    removals = []
+    # Successful probes: (number of removals when probed, encoded prunings)
+    records = {}
+    probes = rounds = 0
+
+    def result(complete):
+        return ProbeResult(len(removals), probes, rounds, time.time() - start,
+                           complete)
+
+    def remove(i, j):
+        """ :return: False iff the variable has no values left """
+        csp.vars[i].remove_domain_values((prober.values[i][j],))
+        removals.append((i, j))
+        if csp.vars[i].domain_size():
+            return True
+        csp.infeasible_reason = "No value of {} survives probing".format(
+            csp.vars[i].name)
+        return False
+
+    def needs_probe(i, j):
+        record = records.get((i, j))
+        return record is None or any(k != i and (k, m) not in record[1]
+                                     for k, m in removals[record[0]:])
+
+    def probe_sequential(tasks):
+        for i, j in tasks:
+            if deadline is not None and time.time() > deadline:
+                return
+            yield (i, j) + prober.probe(i, j)
+
+    if not csp.is_feasible():
+        return result(True)
+    # Workers start from a copy of the CSP as it is now, before any removals
+    state = pickle.dumps((csp, propagator)) if workers else None
+    status, pruned = prober.root()
+    if not status:
+        csp.infeasible_reason = "Dead-end at root propagation"
+        return result(True)
+    for i, j in sorted(pruned):
+        if not remove(i, j):
+            return result(True)
+
+    executor = concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(state,)) \
+        if workers else None
+    try:
+        changed = True
+        while changed:
+            rounds += 1
+            changed = False
+            tasks = [(i, j) for i, var in enumerate(csp.vars)
+                     for j in map(prober.value_index[i].get, var.domain())
+                     if needs_probe(i, j)]
+            if executor is None:
+                outcomes = probe_sequential(tasks)
+            else:
+                # Workers only see the removals made before this round
+                round_start = len(removals)
+                outcomes = _probe_parallel(executor, workers, tasks,
+                                           removals[:], deadline)
+            num_probed = 0
+            for i, j, status, pruned in outcomes:
+                num_probed += 1
+                probes += 1
+                if status:
+                    records[i, j] = (len(removals) if executor is None else
+                                     round_start, pruned)
+                else:
+                    changed = True
+                    if not remove(i, j):
+                        return result(True)
+            if num_probed < len(tasks) or changed and deadline is not None \
+                    and time.time() > deadline:
+                return result(False)
+        return result(True)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
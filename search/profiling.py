@@ -0,0 +1,208 @@
+"""
+Opt-in profiling counters for BacktrackingSearch.
+
+A SearchProfiler instruments a CSP for the duration of a search by swapping
+the classes of its constraints and variables for counting subclasses, and
+wraps the propagator. Nothing is instrumented (so nothing is paid) unless a
+profiler is enabled:
+
+    solver = BacktrackingSearch(board, logging.WARNING)
+    profiler = solver.enable_profiling()
+    solver.bt_search(prop_fc)
+    print(profiler.to_json())
+
+Counters are aggregated by constraint kind (Constraint.kind, e.g.
+"adjacency", "border", "all-diff"). Prunings and domain wipe-outs are
+attributed to the kind of the constraint whose failed check (or missing
+support) preceded them; prunings made by the search itself (pruning values
+with the same tile ID) are attributed to SEARCH_KIND.
+"""
+import collections
+import json
+import time
+
+# Kind reported for prunings made by the search rather than a propagator
+SEARCH_KIND = 'search'
+
+
+def _constraint_counters():
+    return {'checks': 0,
+            'check_failures': 0,
+            'support_queries': 0,
+            'supports_found': 0,
+            'prunings': 0,
+            'wipeouts': 0,
+            'time': 0.0}
+
+
+def _propagator_counters():
+    return {'calls': 0, 'failures': 0, 'prunings': 0, 'time': 0.0}
+
+
+class SearchProfiler:
+    """
+    Collects per-constraint-kind and per-propagator counters, a histogram of
+    search nodes by depth and overall node throughput.
+    """
+
+    def __init__(self):
+        self.constraints = collections.defaultdict(_constraint_counters)
+        self.propagators = collections.defaultdict(_propagator_counters)
+        self.depth_histogram = collections.Counter()
+        self.nodes = 0
+        self.search_time = 0.0
+        # Kind of the constraint which last failed a check / lacked support
+        self._culprit = None
+        self._start = None
+        self._instrumented = []
+        self._subclasses = {}
+
+    #
+    # Instrumentation
+    #
+    def _subclass(self, cls, overrides):
+        """ Counting subclass of cls (created once per class) """
+        if cls not in self._subclasses:
+            overrides['__slots__'] = ()
+            self._subclasses[cls] = type('Profiled' + cls.__name__, (cls,),
+                                         overrides)
+        return self._subclasses[cls]
+
+    def _constraint_class(self, cls):
+        profiler = self
+
+        def counted_check(constraint, run, *args):
+            counters = profiler.constraints[constraint.kind or 'other']
+            start = time.perf_counter()
+            result = run(constraint, *args)
+            counters['time'] += time.perf_counter() - start
+            counters['checks'] += 1
+            if result:
+                profiler._culprit = None
+            else:
+                counters['check_failures'] += 1
+                profiler._culprit = constraint.kind or 'other'
+            return result
+
+        def check(constraint):
+            return counted_check(constraint, cls.check)
+
+        def check_last(constraint, var):
+            if constraint.incremental is None or \
+                    constraint.num_unassigned is None:
+                return check(constraint)  # Falls back on check
+            return counted_check(constraint, cls.check_last, var)
+
+        def has_support(constraint, var, val):
+            counters = profiler.constraints[constraint.kind or 'other']
+            start = time.perf_counter()
+            result = cls.has_support(constraint, var, val)
+            counters['time'] += time.perf_counter() - start
+            counters['support_queries'] += 1
+            if result:
+                counters['supports_found'] += 1
+                profiler._culprit = None
+            else:
+                profiler._culprit = constraint.kind or 'other'
+            return result
+
+        return self._subclass(cls, {'check': check,
+                                    'check_last': check_last,
+                                    'has_support': has_support})
+
+    def _variable_class(self, cls):
+        profiler = self
+
+        def prune_value(var, value):
+            cls.prune_value(var, value)
+            counters = profiler.constraints[profiler._culprit or SEARCH_KIND]
+            counters['prunings'] += 1
+            if var.get_cur_domain_size() == 0:
+                counters['wipeouts'] += 1
+
+        return self._subclass(cls, {'prune_value': prune_value})
+
+    def instrument(self, csp):
+        """ Instrument the constraints and variables of csp """
+        for c in csp.get_all_cons():
+            self._instrumented.append((c, type(c)))
+            c.__class__ = self._constraint_class(type(c))
+        for v in csp.get_all_vars():
+            self._instrumented.append((v, type(v)))
+            v.__class__ = self._variable_class(type(v))
+
+    def restore(self):
+        """ Remove all instrumentation """
+        for obj, cls in self._instrumented:
+            obj.__class__ = cls
+        self._instrumented = []
+
+    def wrap_propagator(self, propagator):
+        """
+        :return: propagator, counting calls, failures, prunings and time
+            (separately for the initial call, before any assignments)
+        """
+        def profiled_propagator(csp, new_var=None):
+            counters = self.propagators[
+                "{} ({})".format(propagator.__name__,
+                                 'node' if new_var else 'root')]
+            self._culprit = None
+            start = time.perf_counter()
+            status, prunings = propagator(csp, new_var)
+            counters['time'] += time.perf_counter() - start
+            counters['calls'] += 1
+            counters['prunings'] += len(prunings)
+            if not status:
+                counters['failures'] += 1
+            self._culprit = None
+            return status, prunings
+
+        profiled_propagator.__name__ = propagator.__name__
+        return profiled_propagator
+
+    #
+    # Search events
+    #
+    def start(self):
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self._start is not None:
+            self.search_time += time.perf_counter() - self._start
+            self._start = None
+
+    def node(self, depth):
+        """ Record a search node (variable assignment) at depth """
+        self.nodes += 1
+        self.depth_histogram[depth] += 1
+        self._culprit = None
+
+    #
+    # Export
+    #
+    def as_dict(self):
+        """
+        :return: All counters (JSON serializable)
+        :rtype: dict
+        """
+        return {
+            'nodes': self.nodes,
+            'search_time': self.search_time,
+            'nodes_per_second':
+                self.nodes / self.search_time if self.search_time else 0.0,
+            'constraints': dict(self.constraints),
+            'propagators': dict(self.propagators),
+            'depth_histogram': {str(depth): count for depth, count in
+                                sorted(self.depth_histogram.items())},
+        }
+
+    def to_json(self, fp=None, **kwargs):
+        """
+        Export counters as JSON.
+
+        :param fp: (Optional) File to write to
+        :return: JSON string (if fp is not given)
+        """
+        if fp is None:
+            return json.dumps(self.as_dict(), **kwargs)
+        json.dump(self.as_dict(), fp, **kwargs)
@@ -0,0 +1,148 @@
+"""
+Transposition table for counting solutions.
+
+Different assignment orders reach search states which leave the same
+problem to solve below them: the same unassigned variables, with the same
+conditions imposed by the assigned variables around them and the same
+values left to use. The number of solutions below such a state only needs
+to be counted once. A state function (e.g. tilecsp.tileboard.FrontierKey)
+describes the state at each node as
+
+    key:        int, Zobrist hash of the state (see zobrist_keys)
+    signature:  hashable, exact description of the state, stored with the
+                entry so that hash collisions are detected (and missed)
+                rather than returning another state's count
+
+and BacktrackingSearch.bt_count looks each state up before searching below
+it, and stores the count it finds.
+
+The table holds at most max_entries entries. When it is full, either the
+least recently used entry is replaced ("lru"), or the deepest entry, whose
+count was the cheapest to find, unless the new entry is deeper still
+("depth").
+
+    table = TranspositionTable(max_entries=100000, replacement='depth')
+    count = solver.bt_count(prop_fc, value_key=layout_key,
+                            state_key=FrontierKey(board), table=table)
+    print(table.stats())
+"""
+import collections
+import random
+
+REPLACEMENTS = ('lru', 'depth')
+
+
+def zobrist_keys(num_keys, seed=0):
+    """
+    :return: Random 64-bit keys, to XOR together into Zobrist hashes (the
+        same for the same seed)
+    :rtype: list[int]
+    """
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(num_keys)]
+
+
+class TranspositionTable:
+    """
+    Bounded map of state hashes to the (signature, value, depth) of the
+    states (see module description).
+    """
+
+    def __init__(self, max_entries=1 << 20, replacement='lru'):
+        """
+        :param max_entries: Maximum number of entries held
+        :type max_entries: int
+        :param replacement: "lru" or "depth" (see module description)
+        :type replacement: str
+        """
+        if replacement not in REPLACEMENTS:
+            raise ValueError("Unknown replacement scheme {!r}".format(
+                replacement))
+        if max_entries < 1:
+            raise ValueError("A table needs at least one entry")
+        self.max_entries = max_entries
+        self.replacement = replacement
+        # key: (signature, value, depth), least recently used first
+        self.entries = collections.OrderedDict()
+        # For depth-preferred replacement: keys by depth, oldest first
+        self._by_depth = collections.defaultdict(dict)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def lookup(self, key, signature):
+        """
+        :return: The value stored for the state, or None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != signature:
+            self.collisions += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.replacement == 'lru':
+            self.entries.move_to_end(key)
+        return entry[1]
+
+    def store(self, key, signature, value, depth):
+        """
+        Store the value of a state found at depth, replacing another entry if
+        the table is full (see module description)
+        """
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self._forget(key, old[2])
+        elif len(self.entries) >= self.max_entries and \
+                not self._evict(depth):
+            return
+        self.entries[key] = (signature, value, depth)
+        if self.replacement == 'depth':
+            self._by_depth[depth][key] = None
+        self.stores += 1
+
+    def _evict(self, depth):
+        """
+        Make room for an entry at depth
+        :return: False iff the entry shouldn't be stored
+        """
+        if self.replacement == 'lru':
+            self.entries.popitem(last=False)
+        else:
+            deepest = max(self._by_depth)
+            if depth > deepest:
+                return False
+            bucket = self._by_depth[deepest]
+            key = next(iter(bucket))
+            del self.entries[key]
+            self._forget(key, deepest)
+        self.evictions += 1
+        return True
+
+    def _forget(self, key, depth):
+        if self.replacement == 'depth':
+            bucket = self._by_depth[depth]
+            del bucket[key]
+            if not bucket:
+                del self._by_depth[depth]
+
+    def clear(self):
+        """ Remove all entries (the counters are kept) """
+        self.entries.clear()
+        self._by_depth.clear()
+
+    def stats(self):
+        """
+        :return: Entries held and the table's counters
+        :rtype: dict
+        """
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'collisions': self.collisions,
+                'stores': self.stores, 'evictions': self.evictions}
+
+    def __len__(self):
+        return len(self.entries)
@@ -4,8 +4,9 @@ from tilecsp.tileboard import *
 from search.btsearch import *
 from csp.propagators import *
 import time
-import matplotlib.pyplot as plt
-import numpy as np
+
+# matplotlib and numpy are only needed for plotting, and slow to import:
+# they are imported where they are used
 
 
 def puzzle_test(num_tiles, terminal_nodes={}, dim=3):
@@ -42,6 +43,8 @@ def puzzle_test(num_tiles, terminal_nodes={}, dim=3):
     print('Time to solve with forward checking: {}\n'.format(time_FC))
     #print('Time to solve with GAC: {}\n'.format(time_GAC))
 
+    # import matplotlib.pyplot as plt
+    # import numpy as np
     # ind = np.arange(3)
     # width = 0.5
     # time_data = [time_BT, time_FC, time_GAC]
@@ -144,6 +147,8 @@ def test_fc_puzzle():
     print('Time to 3x3: {}\n'.format(time_3))
     print('Time to 4x4: {}\n'.format(time_4))
 
+    import numpy as np
+    # import matplotlib.pyplot as plt
 
     ind = np.arange(3)
     width = 0.5
@@ -0,0 +1,504 @@
+"""
+Batch solving of tile puzzles.
+
+Puzzle specs are read as JSON lines, one puzzle per line, e.g.
+
+    {"id": "p1", "dim": 3, "tiles": {"CornerTile": 4, "TTile": 4,
+     "LineTile": 1}, "terminals": [[0, 2, "w"], [2, 0, "n"]]}
+
+    id:          (Optional) echoed back in the result
+    dim:         board dimension (default 3)
+    tiles:       tile counts, keyed by tile class name (see TILE_TYPES)
+    terminals:   (Optional) list of [x, y, edge] terminal nodes
+    propagator:  (Optional) "BT", "FC" or "GAC" (default given on the
+                 command line)
+    model:       (Optional) "cell" (TileBoard, the default), "edge"
+                 (EdgeTileBoard) or "slot" (SlotTileBoard); the latter two
+                 are searched with prop_pigeonhole as well
+    engine:      (Optional) "search" (backtracking search with the
+                 propagator, the default), "sat" (CDCL SAT solver on the
+                 CNF encoding of the board, see tilecsp.satboard) or "lns"
+                 (large-neighbourhood search from the "previous" solution,
+                 if any, see tilecsp.lns; incomplete, for big boards); cell
+                 model only
+    max_conflicts:
+                 (Optional) with the "sat" engine, give up after this many
+                 conflicts (the result then has status "interrupted")
+    time_limit:  (Optional) with the "lns" engine, give up after this many
+                 seconds (default 10; the result then has status
+                 "interrupted"); windows are chosen with the spec's "seed"
+    previous:    (Optional) solution (as in results) of the puzzle before
+                 an edit, e.g. a terminal moved or a tile swapped: the search
+                 repairs it around the changed cells before searching the
+                 whole board (see tilecsp.repair; cell model only)
+    block:       (Optional) if true, also prune with the 2x2 block pattern
+                 database (see tilecsp.patterns; cell model only)
+    connectivity:
+                 (Optional) if true, only accept layouts whose roads all
+                 belong to the network linking the terminals, i.e. without
+                 stray loops (see tilecsp.connectivity; cell model only);
+                 puzzles from tilecsp.generator always have one
+    reachability:
+                 (Optional) if true, also prune tiles with roads that
+                 can't be reached from the terminals (same rule as
+                 connectivity, see tilecsp.connectivity; cell model only)
+    probe:       (Optional) time limit, in seconds, for failed-value probing
+                 (see search.probing) before the search
+    estimate:    (Optional) number of random probes with which to estimate
+                 the cost of the search (see search.estimate) instead of
+                 searching (seeded with the spec's "seed", if any); the
+                 result then has status "estimated" and an "estimate"
+                 record, which schedulers can use for routing
+    memo:        (Optional) when counting, keep the counts of search states
+                 in a transposition table of at most this many entries
+                 (see search.transposition; cell model only)
+    memo_replacement:
+                 (Optional) "lru" (the default) or "depth": which entry the
+                 transposition table replaces when it is full
+    components:  (Optional) if true, when counting, count the components
+                 into which the unassigned cells split separately (see
+                 BoardComponents; cell model only)
+    max_decisions:
+                 (Optional) abandon the search after this many variable
+                 assignments (the result then has status "interrupted")
+
+Results are written as JSON lines in order of completion:
+
+    {"id": "p1", "line": 1, "status": "solved", "solution": [...],
+     "stats": {"decisions": ..., "prunings": ..., "cpu_time": ...,
+               "wall_time": ...}}
+
+status is one of "solved", "unsolvable", "estimated", "interrupted" or
+"error". The solution is a list of rows, each cell given as [tile class
+name, road edges] (e.g. ["CornerTile", "ne"]).
+
+Puzzles are sent to worker processes as their (small) specs, in chunks;
+boards are built and solved entirely within the worker.
+
+To run:
+    python3 -m tilecsp.batch puzzles.jsonl -o results.jsonl
+    cat puzzles.jsonl | python3 -m tilecsp.batch -j 8
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+
+from tilecsp.tileboard import *
+from tilecsp.edgeboard import EdgeTileBoard, prop_pigeonhole
+from tilecsp.slotboard import SlotTileBoard
+from tilecsp.patterns import prop_block
+from tilecsp.connectivity import prop_connectivity, prop_reachability
+from tilecsp.satboard import SatSearch
+from tilecsp.repair import RepairSearch, solution_layouts
+from tilecsp.lns import LNSSearch
+from search.btsearch import BacktrackingSearch
+from search.probing import probe
+from search.estimate import estimate_search
+from search.transposition import TranspositionTable
+from csp.propagators import prop_BT, prop_fc, prop_gac, chain_propagators
+
+PROPAGATORS = {'BT': prop_BT, 'FC': prop_fc, 'GAC': prop_gac}
+
+MODELS = {'cell': TileBoard, 'edge': EdgeTileBoard, 'slot': SlotTileBoard}
+
+
+def puzzle_from_spec(spec):
+    """
+    Decode a puzzle spec into the arguments used to build a TileBoard
+
+    :param spec: Puzzle spec (see module description)
+    :type spec: dict
+    :return: Tile counts by tile class, set of terminal nodes, dimension
+    :rtype: (dict[type, int], set[((int, int), str)], int)
+    """
+    try:
+        num_tiles = {TILE_TYPES[name]: count
+                     for name, count in spec['tiles'].items()}
+    except KeyError as e:
+        raise ValueError("Unknown tile type {}".format(e))
+    terminal_nodes = {((x, y), edge)
+                      for x, y, edge in spec.get('terminals', ())}
+    return num_tiles, terminal_nodes, spec.get('dim', 3)
+
+
+def spec_from_puzzle(num_tiles, terminal_nodes, dim, **fields):
+    """
+    Encode a puzzle as a (JSON serializable) spec. Any additional fields are
+    copied into the spec.
+
+    :type num_tiles: dict[type, int]
+    :type terminal_nodes: set[((int, int), str)]
+    :type dim: int
+    :rtype: dict
+    """
+    spec = dict(fields)
+    spec['dim'] = dim
+    spec['tiles'] = {tile_type.__name__: count
+                     for tile_type, count in num_tiles.items()}
+    spec['terminals'] = sorted([x, y, edge]
+                               for (x, y), edge in terminal_nodes)
+    return spec
+
+
+def encode_solution(board):
+    """
+    :type board: TileBoard
+    :return: Rows of [tile class name, road edges] for each cell
+    :rtype: list[list[list[str]]]
+    """
+    return [[[type(tile).__name__,
+              "".join(e for e in Tile.EDGES if tile.has_edge(e))]
+             for tile in row]
+            for row in board.get_solution_grid()]
+
+
+def build_spec(spec, propagator='FC'):
+    """
+    Build the board for the puzzle described by spec, and choose its
+    propagator.
+
+    :param spec: Puzzle spec (see module description)
+    :type spec: dict
+    :param propagator: Name of the propagator to use if the spec doesn't
+        specify one
+    :type propagator: str
+    :rtype: (CSP, function)
+    """
+    num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+    prop = PROPAGATORS[spec.get('propagator', propagator).upper()]
+    model = MODELS[spec.get('model', 'cell').lower()]
+    if model is not TileBoard:
+        prop = chain_propagators(prop, prop_pigeonhole)
+    if spec.get('block'):
+        if model is not TileBoard:
+            raise ValueError("Block lookahead needs the cell model")
+        prop = chain_propagators(prop, prop_block)
+    if spec.get('connectivity'):
+        if model is not TileBoard:
+            raise ValueError("Road connectivity needs the cell model")
+        prop = chain_propagators(prop, prop_connectivity)
+    if spec.get('reachability'):
+        if model is not TileBoard:
+            raise ValueError("Road reachability needs the cell model")
+        prop = chain_propagators(prop, prop_reachability)
+    board = model(str(spec.get('id', 'Batch puzzle')),
+                  create_tiles(num_tiles), terminal_nodes, dim)
+    return board, prop
+
+
+def solve_spec(spec, propagator='FC'):
+    """
+    Build and solve the puzzle described by spec.
+
+    :param spec: Puzzle spec (see module description)
+    :type spec: dict
+    :param propagator: Name of the propagator to use if the spec doesn't
+        specify one
+    :type propagator: str
+    :return: Result record (see module description)
+    :rtype: dict
+    """
+    result = {'id': spec.get('id')}
+    try:
+        start = time.perf_counter()
+        board, prop = build_spec(spec, propagator)
+        if spec.get('probe'):
+            probed = probe(board, prop, time_limit=float(spec['probe']))
+        if spec.get('estimate'):
+            estimate = estimate_search(board, prop, int(spec['estimate']),
+                                       seed=spec.get('seed'))
+            result['status'] = 'estimated'
+            result['estimate'] = estimate._asdict()
+            result['stats'] = {'wall_time': time.perf_counter() - start}
+            return result
+        engine = spec.get('engine', 'search').lower()
+        if (spec.get('connectivity') or spec.get('reachability')) and \
+                engine != 'search':
+            raise ValueError("Road connectivity needs the search engine")
+        if engine == 'sat':
+            if type(board) is not TileBoard:
+                raise ValueError("The SAT engine needs the cell model")
+            solver = SatSearch(board)
+            solved = solver.solve(spec.get('max_conflicts'),
+                                  spec.get('max_decisions'))
+        elif engine == 'lns':
+            if type(board) is not TileBoard:
+                raise ValueError("The LNS engine needs the cell model")
+            solver = LNSSearch(board, prop, seed=spec.get('seed'))
+            layouts = None
+            if spec.get('previous') is not None:
+                layouts = solution_layouts(spec['previous'],
+                                           board.dimensions)
+            solved = solver.solve(layouts, spec.get('max_decisions'),
+                                  float(spec.get('time_limit', 10)))
+        elif engine == 'search' and spec.get('previous') is not None:
+            if type(board) is not TileBoard:
+                raise ValueError("Repairing a solution needs the cell model")
+            solver = RepairSearch(board, prop)
+            solved = solver.solve(
+                solution_layouts(spec['previous'], board.dimensions),
+                spec.get('max_decisions'))
+        elif engine == 'search':
+            solver = BacktrackingSearch(board, logging.WARNING,
+                                        verbose=False)
+            solved = solver.bt_search(prop, spec.get('max_decisions'))
+        else:
+            raise ValueError("Unknown engine {}".format(engine))
+        result['status'] = 'solved' if solved else \
+            'unsolvable' if solved is not None else 'interrupted'
+        if solved:
+            result['solution'] = encode_solution(board)
+        result['stats'] = solver.get_stats()
+        if spec.get('probe'):
+            result['stats']['probe'] = probed._asdict()
+        result['stats']['wall_time'] = time.perf_counter() - start
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def count_spec(spec, propagator='FC'):
+    """
+    Build the puzzle described by spec and count its solutions, counting
+    layouts which only differ in interchangeable tiles once (see
+    BacktrackingSearch.bt_count and layout_key).
+
+    :return: Result record with status "counted" (and a "count"),
+        "interrupted" (after the spec's max_decisions) or "error"
+    :rtype: dict
+    """
+    result = {'id': spec.get('id')}
+    try:
+        start = time.perf_counter()
+        board, prop = build_spec(spec, propagator)
+        state_key = table = None
+        if (spec.get('connectivity') or spec.get('reachability')) and \
+                (spec.get('memo') or spec.get('components')):
+            # Their search states don't hold the road network
+            raise ValueError("Road connectivity can't be counted with memo "
+                             "or components")
+        if spec.get('memo'):
+            if type(board) is not TileBoard:
+                raise ValueError("Memoized counting needs the cell model")
+            state_key = FrontierKey(board, interchangeable=True)
+            table = TranspositionTable(int(spec['memo']),
+                                       spec.get('memo_replacement', 'lru'))
+        decompose = None
+        if spec.get('components'):
+            if type(board) is not TileBoard:
+                raise ValueError("Component counting needs the cell model")
+            decompose = BoardComponents(board, interchangeable=True)
+        solver = BacktrackingSearch(board, logging.WARNING, verbose=False)
+        count = solver.bt_count(prop, spec.get('max_decisions'),
+                                value_key=layout_key, state_key=state_key,
+                                table=table, decompose=decompose)
+        result['status'] = 'counted' if count is not None else 'interrupted'
+        result['count'] = count
+        result['stats'] = solver.get_stats()
+        result['stats']['wall_time'] = time.perf_counter() - start
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def check_solution(board, solution):
+    """
+    Check a solution (as given by encode_solution) of a TileBoard. Tiles of
+    the same class and edges are interchangeable, so each cell is assigned
+    any unused tile which matches. The board is left unassigned.
+
+    :type board: TileBoard
+    :type solution: list[list[list[str]]]
+    :return: None if the solution is valid, or the reason it isn't
+    :rtype: str
+    """
+    dim = board.dimensions
+    if len(solution) != dim or any(len(row) != dim for row in solution):
+        return "Solution is not a {0}x{0} grid".format(dim)
+    used = set()
+    try:
+        for var in board.cells:
+            name, edges = solution[var.y_pos][var.x_pos]
+            mask = sum(EDGE_BITS[e] for e in edges)
+            tile = next((t for t in var.get_cur_domain()
+                         if type(t).__name__ == name and
+                         t.edge_mask == mask and t.id not in used), None)
+            if tile is None:
+                return "No {} tile with edges '{}' fits cell ({}, {})" \
+                    .format(name, edges, var.x_pos, var.y_pos)
+            used.add(tile.id)
+            var.assign(tile)
+        for c in board.get_all_cons():
+            if not c.check():
+                return "Constraint {} is violated".format(c.name)
+        return None
+    finally:
+        for var in board.cells:
+            if var.is_assigned():
+                var.unassign()
+
+
+def validate_spec(spec):
+    """
+    Check that spec describes a puzzle, and whether it is known to be
+    infeasible (see CSP.infeasible_reason). If the spec has a "solution"
+    (as in results), check it (on the cell model).
+
+    :return: Result record with status "valid", "invalid" (and a "reason")
+        or "error"
+    :rtype: dict
+    """
+    result = {'id': spec.get('id')}
+    try:
+        if 'solution' in spec:
+            num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+            board = TileBoard(str(spec.get('id', 'Batch puzzle')),
+                              create_tiles(num_tiles), terminal_nodes, dim)
+            reason = check_solution(board, spec['solution'])
+        else:
+            board, prop = build_spec(spec)
+            reason = board.infeasible_reason
+        result['status'] = 'valid' if reason is None else 'invalid'
+        if reason is not None:
+            result['reason'] = reason
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def solve_chunk(chunk, propagator='FC'):
+    """
+    Solve a chunk of puzzles (executed in a worker process)
+
+    :param chunk: Sequence of (line number, spec) pairs
+    :type chunk: list[(int, dict)]
+    :rtype: list[dict]
+    """
+    results = []
+    for line_no, spec in chunk:
+        result = solve_spec(spec, propagator)
+        result['line'] = line_no
+        results.append(result)
+    return results
+
+
+def read_specs(lines):
+    """
+    Lazily parse JSON puzzle specs from an iterable of lines. Blank lines are
+    skipped; lines that fail to parse are yielded as their error message.
+
+    :type lines: Iterable[str]
+    :return: Generator of (line number, spec or error message) pairs
+    """
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, "Invalid JSON: {}".format(e)
+
+
+def chunked(iterable, size):
+    """ Group iterable into lists of (at most) size elements """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def solve_stream(lines, propagator='FC', workers=None, chunksize=16):
+    """
+    Solve all puzzle specs in lines, spread over a pool of worker processes.
+    Input is consumed lazily, with a bounded number of chunks in flight.
+
+    :param lines: JSON lines, one puzzle spec per line
+    :type lines: Iterable[str]
+    :param propagator: Default propagator name
+    :type propagator: str
+    :param workers: Number of worker processes (None = number of CPUs,
+        0 = solve in this process)
+    :type workers: int
+    :param chunksize: Number of puzzles sent to a worker at a time
+    :type chunksize: int
+    :return: Generator of result records, in order of completion
+    """
+    def split_errors(chunk):
+        specs, errors = [], []
+        for line_no, spec in chunk:
+            if isinstance(spec, dict):
+                specs.append((line_no, spec))
+            else:
+                errors.append({'id': None, 'status': 'error',
+                               'error': str(spec), 'line': line_no})
+        return specs, errors
+
+    chunks = chunked(read_specs(lines), chunksize)
+    if workers == 0:
+        for chunk in chunks:
+            specs, errors = split_errors(chunk)
+            yield from errors
+            yield from solve_chunk(specs, propagator)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = 4 * workers
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            specs, errors = split_errors(chunk)
+            yield from errors
+            pending.add(executor.submit(solve_chunk, specs, propagator))
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield from future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Solve tile puzzles given as JSON lines")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSONL file of puzzle specs (default: stdin)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="JSONL file for results (default: stdout)")
+    parser.add_argument('-p', '--propagator', default='FC',
+                        choices=sorted(PROPAGATORS),
+                        help="Default propagator (default: FC)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Worker processes (default: CPU count, "
+                             "0: no pool)")
+    parser.add_argument('-c', '--chunksize', type=int, default=16,
+                        help="Puzzles per task sent to a worker")
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for result in solve_stream(infile, args.propagator, args.workers,
+                                   args.chunksize):
+            outfile.write(json.dumps(result) + "\n")
+            outfile.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
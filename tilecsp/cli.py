@@ -0,0 +1,256 @@
+"""
+Command line entry point for solving, counting, benchmarking and generating
+tile puzzles.
+
+    python3 -m tilecsp.cli solve --dim 3 --tiles CornerTile=4,TTile=4,LineTile=1 \\
+        --terminals 0,2,w 2,0,n
+    python3 -m tilecsp.cli solve puzzles.jsonl --block
+    python3 -m tilecsp.cli count --dim 4 --tiles CornerTile=8,LineTile=8 --mitm
+    python3 -m tilecsp.cli count puzzles.jsonl --memo 100000
+    python3 -m tilecsp.cli generate -n 10 --dim 4
+    python3 -m tilecsp.cli bench -f corners
+
+solve and count take puzzle specs as JSON lines (see tilecsp.batch) from a
+file or stdin, or a single puzzle from --dim, --tiles and --terminals, and
+print one JSON result per puzzle. generate and bench pass their remaining
+arguments on to tilecsp.generator and benchmark.harness.
+
+Startup is kept short for one-off solves: nothing beyond the standard
+library is imported until a subcommand runs, and then only the modules it
+needs; compiled tables are loaded from a disk cache (see tilecsp.tablecache)
+in --cache-dir. --timings reports, on stderr, the CPU time spent before the
+entry point ran (interpreter startup), the time spent importing the solver
+modules, and the time spent on the command itself.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'tilecsp')
+
+
+# Spec fields which may be given as options (see tilecsp.batch)
+_SPEC_FIELDS = ('propagator', 'model', 'engine', 'max_decisions',
+                'time_limit', 'memo', 'memo_replacement', 'components')
+
+
+def _spec_from_args(args):
+    """
+    :return: Puzzle spec given by the --dim, --tiles and --terminals options
+    :rtype: dict
+    """
+    tiles = {}
+    for item in args.tiles.split(','):
+        name, _, count = item.partition('=')
+        tiles[name.strip()] = int(count or 1)
+    terminals = []
+    for terminal in args.terminals:
+        x, y, edge = terminal.split(',')
+        terminals.append([int(x), int(y), edge.strip()])
+    spec = {'id': 'cli', 'dim': args.dim, 'tiles': tiles,
+            'terminals': terminals}
+    for field in _SPEC_FIELDS:
+        if getattr(args, field, None) is not None:
+            spec[field] = getattr(args, field)
+    if args.block:
+        spec['block'] = True
+    if args.connectivity:
+        spec['connectivity'] = True
+    if args.reachability:
+        spec['reachability'] = True
+    return spec
+
+
+def _read_specs(args):
+    """ :return: Generator of (line number, spec or error message) pairs """
+    from tilecsp.batch import read_specs
+
+    if args.tiles is not None:
+        yield 1, _spec_from_args(args)
+        return
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        for line_no, spec in read_specs(infile):
+            if isinstance(spec, dict):
+                for field in _SPEC_FIELDS:
+                    if getattr(args, field, None) is not None:
+                        spec.setdefault(field, getattr(args, field))
+                if args.block:
+                    spec.setdefault('block', True)
+                if args.connectivity:
+                    spec.setdefault('connectivity', True)
+                if args.reachability:
+                    spec.setdefault('reachability', True)
+            yield line_no, spec
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+
+
+def _count_mitm(spec):
+    """ Count layouts with tilecsp.mitm (as count_spec) """
+    from tilecsp.batch import puzzle_from_spec
+    from tilecsp.mitm import count_layouts
+    from tilecsp.tileboard import create_tiles
+
+    result = {'id': spec.get('id')}
+    try:
+        start = time.perf_counter()
+        if spec.get('connectivity') or spec.get('reachability'):
+            raise ValueError("Road connectivity can't be counted with mitm")
+        num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+        result['count'] = count_layouts(create_tiles(num_tiles),
+                                        terminal_nodes, dim)
+        result['status'] = 'counted'
+        result['stats'] = {'wall_time': time.perf_counter() - start}
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def run_puzzles(args, timings):
+    """ Solve or count each puzzle, printing results as JSON lines """
+    start = time.perf_counter()
+    from tilecsp.batch import count_spec, solve_spec
+    timings['imports'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.command == 'solve':
+        run = solve_spec
+    else:
+        run = _count_mitm if args.mitm else count_spec
+    failed = False
+    for line_no, spec in _read_specs(args):
+        if isinstance(spec, dict):
+            result = run(spec)
+        else:
+            result = {'id': None, 'status': 'error', 'error': spec}
+        result['line'] = line_no
+        failed = failed or result['status'] == 'error'
+        sys.stdout.write(json.dumps(result) + "\n")
+    timings['command'] = time.perf_counter() - start
+    return 1 if failed else 0
+
+
+def run_tool(args, timings):
+    """ Run the main function of tilecsp.generator or benchmark.harness """
+    start = time.perf_counter()
+    if args.command == 'generate':
+        from tilecsp.generator import main
+    else:
+        from benchmark.harness import main
+    timings['imports'] = time.perf_counter() - start
+    start = time.perf_counter()
+    status = main(args.args)
+    timings['command'] = time.perf_counter() - start
+    return status or 0
+
+
+def main(argv=None):
+    startup = time.process_time()
+    entry = time.perf_counter()
+
+    parser = argparse.ArgumentParser(
+        description="Solve, count, benchmark and generate tile puzzles")
+    parser.add_argument('--cache-dir',
+                        default=os.environ.get('TILECSP_CACHE_DIR',
+                                               DEFAULT_CACHE_DIR),
+                        help="Directory of compiled tables (default: "
+                             "{})".format(DEFAULT_CACHE_DIR))
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't load or store compiled tables")
+    parser.add_argument('--timings', action='store_true',
+                        help="Report startup, import and command times on "
+                             "stderr")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('solve', "Solve puzzles"),
+                            ('count', "Count the solutions of puzzles")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('input', nargs='?', default='-',
+                             help="JSONL file of puzzle specs (default: "
+                                  "stdin)")
+        command.add_argument('-d', '--dim', type=int, default=3)
+        command.add_argument('--tiles', default=None,
+                             help="Tile counts of a single puzzle, e.g. "
+                                  "CornerTile=4,TTile=4,LineTile=1")
+        command.add_argument('--terminals', nargs='*', default=[],
+                             help="Terminal nodes of the puzzle, as x,y,edge")
+        command.add_argument('-p', '--propagator', default=None,
+                             help="BT, FC or GAC (default: FC)")
+        command.add_argument('-m', '--model', default=None,
+                             help="cell, edge or slot (default: cell)")
+        command.add_argument('--max-decisions', type=int, default=None)
+        command.add_argument('--block', action='store_true',
+                             help="Also prune with the 2x2 block pattern "
+                                  "database")
+        command.add_argument('--connectivity', action='store_true',
+                             help="Only accept layouts whose roads all "
+                                  "belong to the network linking the "
+                                  "terminals")
+        command.add_argument('--reachability', action='store_true',
+                             help="As --connectivity, also pruning tiles "
+                                  "with roads that can't be reached from "
+                                  "the terminals")
+        if name == 'solve':
+            command.add_argument('-e', '--engine', default=None,
+                                 choices=('search', 'sat', 'lns'),
+                                 help="Backtracking search, the CDCL SAT "
+                                      "solver or large-neighbourhood search "
+                                      "(default: search)")
+            command.add_argument('--time-limit', type=float, default=None,
+                                 help="Seconds before the lns engine gives "
+                                      "up (default: 10)")
+        if name == 'count':
+            command.add_argument('--mitm', action='store_true',
+                                 help="Count with meet-in-the-middle "
+                                      "enumeration (tilecsp.mitm)")
+            command.add_argument('--memo', type=int, default=None,
+                                 help="Keep the counts of search states in "
+                                      "a transposition table of at most "
+                                      "this many entries")
+            command.add_argument('--memo-replacement', default=None,
+                                 choices=('lru', 'depth'),
+                                 help="Entry to replace when the table is "
+                                      "full (default: lru)")
+            command.add_argument('--components', action='store_const',
+                                 const=True, default=None,
+                                 help="Count the components into which the "
+                                      "unassigned cells split separately")
+
+    for name, help_text in (('generate', "Generate puzzles (see "
+                                         "tilecsp.generator)"),
+                            ('bench', "Run the benchmarks (see "
+                                      "benchmark.harness)")):
+        commands.add_parser(name, help=help_text, add_help=False)
+
+    # The arguments of generate and bench are left for their own parsers
+    args, args.args = parser.parse_known_args(argv)
+    if args.args and args.command not in ('generate', 'bench'):
+        parser.error("unrecognized arguments: {}".format(" ".join(args.args)))
+
+    if not args.no_cache:
+        from tilecsp.tablecache import set_cache_dir
+        set_cache_dir(args.cache_dir)
+
+    timings = {'startup_cpu': startup}
+    try:
+        if args.command in ('solve', 'count'):
+            status = run_puzzles(args, timings)
+        else:
+            status = run_tool(args, timings)
+    except BrokenPipeError:
+        status = 0
+    if args.timings:
+        timings['total'] = time.perf_counter() - entry
+        print(json.dumps({'timings': timings}), file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
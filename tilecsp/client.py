@@ -0,0 +1,158 @@
+"""
+Client for the puzzle service (see tilecsp.server), with a load test.
+
+    client = ServiceClient('127.0.0.1', 8080)
+    status, result = client.solve({"dim": 2, "tiles": {"CornerTile": 4}})
+
+The load test sends puzzle specs (JSON lines, e.g. from tilecsp.generator)
+to an endpoint over a number of concurrent connections, and reports
+throughput, latency percentiles and the server's counters as JSON.
+
+To run:
+    python3 -m tilecsp.generator -n 500 --dim 4 --no-solution > p.jsonl
+    python3 -m tilecsp.client p.jsonl --port 8080 -c 16
+    python3 -m tilecsp.client --generate 200 --dim 3 --repeat 4
+"""
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import json
+import sys
+import threading
+import time
+
+
+class ServiceClient:
+    """
+    Sends requests to the puzzle service over one keep-alive connection (so
+    an instance should only be used by one thread at a time).
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, timeout=None):
+        self.connection = http.client.HTTPConnection(host, port,
+                                                     timeout=timeout)
+
+    def request(self, method, path, body=None):
+        """
+        :return: HTTP status; JSON response
+        :rtype: (int, dict)
+        """
+        data = None if body is None else json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json'} if data else {}
+        try:
+            self.connection.request(method, path, data, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # Reconnect once (e.g. the server closed an idle connection)
+            self.connection.close()
+            self.connection.request(method, path, data, headers)
+            response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def solve(self, spec):
+        return self.request('POST', '/solve', spec)
+
+    def count(self, spec):
+        return self.request('POST', '/count', spec)
+
+    def validate(self, spec):
+        return self.request('POST', '/validate', spec)
+
+    def stats(self):
+        return self.request('GET', '/stats')[1]
+
+    def close(self):
+        self.connection.close()
+
+
+def percentile(values, fraction):
+    """ :param values: Sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_test(specs, endpoint='/solve', host='127.0.0.1', port=8080,
+              concurrency=8):
+    """
+    Send every spec to endpoint, over concurrency connections.
+
+    :type specs: Iterable[dict]
+    :type endpoint: str
+    :type concurrency: int
+    :return: Summary (JSON serializable)
+    :rtype: dict
+    """
+    local = threading.local()
+
+    def send(spec):
+        if not hasattr(local, 'client'):
+            local.client = ServiceClient(host, port)
+        start = time.perf_counter()
+        status, result = local.client.request('POST', endpoint, spec)
+        return time.perf_counter() - start, status, result.get('status')
+
+    latencies = []
+    http_statuses = collections.Counter()
+    statuses = collections.Counter()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for latency, http_status, status in executor.map(send, specs):
+            latencies.append(latency)
+            http_statuses[http_status] += 1
+            statuses[status] += 1
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {'requests': len(latencies),
+            'seconds': elapsed,
+            'requests_per_second': len(latencies) / elapsed
+            if elapsed else 0.0,
+            'latency': {'p50': percentile(latencies, 0.5),
+                        'p90': percentile(latencies, 0.9),
+                        'p99': percentile(latencies, 0.99),
+                        'max': latencies[-1] if latencies else None},
+            'http_statuses': {str(k): v for k, v in http_statuses.items()},
+            'statuses': dict(statuses),
+            'server': ServiceClient(host, port).stats()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the puzzle service")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSONL file of puzzle specs (default: stdin)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-e', '--endpoint', default='solve',
+                        choices=('solve', 'count', 'validate'))
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Send each spec this many times (identical "
+                             "requests may be coalesced)")
+    parser.add_argument('--generate', type=int, default=None,
+                        help="Generate this many puzzles instead of reading "
+                             "specs")
+    parser.add_argument('-d', '--dim', type=int, default=3,
+                        help="Dimension of generated puzzles")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.generate is not None:
+        from tilecsp.batch import spec_from_puzzle
+        from tilecsp.generator import generate_puzzles
+        specs = [spec_from_puzzle(p.num_tiles, p.terminal_nodes, p.dim, id=i)
+                 for i, p in enumerate(generate_puzzles(
+                     args.generate, args.seed, dim=args.dim))]
+    else:
+        infile = sys.stdin if args.input == '-' else open(args.input)
+        with infile:
+            specs = [json.loads(line) for line in infile if line.strip()]
+    specs = [spec for spec in specs for _ in range(args.repeat)]
+    summary = load_test(specs, '/' + args.endpoint, args.host, args.port,
+                        args.concurrency)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
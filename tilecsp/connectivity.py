@@ -0,0 +1,273 @@
+"""
+Road connectivity for TileBoards.
+
+The road network of a (partially) assigned board is tracked incrementally
+with a union-find over road endpoints. There is one node per grid edge of
+the board's BoardTemplate; an assigned tile joins the nodes of its edges
+along each of its internal paths (Tile.paths). Each component counts its
+terminal nodes and its open ends (road edges whose neighbouring cell is
+still unassigned), so a component whose last open end is closed can be
+checked immediately.
+
+On boards with terminal nodes, every road must belong to the network
+linking all of the terminals. A closed component that does not contain
+every terminal (a stray closed loop, or terminals closed off from the rest)
+is a dead-end. Boards without terminals are not constrained. This is a
+stricter rule than the board's own constraints, which accept stray loops;
+puzzles from tilecsp.generator always have a layout without them. In puzzle
+specs, these propagators are enabled by "connectivity" and "reachability"
+(see tilecsp.batch).
+
+prop_reachability goes further, over the whole partially assigned board:
+each unassigned cell is treated as the union of the roads and paths of the
+tiles still in its domain. Roads that cannot be reached from the terminals
+through these possible roads can never be part of the network, so tiles
+with such roads are pruned, and unreachable terminals are a dead-end.
+
+Use these propagators after another propagator, e.g.
+
+    solver.bt_search(chain_propagators(prop_fc, prop_connectivity))
+    solver.bt_search(chain_propagators(prop_fc, prop_reachability))
+"""
+import collections
+
+from tilecsp.tileboard import *
+
+# For each edge position, the other edge positions on the same tile with the
+# PATH_BITS flag of the path between them
+_LINKED_EDGES = tuple(
+    tuple((j, PATH_BITS[frozenset((e, other))])
+          for j, other in enumerate(Tile.EDGES) if other != e)
+    for e in Tile.EDGES)
+
+
+class RoadNetwork:
+    """
+    Backtrackable union-find over the road endpoints (grid edges) of a board.
+
+    Union by size without path compression keeps every change a plain array
+    write, recorded on a trail so that assignments can be undone in
+    reverse order.
+    """
+
+    def __init__(self, template):
+        """
+        :type template: BoardTemplate
+        """
+        self.template = template
+        num_edges = template.num_edges
+        self.parent = list(range(num_edges))
+        self.size = [1] * num_edges
+        # Number of open ends and of terminal nodes, valid at roots only
+        self.open = [0] * num_edges
+        self.terminals = [0] * num_edges
+        # Number of assigned tiles with a road on each grid edge
+        self.ends = [0] * num_edges
+        for cell, mask in enumerate(template.terminal_masks):
+            for i, e in enumerate(Tile.EDGES):
+                if mask & EDGE_BITS[e]:
+                    self.terminals[template.cell_edges[cell][i]] = 1
+        self.num_terminals = sum(self.terminals)
+        self.trail = []
+        # Stack of (variable, value, trail length before the assignment)
+        self.frames = []
+
+    def _set(self, array, i, value):
+        self.trail.append((array, i, array[i]))
+        array[i] = value
+
+    def find(self, node):
+        while self.parent[node] != node:
+            node = self.parent[node]
+        return node
+
+    def _union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self._set(self.parent, b, a)
+        self._set(self.size, a, self.size[a] + self.size[b])
+        self._set(self.open, a, self.open[a] + self.open[b])
+        self._set(self.terminals, a, self.terminals[a] + self.terminals[b])
+        return a
+
+    def undo(self, trail_length):
+        """ Undo all changes made since the trail had trail_length entries """
+        trail = self.trail
+        while len(trail) > trail_length:
+            array, i, value = trail.pop()
+            array[i] = value
+
+    def sync(self):
+        """
+        Undo the assignments which the search has since undone (assignments
+        are undone in reverse order, so these are at the top of the stack).
+        """
+        frames = self.frames
+        while frames and frames[-1][0].get_assigned_value() is not \
+                frames[-1][1]:
+            self.undo(frames.pop()[2])
+
+    def assign(self, var, tile, cells):
+        """
+        Add the roads of tile, newly assigned to var, to the network.
+
+        :type var: GridVariable
+        :type tile: Tile
+        :param cells: The board's variables, by cell index
+        :type cells: Sequence[GridVariable]
+        :return: False iff a component was closed without containing every
+            terminal node
+        :rtype: bool
+        """
+        self.frames.append((var, tile, len(self.trail)))
+        cell = var.index
+        cell_edges = self.template.cell_edges[cell]
+        neighbors = self.template.neighbors[cell]
+        touched = []
+        for i, e in enumerate(Tile.EDGES):
+            if not tile.has_edge(e):
+                continue
+            node = cell_edges[i]
+            self._set(self.ends, node, self.ends[node] + 1)
+            neighbor = neighbors[i]
+            if neighbor >= 0:
+                root = self.find(node)
+                if not cells[neighbor].is_assigned():
+                    self._set(self.open, root, self.open[root] + 1)
+                elif self.ends[node] == 2:
+                    self._set(self.open, root, self.open[root] - 1)
+            touched.append(node)
+        for path in tile.paths:
+            e1, e2 = tuple(path)
+            self._union(cell_edges[Tile.EDGES.index(e1)],
+                        cell_edges[Tile.EDGES.index(e2)])
+
+        if not self.num_terminals:
+            return True
+        for root in {self.find(node) for node in touched}:
+            if self.open[root] == 0 and \
+                    self.terminals[root] != self.num_terminals:
+                return False
+        return True
+
+
+def prop_connectivity(csp, new_var=None):
+    """
+    Check road connectivity (see module description) after each assignment.
+    Prunes nothing; returns False when the newly assigned tile closes a road
+    component that doesn't link every terminal node.
+
+    :param csp: TileBoard instance
+    :type csp: TileBoard
+    :param new_var: Optional new variable
+    :type new_var: GridVariable
+    :return: False if a dead end has been detected and True otherwise; List
+        of variable/value pairs which were pruned (always empty)
+    :rtype: bool, list[(Variable, object)]
+    """
+    if new_var is None:
+        # New search: start from an empty network
+        csp.road_network = RoadNetwork(csp.template)
+        return True, []
+    network = csp.road_network
+    network.sync()
+    if not isinstance(new_var, GridVariable):
+        # e.g. a RoadVariable of an EdgeTileBoard: no tile placed
+        return True, []
+    return network.assign(new_var, new_var.get_assigned_value(),
+                          csp.cells), []
+
+
+def reachable_edges(csp):
+    """
+    Find the grid edges which can be reached by road from the board's first
+    terminal, treating each unassigned cell as having every road and path of
+    the tiles in its current domain.
+
+    :type csp: TileBoard
+    :return: Reachability of each grid edge (by index), and each cell's
+        possible road edge mask
+    :rtype: (list[bool], list[int])
+    """
+    template = csp.template
+    road_masks, path_masks = [], []
+    for var in csp.cells:
+        roads = paths = 0
+        for tile in var.get_cur_domain():
+            roads |= tile.edge_mask
+            paths |= tile.path_mask
+        road_masks.append(roads)
+        path_masks.append(paths)
+
+    # A grid edge can carry a road iff all the cells it belongs to can have
+    # a road there, and it is internal or a terminal
+    usable = [all(road_masks[cell] & EDGE_BITS[Tile.EDGES[i]]
+                  for cell, i in cells) and
+              (len(cells) == 2 or
+               template.terminal_masks[cells[0][0]] &
+               EDGE_BITS[Tile.EDGES[cells[0][1]]])
+              for cells in template.edge_cells]
+
+    reached = [False] * template.num_edges
+    start = next((cell_edges[i]
+                  for cell, cell_edges in enumerate(template.cell_edges)
+                  for i, e in enumerate(Tile.EDGES)
+                  if template.terminal_masks[cell] & EDGE_BITS[e]), None)
+    if start is None or not usable[start]:
+        return reached, road_masks
+    reached[start] = True
+    queue = collections.deque([start])
+    while queue:
+        edge = queue.popleft()
+        for cell, i in template.edge_cells[edge]:
+            paths = path_masks[cell]
+            for j, bit in _LINKED_EDGES[i]:
+                other = template.cell_edges[cell][j]
+                if paths & bit and usable[other] and not reached[other]:
+                    reached[other] = True
+                    queue.append(other)
+    return reached, road_masks
+
+
+def prop_reachability(csp, new_var=None):
+    """
+    Prune tiles with roads that cannot be reached from the terminals (see
+    module description), repeating until nothing more is pruned. Returns
+    False if a terminal, or a road of an assigned tile, cannot be reached.
+
+    :param csp: TileBoard instance
+    :type csp: TileBoard
+    :param new_var: Optional new variable
+    :type new_var: GridVariable
+    :return: False if a dead end has been detected and True otherwise; List
+        of variable/value pairs which were pruned
+    :rtype: bool, list[(Variable, object)]
+    """
+    template = csp.template
+    if not template.terminal_nodes:
+        return True, []
+    pruned = []
+    while True:
+        reached, road_masks = reachable_edges(csp)
+        num_pruned = len(pruned)
+        for var in csp.cells:
+            cell_edges = template.cell_edges[var.index]
+            reachable = edge_mask(e for i, e in enumerate(Tile.EDGES)
+                                  if reached[cell_edges[i]])
+            if template.terminal_masks[var.index] & ~reachable:
+                return False, pruned
+            if not road_masks[var.index] & ~reachable:
+                continue
+            if var.is_assigned():
+                return False, pruned
+            for tile in var.get_cur_domain():
+                if tile.edge_mask & ~reachable:
+                    var.prune_value(tile)
+                    pruned.append((var, tile))
+            if var.get_cur_domain_size() == 0:
+                return False, pruned
+        if len(pruned) == num_pruned:
+            return True, pruned
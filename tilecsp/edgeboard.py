@@ -0,0 +1,127 @@
+"""
+Edge-variable (dual) model of a tile board.
+
+EdgeTileBoard extends the cell model of TileBoard with one boolean
+RoadVariable per internal grid edge, True iff a road crosses that edge.
+Channeling constraints link each RoadVariable to the two cells it separates:
+a cell's tile has a road on the edge iff the road variable is True.
+
+Road variables have a domain of 2, so a minimum-remaining-values search
+branches on roads first: each decision settles one edge for both of its
+cells, and once the roads around a cell are decided, forward checking
+through the channeling constraints leaves only the tiles with exactly those
+roads. Cells are then assigned from these (small) domains.
+
+The cell model's constraints are kept, so any propagator works on either
+model. Since cells are assigned late, all-diff conflicts (too few tiles of a
+kind for the roads chosen) are only found deep in the search unless
+prop_pigeonhole is run as well:
+
+    board = EdgeTileBoard("p1", create_tiles(num_tiles), terminal_nodes, 4)
+    solver.bt_search(chain_propagators(prop_fc, prop_pigeonhole))
+"""
+import collections
+
+from tilecsp.tileboard import *
+
+
+# False first: most grid edges of a board carry no road
+_ROAD_VALUES = ValueTable((False, True))
+
+
+class RoadVariable(Variable):
+    """
+    Boolean variable for an internal grid edge: True iff a road crosses it
+
+    Attributes:
+
+        edge:   int, grid edge index in the board's BoardTemplate
+        cells:  (cell, neighbour) cell indices on either side of the edge
+    """
+    __slots__ = ('edge', 'cells')
+
+    def __init__(self, name, edge, cells):
+        super().__init__(name, (False, True), _ROAD_VALUES)
+        self.edge = edge
+        self.cells = cells
+
+
+def channel_constraint(var_map, var, edge):
+    """
+    Channeling constraint between the cell variable var and the road
+    variable of one of its edges
+
+    :param var_map: Dictionary of variables mapped to assigned values
+    :type var_map: dict[Variable, Tile | bool]
+    :param var: The cell variable
+    :param edge: Edge of var's tile which the road variable stands for
+    :return: True iff var's tile has a road on edge exactly when the road
+        variable is True
+    :rtype: bool
+    """
+    assert len(var_map) == 2
+    road = next(r for v, r in var_map.items() if v is not var)
+    return var_map[var].has_edge(edge) == road
+
+
+class EdgeTileBoard(TileBoard):
+    """
+    TileBoard with additional road variables (see module description)
+
+    Attributes:
+
+        roads:  tuple of RoadVariables, one per pair of adjacent cells (in
+                template.pairs order)
+    """
+
+    def __init__(self, name, tiles, terminal_nodes, dim=3):
+        super().__init__(name, tiles, terminal_nodes, dim)
+        roads = []
+        for cell, neighbor, edge in self.template.pairs:
+            x, y = self.template.coords[cell]
+            road = RoadVariable(
+                'R{}{}'.format((x, y), edge),
+                self.template.cell_edges[cell][Tile.EDGES.index(edge)],
+                (cell, neighbor))
+            self.add_var(road)
+            self._add_channel_constraint(self.cells[cell], road, edge)
+            self._add_channel_constraint(self.cells[neighbor], road,
+                                         OPPOSITE_EDGES[edge])
+            roads.append(road)
+        self.roads = tuple(roads)
+
+    def _add_channel_constraint(self, var, road, edge):
+        self.add_constraint(
+            Constraint("Channel {} {}".format(var.name, road.name),
+                       (var, road),
+                       functools.partial(channel_constraint,
+                                         var=var,
+                                         edge=edge),
+                       'channel'))
+
+
+def prop_pigeonhole(csp, new_var=None):
+    """
+    Pigeonhole check over the all-diff constraints of a board (any constraint
+    of kind 'all-diff' over values with tile IDs, as in TileBoard and
+    SlotTileBoard): unassigned variables whose current domains hold the same
+    set of tile IDs need as many distinct tiles, so there can be no more of
+    them than IDs in the set. Prunes nothing.
+
+    :param csp: Board instance
+    :type csp: CSP
+    :param new_var: Optional new variable
+    :type new_var: Variable
+    :return: False if a dead end has been detected and True otherwise; List
+        of variable/value pairs which were pruned (always empty)
+    :rtype: bool, list[(Variable, object)]
+    """
+    for constraint in csp.get_all_cons():
+        if constraint.kind != 'all-diff':
+            continue
+        vars_by_ids = collections.Counter(
+            frozenset(value.id for value in var.get_cur_domain())
+            for var in constraint.scope_vars if not var.is_assigned())
+        if any(count > len(ids) for ids, count in vars_by_ids.items()):
+            return False, []
+    return True, []
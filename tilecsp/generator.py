@@ -0,0 +1,281 @@
+"""
+Random generation of solvable tile puzzles.
+
+A layout is generated directly: each grid edge gets a road bit (border edges
+only at terminals), dead ends and other shapes without a matching tile are
+repaired locally, and the tile at each cell is derived from its edges. On
+boards with terminals, roads which aren't part of the network linking the
+terminals (stray loops) are then removed, and layouts whose terminals aren't
+all linked are discarded, so that the generated layout also satisfies
+tilecsp.connectivity. The puzzle's inventory is the multiset of derived
+tiles, so every generated puzzle has at least one solution (the generated
+layout).
+
+To run:
+    python3 -m tilecsp.generator -n 1000 --dim 4 --terminals 2 > puzzles.jsonl
+"""
+import argparse
+import collections
+import json
+import random
+import sys
+
+from tilecsp.tileboard import *
+
+# Tile classes used by default (those not distinguished by internal paths)
+DEFAULT_TILE_TYPES = (EmptyTile, LineTile, CornerTile, TTile, CrossTile)
+
+Puzzle = collections.namedtuple('Puzzle',
+                                'num_tiles terminal_nodes dim solution')
+Puzzle.__doc__ = """
+A generated puzzle.
+
+    num_tiles:      dict of tile class to count (argument to create_tiles)
+    terminal_nodes: set of ((x, y), edge) terminal nodes
+    dim:            board dimension
+    solution:       dim x dim matrix (indexed [y][x]) of
+                    (tile class, orientation) forming a solution
+"""
+
+
+def _orientations_by_mask(tile_types):
+    """
+    :type tile_types: Iterable[type]
+    :return: Edge mask mapped to the (tile class, orientation) pairs that
+        have exactly those edges
+    :rtype: dict[int, list[(type, int)]]
+    """
+    by_mask = collections.defaultdict(list)
+    for tile_type in tile_types:
+        for orientation in tile_type.ORIENTATIONS:
+            mask = edge_mask(tile_type.CONFIGURATIONS[orientation])
+            by_mask[mask].append((tile_type, orientation))
+    return dict(by_mask)
+
+
+def _border_edges(dim):
+    """ All ((x, y), edge) pairs on the border of a dim x dim board """
+    template = get_template(dim)
+    return [(xy, e)
+            for xy, border in zip(template.coords, template.border_masks)
+            for e in Tile.EDGES if border & EDGE_BITS[e]]
+
+
+def random_layout(template, by_mask, density, rng, max_repairs=None):
+    """
+    Generate edge masks for every cell of the template such that every cell's
+    mask is a key of by_mask, border edges have roads exactly at terminals,
+    and adjacent cells agree on the edges they share.
+
+    :type template: BoardTemplate
+    :param by_mask: Allowed edge masks (see _orientations_by_mask)
+    :type by_mask: dict[int, list]
+    :param density: Probability of a road across each internal edge
+    :type density: float
+    :type rng: random.Random
+    :param max_repairs: Maximum number of edge repairs before giving up
+    :return: Edge mask of each cell, or None if the layout could not be
+        repaired
+    :rtype: list[int]
+    """
+    masks = list(template.terminal_masks)
+    for cell, neighbor, e in template.pairs:
+        if rng.random() < density:
+            masks[cell] |= EDGE_BITS[e]
+            masks[neighbor] |= EDGE_BITS[OPPOSITE_EDGES[e]]
+
+    if max_repairs is None:
+        max_repairs = 20 * template.num_cells
+    queue = collections.deque(c for c in range(template.num_cells)
+                              if masks[c] not in by_mask)
+    while queue:
+        cell = queue.popleft()
+        if masks[cell] in by_mask:
+            continue
+        if max_repairs == 0:
+            return None
+        max_repairs -= 1
+        # Toggle one internal edge of the cell, preferring toggles which
+        # leave both the cell and the neighbour with valid masks
+        toggles = [(i, n) for i, n in enumerate(template.neighbors[cell])
+                   if n >= 0]
+        rng.shuffle(toggles)
+
+        def score(toggle):
+            i, n = toggle
+            bit, n_bit = EDGE_BITS[Tile.EDGES[i]], EDGE_BITS[Tile.EDGES[i - 2]]
+            return ((masks[cell] ^ bit) in by_mask) + \
+                ((masks[n] ^ n_bit) in by_mask)
+
+        i, n = max(toggles, key=score)
+        masks[cell] ^= EDGE_BITS[Tile.EDGES[i]]
+        masks[n] ^= EDGE_BITS[Tile.EDGES[i - 2]]
+        queue.append(cell)
+        queue.append(n)
+    return masks
+
+
+def connect_layout(template, cells, by_mask, rng):
+    """
+    Remove the roads which aren't part of the network linking the template's
+    terminals (as followed along the paths of each cell's tile), choosing
+    new tiles for the cells which lose roads.
+
+    :type template: BoardTemplate
+    :param cells: (tile class, orientation) of each cell, by cell index
+    :type cells: list[(type, int)]
+    :param by_mask: Allowed edge masks (see _orientations_by_mask)
+    :type by_mask: dict[int, list]
+    :type rng: random.Random
+    :return: (tile class, orientation) of each cell, or None if the
+        terminals aren't all linked, or a cell's remaining roads match no
+        tile
+    :rtype: list[(type, int)]
+    """
+    # Union-find over grid edges, joined along the paths of each tile
+    parent = list(range(template.num_edges))
+
+    def find(edge):
+        while parent[edge] != edge:
+            parent[edge] = parent[parent[edge]]
+            edge = parent[edge]
+        return edge
+
+    for cell, (tile_type, orientation) in enumerate(cells):
+        cell_edges = template.cell_edges[cell]
+        for path in tile_type(0, orientation).paths:
+            e1, e2 = tuple(path)
+            parent[find(cell_edges[Tile.EDGES.index(e1)])] = \
+                find(cell_edges[Tile.EDGES.index(e2)])
+
+    networks = {find(template.cell_edges[cell][i])
+                for cell, mask in enumerate(template.terminal_masks)
+                for i, e in enumerate(Tile.EDGES) if mask & EDGE_BITS[e]}
+    if len(networks) > 1:
+        return None
+    cells = list(cells)
+    for cell, (tile_type, orientation) in enumerate(cells):
+        roads = edge_mask(tile_type.CONFIGURATIONS[orientation])
+        mask = edge_mask(e for i, e in enumerate(Tile.EDGES)
+                         if roads & EDGE_BITS[e] and
+                         find(template.cell_edges[cell][i]) in networks)
+        if mask != roads:
+            if mask not in by_mask:
+                return None
+            cells[cell] = rng.choice(by_mask[mask])
+    return cells
+
+
+def generate_puzzle(dim=3, num_terminals=0, tile_types=DEFAULT_TILE_TYPES,
+                    density=0.5, rng=random, max_attempts=100):
+    """
+    Generate a random puzzle with a known solution.
+
+    :param dim: Board dimension
+    :type dim: int
+    :param num_terminals: Number of terminal nodes (on random border edges)
+    :type num_terminals: int
+    :param tile_types: Tile classes that may appear in the inventory
+    :type tile_types: Iterable[type]
+    :param density: Probability of a road across each internal edge, before
+        repairs (higher values give more T and cross tiles)
+    :type density: float
+    :param rng: Random number generator
+    :type rng: random.Random
+    :param max_attempts: Number of layouts to try before giving up
+    :type max_attempts: int
+    :rtype: Puzzle
+    """
+    by_mask = _orientations_by_mask(tile_types)
+    border_edges = _border_edges(dim)
+    if num_terminals > len(border_edges):
+        raise ValueError("A {0}x{0} board has only {1} border edges".format(
+            dim, len(border_edges)))
+
+    for _ in range(max_attempts):
+        terminal_nodes = set(rng.sample(border_edges, num_terminals))
+        template = get_template(dim, terminal_nodes)
+        masks = random_layout(template, by_mask, density, rng)
+        if masks is None:
+            continue
+        cells = [rng.choice(by_mask[mask]) for mask in masks]
+        if terminal_nodes:
+            cells = connect_layout(template, cells, by_mask, rng)
+            if cells is None:
+                continue
+        num_tiles = collections.Counter(t for t, o in cells)
+        solution = [cells[y * dim:(y + 1) * dim] for y in range(dim)]
+        return Puzzle(dict(num_tiles), terminal_nodes, dim, solution)
+    raise ValueError("Could not generate a {0}x{0} layout from tile types "
+                     "{1}".format(dim, [t.__name__ for t in tile_types]))
+
+
+def generate_puzzles(count=None, seed=None, **kwargs):
+    """
+    Lazily generate random puzzles (see generate_puzzle for arguments).
+
+    :param count: Number of puzzles (None = unlimited)
+    :type count: int
+    :param seed: Random seed, for reproducible sequences of puzzles
+    :return: Generator of Puzzles
+    """
+    rng = random.Random(seed)
+    generated = 0
+    while count is None or generated < count:
+        yield generate_puzzle(rng=rng, **kwargs)
+        generated += 1
+
+
+def encode_layout(solution):
+    """
+    :param solution: Matrix of (tile class, orientation)
+    :return: Rows of [tile class name, road edges] for each cell (as in
+        tilecsp.batch results)
+    :rtype: list[list[list[str]]]
+    """
+    return [[[tile_type.__name__,
+              "".join(e for e in Tile.EDGES
+                      if e in tile_type.CONFIGURATIONS[orientation])]
+             for tile_type, orientation in row]
+            for row in solution]
+
+
+def main(argv=None):
+    # Imported here to avoid a cycle (batch is the consumer of these specs)
+    from tilecsp.batch import spec_from_puzzle
+
+    parser = argparse.ArgumentParser(
+        description="Generate solvable tile puzzles as JSON lines")
+    parser.add_argument('-n', '--count', type=int, default=None,
+                        help="Number of puzzles (default: unlimited)")
+    parser.add_argument('-d', '--dim', type=int, default=3)
+    parser.add_argument('-t', '--terminals', type=int, default=0,
+                        help="Number of terminal nodes")
+    parser.add_argument('--density', type=float, default=0.5,
+                        help="Probability of a road across an internal edge")
+    parser.add_argument('--types', default=",".join(
+        t.__name__ for t in DEFAULT_TILE_TYPES),
+                        help="Comma separated tile class names")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--no-solution', action='store_true',
+                        help="Don't include the generated solution")
+    args = parser.parse_args(argv)
+
+    tile_types = [TILE_TYPES[name] for name in args.types.split(",")]
+    puzzles = generate_puzzles(args.count, args.seed, dim=args.dim,
+                               num_terminals=args.terminals,
+                               tile_types=tile_types, density=args.density)
+    try:
+        for i, puzzle in enumerate(puzzles):
+            fields = {'id': i}
+            if not args.no_solution:
+                fields['solution'] = encode_layout(puzzle.solution)
+            spec = spec_from_puzzle(puzzle.num_tiles, puzzle.terminal_nodes,
+                                    puzzle.dim, **fields)
+            sys.stdout.write(json.dumps(spec) + "\n")
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
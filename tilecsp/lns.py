@@ -0,0 +1,336 @@
+"""
+Large-neighbourhood search (LNS) for boards too big for complete search.
+
+LNSSearch keeps a layout of the board, a tile (or nothing) in each cell, and
+repeatedly improves it:
+
+    1. a window of cells is chosen around a random bad cell (empty, or with
+       a road that its neighbour doesn't meet): a band of whole rows, a
+       square block, or a random connected region of the board (see
+       SHAPES)
+    2. the window is emptied and re-solved exactly, as a CSP of its cells
+       with the board's adjacency and all-diff constraints, searched by
+       BacktrackingSearch with the propagator for at most window_decisions
+       assignments; the tiles outside the window stay where they are (the
+       window's domains only hold the tiles left and the tiles which meet
+       the roads of the good cells around it)
+    3. the new layout is kept unless it has more bad cells and violated
+       pairs than before (the cost)
+
+The window grows when its search finds no layout and shrinks when the
+search runs out of decisions, cycling back to min_window once max_window is
+reached. The search ends when the layout solves the board, or its budget
+(time, decisions or iterations) runs out; the best layout found is kept
+in tiles either way. LNS never proves a board unsolvable: solve returns
+False only for boards known to be infeasible (see CSP.infeasible_reason).
+
+    board = TileBoard("big", create_tiles(num_tiles), terminal_nodes, 12)
+    lns = LNSSearch(board, prop_fc, seed=1)
+    if lns.solve(time_limit=30.0):
+        print(board.solution_str())
+    else:
+        print(lns.cost, "left to repair")
+"""
+import collections
+import functools
+import logging
+import math
+import random
+import time
+
+from tilecsp.tileboard import *
+from search.btsearch import BacktrackingSearch
+from csp.propagators import prop_fc
+
+# Window shapes: "band" (whole rows), "block" (a square) and "region" (a
+# random connected region)
+SHAPES = ('band', 'block', 'region')
+
+
+class LNSSearch:
+    """
+    Large-neighbourhood search of a TileBoard (see module description).
+
+    Attributes:
+
+        tiles:      best layout found: the tile in each cell (or None), by
+                    cell index
+        cost:       number of empty cells and violated adjacent pairs of
+                    tiles (0 iff tiles solve the board)
+        window:     current window size, in cells
+    """
+
+    def __init__(self, board, propagator=prop_fc, shapes=SHAPES,
+                 min_window=4, max_window=None, window_decisions=1000,
+                 seed=None):
+        """
+        :type board: TileBoard
+        :param propagator: Propagator of the window searches (one which
+            works on any CSP, e.g. prop_fc, see bt_search; prop_gac's
+            all-diff supports only stay tractable for tiny windows)
+        :param shapes: Window shapes to choose from (see SHAPES)
+        :type shapes: Iterable[str]
+        :param min_window: Smallest window size, in cells
+        :type min_window: int
+        :param max_window: Largest window size, in cells (by default a
+            quarter of the board, but at least 36 cells, so small boards
+            are eventually searched whole)
+        :type max_window: int
+        :param window_decisions: Maximum number of assignments of each
+            window's search
+        :type window_decisions: int
+        :param seed: Seed of the choice of windows
+        """
+        shapes = tuple(shapes)
+        for shape in shapes:
+            if shape not in SHAPES:
+                raise ValueError("Unknown window shape {!r}".format(shape))
+        self.board = board
+        self.template = board.template
+        self.propagator = propagator
+        self.shapes = shapes
+        num_cells = self.template.num_cells
+        self.min_window = min(min_window, num_cells)
+        self.max_window = min(max(max_window or max(num_cells // 4, 36),
+                                  self.min_window), num_cells)
+        self.window_decisions = window_decisions
+        self.rng = random.Random(seed)
+        self.domains = [var.domain() for var in board.cells]
+        # All window variables share one table of the tiles (see ValueTable)
+        self.table = ValueTable(board.tiles)
+        ids_by_class = collections.defaultdict(set)
+        for tile in board.tiles:
+            ids_by_class[type(tile)].add(tile.id)
+        self.ids_by_class = {c: sorted(ids) for c, ids in ids_by_class.items()}
+        self.num_ids = max((t.id for t in board.tiles), default=-1) + 1
+        self.tiles = [None] * num_cells
+        self.cost = self.evaluate(self.tiles)[0]
+        self.window = self.min_window
+        self.num_decisions = 0
+        self.num_prunings = 0
+        self.iterations = 0
+        self.improvements = 0
+        self.runtime = 0
+
+    def place(self, layouts):
+        """
+        Start from the given layout: each cell is given an unused tile with
+        its (class, edge mask), if one fits it, and is otherwise left empty
+
+        :param layouts: (class, edge mask) of each cell (or None), by cell
+            index (see tilecsp.repair.board_layouts)
+        :type layouts: list[(type, int)]
+        """
+        used = set()
+        tiles = []
+        for domain, layout in zip(self.domains, layouts):
+            tile = next((t for t in domain if t.id not in used and
+                         (type(t), t.edge_mask) == layout), None)
+            if tile is not None:
+                used.add(tile.id)
+            tiles.append(tile)
+        self.tiles = tiles
+        self.cost = self.evaluate(tiles)[0]
+
+    def evaluate(self, tiles):
+        """
+        :param tiles: Tile in each cell (or None), by cell index
+        :type tiles: list[Tile]
+        :return: The layout's cost, and its bad cells (empty cells and cells
+            in a violated pair)
+        :rtype: (int, set[int])
+        """
+        bad = {cell for cell, tile in enumerate(tiles) if tile is None}
+        cost = len(bad)
+        for cell, neighbor, edge in self.template.pairs:
+            tile, neighbor_tile = tiles[cell], tiles[neighbor]
+            if tile is not None and neighbor_tile is not None and \
+                    bool(tile.edge_mask & EDGE_BITS[edge]) != \
+                    bool(neighbor_tile.edge_mask &
+                         EDGE_BITS[OPPOSITE_EDGES[edge]]):
+                bad.add(cell)
+                bad.add(neighbor)
+                cost += 1
+        return cost, bad
+
+    def choose_window(self, shape, size, center):
+        """
+        :param shape: Window shape (see SHAPES)
+        :param size: Number of cells (rounded to whole rows for bands and to
+            a square for blocks)
+        :param center: Cell the window must contain
+        :return: Cells of the window
+        :rtype: set[int]
+        """
+        template = self.template
+        dim = template.dim
+        rng = self.rng
+        x, y = template.coords[center]
+        if shape == 'band':
+            rows = min(max(1, round(size / dim)), dim)
+            top = min(max(y - rng.randrange(rows), 0), dim - rows)
+            return set(range(top * dim, (top + rows) * dim))
+        if shape == 'block':
+            side = min(max(1, round(math.sqrt(size))), dim)
+            left = min(max(x - rng.randrange(side), 0), dim - side)
+            top = min(max(y - rng.randrange(side), 0), dim - side)
+            return {template.index(left + dx, top + dy)
+                    for dx in range(side) for dy in range(side)}
+        # Grow a region from center, through random cells of its frontier
+        window = {center}
+        frontier = [n for n in template.neighbors[center] if n >= 0]
+        while frontier and len(window) < size:
+            cell = frontier.pop(rng.randrange(len(frontier)))
+            if cell in window:
+                continue
+            window.add(cell)
+            frontier.extend(n for n in template.neighbors[cell]
+                            if n >= 0 and n not in window)
+        return window
+
+    def window_csp(self, tiles, window, bad):
+        """
+        :return: CSP of the window's cells, given the tiles around it, or
+            None if a cell of the window has no tile left which fits it
+        :rtype: CSP
+        """
+        template = self.template
+        used = {tile.id for cell, tile in enumerate(tiles)
+                if tile is not None and cell not in window}
+        # Tiles of the same class are interchangeable: the window needs at
+        # most one tile of each class per cell
+        allowed = set()
+        for ids in self.ids_by_class.values():
+            allowed.update([i for i in ids if i not in used][:len(window)])
+
+        variables = {}
+        for cell in sorted(window):
+            # Edges facing good tiles outside the window, and their roads
+            known = roads = 0
+            for n, e in zip(template.neighbors[cell], Tile.EDGES):
+                if n >= 0 and n not in window and n not in bad:
+                    known |= EDGE_BITS[e]
+                    if tiles[n].edge_mask & EDGE_BITS[OPPOSITE_EDGES[e]]:
+                        roads |= EDGE_BITS[e]
+            domain = [t for t in self.domains[cell] if t.id in allowed and
+                      t.edge_mask & known == roads]
+            if not domain:
+                return None
+            x, y = template.coords[cell]
+            variables[cell] = GridVariable(
+                'V{}'.format((x, y)), domain, x, y,
+                template.terminal_edges(cell), cell, self.table)
+
+        csp = CSP("{} window".format(self.board.name), variables.values())
+        csp.add_constraint(Constraint("All-diff", csp.get_all_vars(),
+                                      all_diff_constraint, 'all-diff',
+                                      AllDiffCheck(self.num_ids)))
+        for cell, neighbor, edge in template.pairs:
+            if cell in variables and neighbor in variables:
+                var, neighbor_var = variables[cell], variables[neighbor]
+                csp.add_constraint(Constraint(
+                    "Pair {} {}".format(var.name, neighbor_var.name),
+                    (var, neighbor_var),
+                    functools.partial(adjacency_constraint, var=var,
+                                      edge=edge,
+                                      neighbor_edge=OPPOSITE_EDGES[edge]),
+                    'adjacency', AdjacencyCheck(var, neighbor_var, edge)))
+        return csp
+
+    def step(self):
+        """
+        Re-solve one window, keeping the new layout unless it costs more,
+        and resize the window (see module description)
+
+        :return: True iff the cost fell
+        :rtype: bool
+        """
+        tiles = self.tiles
+        cost, bad = self.evaluate(tiles)
+        self.iterations += 1
+        center = self.rng.choice(sorted(bad))
+        window = self.choose_window(self.rng.choice(self.shapes),
+                                    self.window, center)
+        csp = self.window_csp(tiles, window, bad)
+        status = False
+        if csp is not None:
+            search = BacktrackingSearch(csp, logging.WARNING, verbose=False)
+            status = search.bt_search(self.propagator, self.window_decisions)
+            self.num_decisions += search.num_decisions
+            self.num_prunings += search.num_prunings
+
+        improved = False
+        if status:
+            new_tiles = list(tiles)
+            for var in csp.get_all_vars():
+                new_tiles[var.index] = var.get_assigned_value()
+            new_cost = self.evaluate(new_tiles)[0]
+            if new_cost <= cost:
+                improved = new_cost < cost
+                self.tiles, self.cost = new_tiles, new_cost
+        if status is None:
+            self.window = max(self.window - 1, self.min_window)
+        elif not improved:
+            self.window = self.window + 1 if self.window < self.max_window \
+                else self.min_window
+        if improved:
+            self.improvements += 1
+        return improved
+
+    def solve(self, layouts=None, max_decisions=None, time_limit=None,
+              max_iterations=None):
+        """
+        Returns True iff a solution was found (the solution is left assigned
+        to the board's cells), False if the board is known to be infeasible,
+        or None if the budget ran out first (the best layout is kept in
+        tiles).
+
+        :param layouts: Layout to start from (see place); by default, the
+            current layout (empty at first)
+        :param max_decisions: Maximum number of assignments over all windows
+        :param time_limit: Maximum wall time, in seconds
+        :param max_iterations: Maximum number of windows
+        """
+        stime = time.process_time()
+        deadline = time.perf_counter() + time_limit \
+            if time_limit is not None else None
+        board = self.board
+        for var in board.cells:
+            if var.is_assigned():
+                var.unassign()
+        status = False
+        if board.is_feasible():
+            if layouts is not None:
+                self.place(layouts)
+            iterations = 0
+            status = None
+            while self.cost:
+                if max_decisions is not None and \
+                        self.num_decisions >= max_decisions or \
+                        max_iterations is not None and \
+                        iterations >= max_iterations or \
+                        deadline is not None and \
+                        time.perf_counter() >= deadline:
+                    break
+                self.step()
+                iterations += 1
+            if not self.cost:
+                for var, tile in zip(board.cells, self.tiles):
+                    var.assign(tile)
+                status = True
+        self.runtime += time.process_time() - stime
+        return status
+
+    def get_stats(self):
+        """
+        :return: Search statistics over all windows, the number of windows
+            searched and of improvements, and the best layout's cost
+        :rtype: dict
+        """
+        return {'decisions': self.num_decisions,
+                'prunings': self.num_prunings,
+                'cpu_time': self.runtime,
+                'iterations': self.iterations,
+                'improvements': self.improvements,
+                'cost': self.cost,
+                'window': self.window}
@@ -0,0 +1,153 @@
+"""
+Meet-in-the-middle counting of tile board layouts.
+
+The board is cut between rows h - 1 and h (h = dim // 2). The top half is
+filled row by row from the top and the bottom half row by row from the
+bottom, each with the same border, terminal and adjacency rules as
+TileBoard (cell domains as given by cell_domains). Each half is stored in a
+hash index keyed by
+
+    profile:    bit mask of the grid edges on the cut with a road (bit x for
+                the edge below cell (x, h - 1))
+    usage:      number of tiles of each class the half uses
+
+counting the fillings with that key, and the two indexes are joined on the
+profile: a top and a bottom half fit together iff their profiles are equal
+and their combined usage is within the inventory. Each half is enumerated
+as a dynamic program over a frontier of edge bits (cell by cell, merging
+fillings with the same frontier and usage), so each side does roughly the
+square root of the work of enumerating the whole board.
+
+Layouts are counted as in BacktrackingSearch.bt_count with value_key
+layout_key: tiles of the same class in the same orientation are
+interchangeable.
+
+    count = count_layouts(create_tiles(num_tiles), terminal_nodes, 6)
+"""
+import collections
+
+from tilecsp.tileboard import *
+
+def _cell_layouts(template, tiles, classes):
+    """
+    :return: For each cell, the distinct layouts of the tiles which fit it,
+        as (class index, edge mask) pairs (a mask appears once per layout
+        with it, e.g. twice for the two paths of OppositeCornersTile)
+    :rtype: list[list[(int, int)]]
+    """
+    class_index = {c: i for i, c in enumerate(classes)}
+    layouts = []
+    for domain in cell_domains(template, tiles):
+        keys = dict.fromkeys(layout_key(tile) for tile in domain)
+        layouts.append([(class_index[tile_class], mask)
+                        for tile_class, mask, paths in keys])
+    return layouts
+
+
+def fill_half(template, layouts, limits, rows, incoming, outgoing):
+    """
+    Count the fillings of the given rows, by cut profile and usage.
+
+    :type template: BoardTemplate
+    :param layouts: Layouts of each cell (see _cell_layouts)
+    :param limits: Number of tiles of each class
+    :type limits: tuple[int]
+    :param rows: Rows in the order they are filled (from the board's edge
+        towards the cut)
+    :type rows: Sequence[int]
+    :param incoming: Edge (N or S) shared with the previously filled row
+    :param outgoing: Edge (S or N) shared with the next row
+    :return: Number of fillings by (profile, usage)
+    :rtype: dict[(int, tuple[int]), int]
+    """
+    dim = template.dim
+    in_bit, out_bit = EDGE_BITS[incoming], EDGE_BITS[outgoing]
+    # The first row's incoming edges are on the border: the terminals
+    first = rows[0]
+    profile = 0
+    for x in range(dim):
+        if template.terminal_masks[template.index(x, first)] & in_bit:
+            profile |= 1 << x
+    # State: (frontier, road on the east edge of the last cell, usage)
+    states = {(profile, 0, (0,) * len(limits)): 1}
+    for y in rows:
+        for x in range(dim):
+            cell = template.index(x, y)
+            border_west = template.terminal_masks[cell] & EDGE_BITS[W]
+            next_states = collections.defaultdict(int)
+            for (frontier, east, usage), count in states.items():
+                west = east if x else bool(border_west)
+                above = bool(frontier >> x & 1)
+                for class_i, mask in layouts[cell]:
+                    if bool(mask & EDGE_BITS[W]) != west or \
+                            bool(mask & in_bit) != above or \
+                            usage[class_i] == limits[class_i]:
+                        continue
+                    new_usage = usage[:class_i] + \
+                        (usage[class_i] + 1,) + usage[class_i + 1:]
+                    new_frontier = frontier & ~(1 << x) | \
+                        (bool(mask & out_bit) << x)
+                    next_states[new_frontier, bool(mask & EDGE_BITS[E]),
+                                new_usage] += count
+            states = next_states
+    halves = collections.defaultdict(int)
+    for (frontier, east, usage), count in states.items():
+        halves[frontier, usage] += count
+    return halves
+
+
+def join_halves(top, bottom, limits):
+    """
+    :param top: Fillings of the top half by (profile, usage)
+    :param bottom: Fillings of the bottom half by (profile, usage)
+    :type limits: tuple[int]
+    :return: Number of layouts of the board
+    :rtype: int
+    """
+    bottom_by_profile = collections.defaultdict(list)
+    for (profile, usage), count in bottom.items():
+        bottom_by_profile[profile].append((usage, count))
+    total = 0
+    for (profile, usage), count in top.items():
+        for other_usage, other_count in bottom_by_profile.get(profile, ()):
+            if all(a + b <= limit
+                   for a, b, limit in zip(usage, other_usage, limits)):
+                total += count * other_count
+    return total
+
+
+def count_layouts(tiles, terminal_nodes, dim=3, stats=None):
+    """
+    Count the layouts of a board (see module description).
+
+    :param tiles: Tiles in every orientation (as given by create_tiles)
+    :type tiles: list[Tile]
+    :type terminal_nodes: Iterable[((int, int), str)]
+    :type dim: int
+    :param stats: (Optional) dict to record the number of entries in each
+        half's index in ('top', 'bottom')
+    :type stats: dict
+    :rtype: int
+    """
+    template = get_template(dim, terminal_nodes)
+    ids_by_class = collections.OrderedDict()
+    for tile in tiles:
+        ids_by_class.setdefault(type(tile), set()).add(tile.id)
+    classes = list(ids_by_class)
+    limits = tuple(len(ids) for ids in ids_by_class.values())
+    layouts = _cell_layouts(template, tiles, classes)
+    if any(not cell_layouts for cell_layouts in layouts):
+        return 0
+
+    h = dim // 2
+    bottom = fill_half(template, layouts, limits, range(dim - 1, h - 1, -1),
+                       S, N)
+    if h == 0:
+        # A single row: the cut is the border, already satisfied
+        if stats is not None:
+            stats['top'], stats['bottom'] = 0, len(bottom)
+        return sum(bottom.values())
+    top = fill_half(template, layouts, limits, range(h), N, S)
+    if stats is not None:
+        stats['top'], stats['bottom'] = len(top), len(bottom)
+    return join_halves(top, bottom, limits)
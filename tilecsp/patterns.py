@@ -0,0 +1,202 @@
+"""
+2x2 block pattern database for lookahead pruning.
+
+Adjacency constraints are checked pair by pair, so (arc consistent) domains
+can still leave a 2x2 block of cells which no combination of tiles can fill:
+the four adjacency constraints around the block form a cycle. A block is
+also limited by the inventory, since its four cells need four different
+tiles (e.g. a block can't hold two crossroads if there is only one cross
+tile).
+
+The pattern database lists every consistent 2x2 block of edge masks (see
+EDGE_BITS) for a given inventory: the four masks, in the order
+
+    0 1
+    2 3
+
+must agree on the block's four internal edges, and there must be four
+distinct tiles in the inventory with those masks. Patterns are stored as
+bitsets: for each position in the block and each edge mask, one int whose
+set bits are the indices of the patterns with that mask at that position.
+The patterns which fit the current domains of a block are then the AND over
+its positions of the OR of the bitsets of their masks, and a tile is
+supported iff the bitset of its mask at its position meets them.
+
+Databases are built once per inventory (see get_block_patterns), and
+stored in the disk cache if there is one (see tilecsp.tablecache). Use
+prop_block after another propagator, e.g.
+
+    solver.bt_search(chain_propagators(prop_fc, prop_block))
+"""
+import collections
+import functools
+import itertools
+
+from tilecsp.tileboard import *
+from tilecsp.tablecache import load_or_build
+
+# Internal edges of a 2x2 block: (position, edge, position across the edge)
+BLOCK_EDGES = ((0, E, 1), (2, E, 3), (0, S, 2), (1, S, 3))
+
+
+class BlockPatterns:
+    """
+    Consistent 2x2 blocks of edge masks for an inventory (see module
+    description)
+
+    Attributes:
+
+        num_patterns:   int, number of consistent blocks
+        bits:           for each block position, a list of 16 bitsets (by
+                        edge mask) of the patterns with that mask there
+    """
+
+    def __init__(self, inventory):
+        """
+        :param inventory: Pairs of (Tile subclass, number of tiles)
+        :type inventory: Iterable[(type, int)]
+        """
+        classes_by_mask = collections.defaultdict(set)
+        counts = {}
+        for tile_class, count in inventory:
+            counts[tile_class] = count
+            for orientation in tile_class.ORIENTATIONS:
+                mask = tile_class(None, orientation).edge_mask
+                classes_by_mask[mask].add(tile_class)
+        masks = sorted(classes_by_mask)
+
+        @functools.lru_cache(maxsize=None)
+        def realizable(block_masks):
+            """ True iff 4 distinct tiles have the (sorted) masks """
+            for classes in itertools.product(
+                    *(classes_by_mask[m] for m in block_masks)):
+                if all(n <= counts[c]
+                       for c, n in collections.Counter(classes).items()):
+                    return True
+            return False
+
+        self.bits = [[0] * 16 for _ in range(4)]
+        num_patterns = 0
+        for block in itertools.product(masks, repeat=4):
+            if all(bool(block[p] & EDGE_BITS[e]) ==
+                   bool(block[q] & EDGE_BITS[OPPOSITE_EDGES[e]])
+                   for p, e, q in BLOCK_EDGES) and \
+                    realizable(tuple(sorted(block))):
+                bit = 1 << num_patterns
+                for p, mask in enumerate(block):
+                    self.bits[p][mask] |= bit
+                num_patterns += 1
+        self.num_patterns = num_patterns
+
+    def supported_masks(self, block_masks):
+        """
+        :param block_masks: For each block position, the set of edge masks
+            of the tiles in the cell's current domain
+        :type block_masks: Sequence[Iterable[int]]
+        :return: For each block position, the edge masks which appear at that
+            position in a pattern that fits all four domains
+        :rtype: list[set[int]]
+        """
+        fits = -1
+        for p, masks in enumerate(block_masks):
+            allowed = 0
+            for mask in masks:
+                allowed |= self.bits[p][mask]
+            fits &= allowed
+            if not fits:
+                return [set() for _ in block_masks]
+        return [{mask for mask in masks if self.bits[p][mask] & fits}
+                for p, masks in enumerate(block_masks)]
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_patterns(inventory):
+    key = sorted((tile_class.__name__, count)
+                 for tile_class, count in inventory)
+    return load_or_build('patterns', key,
+                         functools.partial(BlockPatterns, inventory))
+
+
+def get_block_patterns(tiles):
+    """
+    Return the (cached) BlockPatterns for the inventory of tiles.
+
+    :param tiles: Tiles in every orientation (as given by create_tiles)
+    :type tiles: Iterable[Tile]
+    :rtype: BlockPatterns
+    """
+    ids_by_class = collections.defaultdict(set)
+    for tile in tiles:
+        ids_by_class[type(tile)].add(tile.id)
+    return _compile_patterns(frozenset(
+        (tile_class, len(ids)) for tile_class, ids in ids_by_class.items()))
+
+
+def block_windows(template):
+    """
+    :type template: BoardTemplate
+    :return: The cell indices of every 2x2 block of the board (in block
+        position order); the blocks containing each cell
+    :rtype: (list[(int, int, int, int)], list[list[int]])
+    """
+    dim = template.dim
+    windows = [(template.index(x, y), template.index(x + 1, y),
+                template.index(x, y + 1), template.index(x + 1, y + 1))
+               for y in range(dim - 1) for x in range(dim - 1)]
+    windows_by_cell = [[] for _ in range(template.num_cells)]
+    for w, window in enumerate(windows):
+        for cell in window:
+            windows_by_cell[cell].append(w)
+    return windows, windows_by_cell
+
+
+def prop_block(csp, new_var=None):
+    """
+    Prune tiles which fit no consistent 2x2 block given the domains of the
+    other cells of the block (see module description), until no more can be
+    pruned. Checks every block initially, then the blocks around new_var
+    and around the cells whose domains were pruned.
+
+    :param csp: TileBoard instance
+    :type csp: TileBoard
+    :param new_var: Optional new variable
+    :type new_var: GridVariable
+    :return: False if a dead end has been detected and True otherwise; List
+        of variable/value pairs which were pruned
+    :rtype: bool, list[(Variable, object)]
+    """
+    if new_var is None:
+        csp.block_patterns = get_block_patterns(csp.tiles)
+        csp.block_windows = block_windows(csp.template)
+        queue = collections.deque(range(len(csp.block_windows[0])))
+    elif isinstance(new_var, GridVariable):
+        queue = collections.deque(csp.block_windows[1][new_var.index])
+    else:
+        return True, []
+    patterns = csp.block_patterns
+    windows, windows_by_cell = csp.block_windows
+    queued = set(queue)
+    pruned = []
+    while queue:
+        w = queue.popleft()
+        queued.discard(w)
+        cells = [csp.cells[cell] for cell in windows[w]]
+        domains = [var.get_cur_domain() for var in cells]
+        supported = patterns.supported_masks(
+            [{tile.edge_mask for tile in domain} for domain in domains])
+        for var, domain, masks in zip(cells, domains, supported):
+            if len(masks) == len({tile.edge_mask for tile in domain}):
+                continue
+            if var.is_assigned():
+                return False, pruned
+            for tile in domain:
+                if tile.edge_mask not in masks:
+                    var.prune_value(tile)
+                    pruned.append((var, tile))
+            if var.get_cur_domain_size() == 0:
+                return False, pruned
+            for other in windows_by_cell[var.index]:
+                if other not in queued:
+                    queued.add(other)
+                    queue.append(other)
+    return True, pruned
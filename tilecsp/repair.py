@@ -0,0 +1,294 @@
+"""
+Incremental re-solving of edited puzzles.
+
+An edit (adding or moving a terminal, swapping a tile for one of another
+type) usually leaves most of the previous solution valid. RepairSearch
+solves the edited board by repairing the previous solution locally:
+
+    1. each cell is seeded with an unused tile of the new inventory with the
+       layout (class and road edges) the cell had before, if the tile still
+       fits the cell; the cells left without a seed (e.g. at a new terminal,
+       or holding a class the edit took tiles away from) are the changed
+       cells
+    2. a window of the changed cells and the cells within radius steps of
+       them is searched with BacktrackingSearch and the propagator, every
+       other cell fixed to its seed, for at most window_decisions
+       assignments
+    3. if the window has no solution within the budget, the radius grows
+       until the window covers the board, and the last search is the
+       complete search of the board (with max_decisions)
+
+so small edits are solved by searching a few cells rather than the board.
+IncrementalSolver keeps the current puzzle and its last solution between
+edits:
+
+    solver = IncrementalSolver(num_tiles, terminal_nodes, 5)
+    solver.solve()
+    solver.edit(terminal_nodes=terminal_nodes | {((4, 2), 'e')})
+    solver.edit(num_tiles={CornerTile: 9, TTile: 6, LineTile: 10})
+    print(solver.board.solution_str(), solver.stats)
+"""
+import collections
+import logging
+import time
+
+from tilecsp.tileboard import *
+from search.btsearch import BacktrackingSearch
+from csp.propagators import prop_fc
+
+
+def board_layouts(board):
+    """
+    :type board: TileBoard
+    :return: (class, edge mask) of the tile assigned to each cell (None where
+        unassigned), by cell index
+    :rtype: list[(type, int)]
+    """
+    return [(type(tile), tile.edge_mask) if tile is not None else None
+            for tile in map(Variable.get_assigned_value, board.cells)]
+
+
+def solution_layouts(solution, dim):
+    """
+    :param solution: Solution as given by tilecsp.batch.encode_solution
+    :type solution: list[list[list[str]]]
+    :return: (class, edge mask) of each cell of the solution, by cell index
+        (None for unknown tile classes), or None if the solution is not a
+        dim x dim grid
+    :rtype: list[(type, int)]
+    """
+    if len(solution) != dim or any(len(row) != dim for row in solution):
+        return None
+    return [(TILE_TYPES[name], edge_mask(edges))
+            if name in TILE_TYPES else None
+            for row in solution for name, edges in row]
+
+
+class RepairSearch:
+    """
+    Solves a TileBoard by repairing the solution of a similar board (see
+    module description), with the same results as
+    BacktrackingSearch.bt_search.
+    """
+
+    def __init__(self, board, propagator=prop_fc, radius=1,
+                 window_decisions=2000):
+        """
+        :type board: TileBoard
+        :param propagator: Propagator of the searches (see bt_search)
+        :param radius: Radius of the first window around the changed cells
+        :type radius: int
+        :param window_decisions: Maximum number of assignments of each
+            window's search (before the window grows)
+        :type window_decisions: int
+        """
+        self.board = board
+        self.propagator = propagator
+        self.radius = radius
+        self.window_decisions = window_decisions
+        self.search = BacktrackingSearch(board, logging.WARNING,
+                                         verbose=False)
+        self.num_decisions = 0
+        self.num_prunings = 0
+        self.runtime = 0
+        self.windows = 0
+        self.changed = 0
+        self.window_cells = 0
+
+    def seed(self, layouts):
+        """
+        Give each cell an unused tile with its previous layout. Where a class
+        has fewer tiles than cells which had it, the cells nearest the
+        changed cells give theirs up.
+
+        :param layouts: Previous (class, edge mask) of each cell, by cell
+            index (see board_layouts)
+        :type layouts: list[(type, int)]
+        :return: Seed tile of each cell (None for changed cells), by cell
+            index
+        :rtype: list[Tile]
+        """
+        board = self.board
+        seeds = [None] * len(board.cells)
+        if layouts is None or len(layouts) != len(board.cells):
+            return seeds
+        # Tiles of each layout fitting each cell
+        candidates = [[t for t in var.domain()
+                       if layout is not None and
+                       (type(t), t.edge_mask) == layout]
+                      for var, layout in zip(board.cells, layouts)]
+        changed = [cell for cell, tiles in enumerate(candidates) if not tiles]
+        distance = self._distances(changed)
+        ids_by_class = collections.defaultdict(set)
+        for tile in board.tiles:
+            ids_by_class[type(tile)].add(tile.id)
+        cells_by_class = collections.defaultdict(list)
+        for cell, tiles in enumerate(candidates):
+            if tiles:
+                cells_by_class[type(tiles[0])].append(cell)
+
+        used = set()
+        for tile_class, cells in cells_by_class.items():
+            # Keep the seeds farthest from the changed cells
+            cells.sort(key=lambda cell: -distance[cell])
+            for cell in cells[:len(ids_by_class[tile_class])]:
+                seeds[cell] = next(
+                    (t for t in candidates[cell] if t.id not in used), None)
+                if seeds[cell] is not None:
+                    used.add(seeds[cell].id)
+        return seeds
+
+    def _distances(self, cells):
+        """
+        :return: Number of steps from each cell to the nearest of cells (the
+            number of cells if cells is empty)
+        :rtype: list[int]
+        """
+        neighbors = self.board.template.neighbors
+        distance = [len(neighbors)] * len(neighbors)
+        for cell in cells:
+            distance[cell] = 0
+        queue = collections.deque(cells)
+        while queue:
+            cell = queue.popleft()
+            for n in neighbors[cell]:
+                if n >= 0 and distance[n] > distance[cell] + 1:
+                    distance[n] = distance[cell] + 1
+                    queue.append(n)
+        return distance
+
+    def solve(self, layouts=None, max_decisions=None):
+        """
+        Returns True iff a solution was found (the solution is left assigned
+        to the board's cells), False if there is no solution, or None if the
+        complete search was abandoned after max_decisions assignments.
+
+        :param layouts: Previous (class, edge mask) of each cell, by cell
+            index (see board_layouts); without it, the board is searched
+            at once
+        :type layouts: list[(type, int)]
+        """
+        stime = time.process_time()
+        board = self.board
+        self.num_decisions = self.num_prunings = self.windows = 0
+        status = False
+        if board.is_feasible():
+            seeds = self.seed(layouts)
+            changed = [cell for cell, tile in enumerate(seeds) if tile is None]
+            self.changed = len(changed)
+            distance = self._distances(changed)
+            radius = self.radius if changed else 0
+            status = None
+            while status is None:
+                window = {cell for cell, d in enumerate(distance)
+                          if d <= radius}
+                if len(window) == len(board.cells):
+                    status = self._search(window, seeds, max_decisions)
+                    break
+                status = self._search(window, seeds, self.window_decisions) \
+                    or None
+                radius += 1
+        self.runtime = time.process_time() - stime
+        return status
+
+    def _search(self, window, seeds, max_decisions):
+        """
+        Search the board with the cells outside window fixed to their seeds
+        """
+        board = self.board
+        self.windows += 1
+        self.window_cells = len(window)
+        removed = []
+        if len(window) < len(board.cells):
+            fixed_ids = {seeds[cell].id for cell in range(len(board.cells))
+                         if cell not in window}
+            for cell, var in enumerate(board.cells):
+                if cell in window:
+                    values = [t for t in var.domain() if t.id in fixed_ids]
+                else:
+                    values = [t for t in var.domain() if t is not seeds[cell]]
+                var.remove_domain_values(values)
+                removed.append((var, values))
+        try:
+            status = self.search.bt_search(self.propagator, max_decisions)
+        finally:
+            for var, values in removed:
+                var.add_domain_values(values)
+            self.num_decisions += self.search.num_decisions
+            self.num_prunings += self.search.num_prunings
+        return status
+
+    def get_stats(self):
+        """
+        :return: Search statistics over all windows, the number of windows
+            searched, of changed cells, and of cells in the last window
+        :rtype: dict
+        """
+        return {'decisions': self.num_decisions,
+                'prunings': self.num_prunings,
+                'cpu_time': self.runtime,
+                'windows': self.windows,
+                'changed': self.changed,
+                'window_cells': self.window_cells}
+
+
+class IncrementalSolver:
+    """
+    Solves a puzzle through a series of edits, repairing the last solution
+    found after each edit (see RepairSearch).
+
+    Attributes:
+
+        board:      TileBoard of the current puzzle
+        layouts:    (class, edge mask) of each cell of the last solution
+                    found (kept when an edit has no solution), or None
+        stats:      statistics of the last search (see RepairSearch)
+    """
+
+    def __init__(self, num_tiles, terminal_nodes, dim=3, propagator=prop_fc,
+                 name="Puzzle", **options):
+        """
+        :type num_tiles: dict[type, int]
+        :type terminal_nodes: set[((int, int), str)]
+        :type dim: int
+        :param options: Options of each RepairSearch (radius,
+            window_decisions)
+        """
+        self.num_tiles = dict(num_tiles)
+        self.terminal_nodes = set(terminal_nodes)
+        self.dim = dim
+        self.propagator = propagator
+        self.name = name
+        self.options = options
+        self.board = None
+        self.layouts = None
+        self.stats = {}
+
+    def solve(self, max_decisions=None):
+        """ Solve the current puzzle (see edit) """
+        return self.edit(max_decisions=max_decisions)
+
+    def edit(self, num_tiles=None, terminal_nodes=None, dim=None,
+             max_decisions=None):
+        """
+        Change the puzzle (the arguments given) and solve it, starting from
+        the last solution.
+
+        :return: True iff a solution was found (left assigned to board),
+            False if there is none, or None if the search was abandoned (see
+            RepairSearch.solve)
+        """
+        if num_tiles is not None:
+            self.num_tiles = dict(num_tiles)
+        if terminal_nodes is not None:
+            self.terminal_nodes = set(terminal_nodes)
+        if dim is not None:
+            self.dim = dim
+        self.board = TileBoard(self.name, create_tiles(self.num_tiles),
+                               self.terminal_nodes, self.dim)
+        search = RepairSearch(self.board, self.propagator, **self.options)
+        status = search.solve(self.layouts, max_decisions)
+        self.stats = search.get_stats()
+        if status:
+            self.layouts = board_layouts(self.board)
+        return status
@@ -0,0 +1,300 @@
+"""
+CNF (SAT) encoding of a tile board, solved with the CDCL solver of
+search.cdcl or exported in DIMACS format for any other SAT solver.
+
+The encoding of a TileBoard has:
+
+    - a road variable per grid edge of the board's BoardTemplate, true iff
+      a road crosses the edge; border edges are fixed by unit clauses (true
+      exactly at the terminals)
+    - a layout variable per cell and distinct tile layout in the cell's
+      domain (see layout_key): tiles of the same class in the same
+      orientation are interchangeable, so the encoding doesn't tell them
+      apart, and the solver doesn't search over which of them goes where
+    - exactly one layout per cell: one clause for at least one, and an
+      at-most-one constraint (pairwise for a few layouts, otherwise a
+      sequential counter)
+    - adjacency: each layout implies the value of the road variable of each
+      of its edges, and neighbouring cells share the road variable of the
+      edge between them
+    - tile usage: a usage variable per cell and tile class (implied by the
+      cell's layouts of that class), with an at-most-k sequential counter
+      over each class's usage variables, k the number of tiles of the class
+
+A solution is decoded by giving each cell an unused tile with its layout.
+
+    board = TileBoard("p1", create_tiles(num_tiles), terminal_nodes, 5)
+    solver = SatSearch(board)
+    if solver.solve(max_conflicts=100000):
+        print(board.solution_str())
+
+    with open("p1.cnf", "w") as f:
+        TileCNF(board).write_dimacs(f)
+
+To export puzzle specs (see tilecsp.batch) as DIMACS files <id>.cnf:
+    python3 -m tilecsp.satboard puzzles.jsonl -o cnf/
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+from tilecsp.tileboard import *
+from search.cdcl import SATSolver, write_dimacs
+
+# Largest number of literals given pairwise at-most-one clauses
+PAIRWISE_LIMIT = 6
+
+
+class TileCNF:
+    """
+    CNF encoding of a TileBoard (see module description)
+
+    Attributes:
+
+        board:      the TileBoard
+        num_vars:   int, number of variables
+        clauses:    list of clauses, as lists of DIMACS literals
+        roads:      road variable of each grid edge, by grid edge index
+        layouts:    for each cell, list of (layout variable, tiles with the
+                    layout in the cell's domain) pairs
+    """
+
+    def __init__(self, board):
+        """
+        :param board: Board to encode, unassigned (the current domains of
+            its cells are encoded)
+        :type board: TileBoard
+        """
+        self.board = board
+        self.num_vars = 0
+        self.clauses = []
+        template = board.template
+        self.roads = [self.new_var() for _ in range(template.num_edges)]
+        self._add_border_clauses()
+
+        usage = collections.defaultdict(list)
+        self.layouts = []
+        for cell, var in enumerate(board.cells):
+            tiles_by_layout = {}
+            for tile in var.get_cur_domain():
+                tiles_by_layout.setdefault(layout_key(tile), []).append(tile)
+            layouts = [(self.new_var(), tiles)
+                       for tiles in tiles_by_layout.values()]
+            self.layouts.append(layouts)
+            literals = [layout for layout, tiles in layouts]
+            self.clauses.append(literals)
+            self.at_most(literals, 1)
+            self._add_road_clauses(cell, layouts)
+
+            by_class = collections.defaultdict(list)
+            for layout, tiles in layouts:
+                by_class[type(tiles[0])].append(layout)
+            for tile_class, class_layouts in by_class.items():
+                if len(class_layouts) == 1:
+                    usage[tile_class].append(class_layouts[0])
+                    continue
+                used = self.new_var()
+                for layout in class_layouts:
+                    self.clauses.append([-layout, used])
+                usage[tile_class].append(used)
+
+        tiles_by_id = {tile.id: tile for tile in board.tiles}
+        limits = collections.Counter(map(type, tiles_by_id.values()))
+        for tile_class, literals in usage.items():
+            self.at_most(literals, limits[tile_class])
+
+    def new_var(self):
+        """
+        :return: A new variable
+        :rtype: int
+        """
+        self.num_vars += 1
+        return self.num_vars
+
+    def _add_border_clauses(self):
+        """ Fix the road variables of the border: roads at the terminals """
+        template = self.board.template
+        for cell, edges in enumerate(template.cell_edges):
+            for e, edge in zip(Tile.EDGES, edges):
+                if template.border_masks[cell] & EDGE_BITS[e]:
+                    road = self.roads[edge]
+                    self.clauses.append(
+                        [road if template.terminal_masks[cell] & EDGE_BITS[e]
+                         else -road])
+
+    def _add_road_clauses(self, cell, layouts):
+        """ Each layout of the cell implies the roads on its edges """
+        edges = self.board.template.cell_edges[cell]
+        for layout, tiles in layouts:
+            mask = tiles[0].edge_mask
+            for e, edge in zip(Tile.EDGES, edges):
+                road = self.roads[edge]
+                self.clauses.append(
+                    [-layout, road if mask & EDGE_BITS[e] else -road])
+
+    def at_most(self, literals, k):
+        """
+        Add clauses allowing at most k of literals to be true (pairwise for
+        at most one of a few literals, otherwise a sequential counter)
+
+        :type literals: list[int]
+        :type k: int
+        """
+        n = len(literals)
+        if k >= n:
+            return
+        if k == 0:
+            self.clauses.extend([-x] for x in literals)
+            return
+        if k == 1 and n <= PAIRWISE_LIMIT:
+            self.clauses.extend([-literals[i], -literals[j]]
+                                for i in range(n) for j in range(i + 1, n))
+            return
+        # s[i][j]: at least j + 1 of the first i + 1 literals are true
+        s = [[self.new_var() for _ in range(k)] for _ in range(n - 1)]
+        clauses = self.clauses
+        clauses.append([-literals[0], s[0][0]])
+        clauses.extend([-s[0][j]] for j in range(1, k))
+        for i in range(1, n - 1):
+            x = literals[i]
+            clauses.append([-x, s[i][0]])
+            clauses.append([-s[i - 1][0], s[i][0]])
+            for j in range(1, k):
+                clauses.append([-x, -s[i - 1][j - 1], s[i][j]])
+                clauses.append([-s[i - 1][j], s[i][j]])
+            clauses.append([-x, -s[i - 1][k - 1]])
+        clauses.append([-literals[n - 1], -s[n - 2][k - 1]])
+
+    def solver(self):
+        """
+        :return: A SATSolver loaded with the encoding
+        :rtype: SATSolver
+        """
+        solver = SATSolver(self.num_vars)
+        for clause in self.clauses:
+            if not solver.add_clause(clause):
+                break
+        return solver
+
+    def decode(self, model):
+        """
+        :param model: Value of each variable (see SATSolver.model)
+        :type model: list[bool]
+        :return: A tile for each cell, by cell index (each tile used once)
+        :rtype: list[Tile]
+        """
+        used = set()
+        solution = []
+        for layouts in self.layouts:
+            tiles = next(tiles for layout, tiles in layouts if model[layout])
+            tile = next(t for t in tiles if t.id not in used)
+            used.add(tile.id)
+            solution.append(tile)
+        return solution
+
+    def write_dimacs(self, f):
+        """ Write the encoding to the text file f in DIMACS format """
+        board = self.board
+        write_dimacs(f, self.num_vars, self.clauses, (
+            "Tile board {}: {}x{}, terminals {}".format(
+                board.name, board.dimensions, board.dimensions,
+                sorted(board.template.terminal_nodes)),
+            "Road variables 1-{}".format(len(self.roads))))
+
+
+class SatSearch:
+    """
+    Solves a TileBoard by encoding it to CNF (see TileCNF) and running the
+    CDCL solver, with the same results as BacktrackingSearch.bt_search.
+    """
+
+    def __init__(self, board):
+        """
+        :type board: TileBoard
+        """
+        self.board = board
+        self.cnf = None
+        self.solver = None
+        self.runtime = 0
+
+    def solve(self, max_conflicts=None, max_decisions=None, time_limit=None):
+        """
+        Returns True iff a solution was found (the solution is left assigned
+        to the board's cells), False if there is no solution (at once, if the
+        board is known to be infeasible, see CSP.infeasible_reason), or None
+        if the solver gave up (see SATSolver.solve).
+        """
+        stime = time.process_time()
+        board = self.board
+        for var in board.cells:
+            if var.is_assigned():
+                var.unassign()
+        status = False
+        if board.is_feasible():
+            self.cnf = TileCNF(board)
+            self.solver = self.cnf.solver()
+            status = self.solver.solve(max_conflicts, max_decisions,
+                                       time_limit)
+            if status:
+                for var, tile in zip(board.cells,
+                                     self.cnf.decode(self.solver.model)):
+                    var.assign(tile)
+        self.runtime = time.process_time() - stime
+        return status
+
+    def get_stats(self):
+        """
+        :return: Solver statistics: decisions, prunings (literals set by
+            unit propagation), conflicts, learned clauses, restarts, CPU time
+            and the size of the encoding
+        :rtype: dict
+        """
+        stats = {'decisions': 0, 'prunings': 0, 'conflicts': 0,
+                 'learned': 0, 'restarts': 0, 'cpu_time': self.runtime,
+                 'variables': 0, 'clauses': 0}
+        if self.solver is not None:
+            for name in ('decisions', 'conflicts', 'learned', 'restarts'):
+                stats[name] = self.solver.stats[name]
+            stats['prunings'] = self.solver.stats['propagations']
+            stats['variables'] = self.cnf.num_vars
+            stats['clauses'] = len(self.cnf.clauses)
+        return stats
+
+
+def main(argv=None):
+    from tilecsp.batch import puzzle_from_spec, read_specs
+
+    parser = argparse.ArgumentParser(
+        description="Export tile puzzles as DIMACS CNF files")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSONL file of puzzle specs (default: stdin)")
+    parser.add_argument('-o', '--output', default='.',
+                        help="Directory of the <id>.cnf files")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    status = 0
+    try:
+        for line_no, spec in read_specs(infile):
+            if not isinstance(spec, dict):
+                print("Line {}: {}".format(line_no, spec), file=sys.stderr)
+                status = 1
+                continue
+            name = str(spec.get('id', line_no))
+            num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+            board = TileBoard(name, create_tiles(num_tiles), terminal_nodes,
+                              dim)
+            path = os.path.join(args.output, "{}.cnf".format(name))
+            with open(path, 'w') as f:
+                TileCNF(board).write_dimacs(f)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Local HTTP service for solving tile puzzles.
+
+Keeps a pool of worker processes warm, so callers don't pay for Python
+startup and imports (or building the tile tables) on every puzzle. Requests
+are POSTed as JSON puzzle specs (see tilecsp.batch) and answered with JSON
+result records:
+
+    POST /solve      solve the puzzle (as tilecsp.batch.solve_spec)
+    POST /count      count its solutions (tilecsp.batch.count_spec)
+    POST /validate   check the spec, or the solution it contains
+                     (tilecsp.batch.validate_spec)
+    GET  /stats      server counters
+
+Results with status "error" (e.g. an unknown tile type), and requests which
+can't be parsed, are answered with 400; everything else with 200. If a
+worker process dies (e.g. out of memory), the requests waiting on it are
+answered with 500 and the pool of workers is replaced.
+
+Admission control: at most max_pending distinct puzzles are queued or being
+solved at a time. Beyond that, requests are rejected at once with 503 (and
+a Retry-After header) rather than queued without bound.
+
+Coalescing: requests are identified by a hash of their endpoint and
+canonical spec (tile counts and terminals in a fixed order, defaults filled
+in, without the id). A request identical to one in flight waits for the
+same result instead of solving the puzzle again, and isn't counted against
+max_pending. The server's max_decisions caps each search.
+
+To run (see tilecsp.client for a load-testing client):
+    python3 -m tilecsp.server --port 8080 -j 4
+    curl -d '{"dim": 2, "tiles": {"CornerTile": 4}}' localhost:8080/solve
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+
+from tilecsp.batch import PROPAGATORS, count_spec, puzzle_from_spec, \
+    solve_spec, spec_from_puzzle, validate_spec
+
+ENDPOINTS = {'/solve': solve_spec, '/count': count_spec,
+             '/validate': validate_spec}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def canonical_spec(spec, propagator='FC', max_decisions=None):
+    """
+    :param spec: Puzzle spec (see tilecsp.batch)
+    :type spec: dict
+    :param propagator: Default propagator name
+    :param max_decisions: (Optional) Upper bound on the spec's max_decisions
+    :return: The spec with its puzzle in canonical form, defaults filled in
+        and without an id
+    :rtype: dict
+    :raises ValueError: if the puzzle can't be decoded
+    """
+    num_tiles, terminal_nodes, dim = puzzle_from_spec(spec)
+    fields = {k: v for k, v in spec.items()
+              if k not in ('id', 'dim', 'tiles', 'terminals')}
+    fields['propagator'] = str(fields.get('propagator', propagator)).upper()
+    fields['model'] = str(fields.get('model', 'cell')).lower()
+    if max_decisions is not None:
+        fields['max_decisions'] = min(
+            fields.get('max_decisions') or max_decisions, max_decisions)
+    return spec_from_puzzle(
+        {tile_type: count for tile_type, count in num_tiles.items()
+         if count},
+        terminal_nodes, dim, **fields)
+
+
+def request_key(endpoint, spec):
+    """
+    :return: Hash identifying requests with the same endpoint and
+        (canonical) spec
+    :rtype: str
+    """
+    return hashlib.sha256(
+        (endpoint + json.dumps(spec, sort_keys=True)).encode()).hexdigest()
+
+
+class PuzzleServer:
+    """
+    Serves puzzle requests from a bounded pool of worker processes (see
+    module description).
+    """
+
+    def __init__(self, workers=None, max_pending=None, max_decisions=None,
+                 propagator='FC', max_body=1 << 20):
+        """
+        :param workers: Number of worker processes (default: CPU count)
+        :type workers: int
+        :param max_pending: Maximum number of distinct puzzles queued or
+            being solved (default: 4 per worker)
+        :type max_pending: int
+        :param max_decisions: (Optional) Maximum number of decisions of each
+            search
+        :type max_decisions: int
+        :param propagator: Default propagator name
+        :type propagator: str
+        :param max_body: Maximum size of a request body, in bytes
+        :type max_body: int
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_decisions = max_decisions
+        self.propagator = propagator
+        self.max_body = max_body
+        self.executor = None
+        # In-flight jobs (asyncio.Future of the result record) by request key
+        self.in_flight = {}
+        self.counters = {'requests': 0, 'coalesced': 0, 'rejected': 0,
+                         'completed': 0, 'failed': 0, 'restarts': 0}
+
+    def start_executor(self):
+        """ Start a new pool of worker processes """
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+    def restart_executor(self, broken):
+        """
+        Replace the pool of worker processes after a worker died (the pool
+        is then broken, and fails every job); does nothing if broken was
+        already replaced
+
+        :type broken: concurrent.futures.ProcessPoolExecutor
+        """
+        if self.executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.start_executor()
+        self.counters['restarts'] += 1
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        stats = dict(self.counters)
+        stats.update(workers=self.workers, pending=len(self.in_flight),
+                     max_pending=self.max_pending)
+        return stats
+
+    async def handle(self, endpoint, spec):
+        """
+        Answer a request.
+
+        :param endpoint: Path of an endpoint (see ENDPOINTS)
+        :type endpoint: str
+        :param spec: Puzzle spec
+        :type spec: dict
+        :return: HTTP status; Result record
+        :rtype: (int, dict)
+        """
+        self.counters['requests'] += 1
+        try:
+            canonical = canonical_spec(spec, self.propagator,
+                                       self.max_decisions)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return 400, {'id': spec.get('id'), 'status': 'error',
+                         'error': "{}: {}".format(type(e).__name__, e)}
+        key = request_key(endpoint, canonical)
+        job = self.in_flight.get(key)
+        if job is not None:
+            self.counters['coalesced'] += 1
+        elif len(self.in_flight) >= self.max_pending:
+            self.counters['rejected'] += 1
+            return 503, {'id': spec.get('id'), 'status': 'error',
+                         'error': "Server busy"}
+        else:
+            executor = self.executor
+            try:
+                job = asyncio.get_running_loop().run_in_executor(
+                    executor, ENDPOINTS[endpoint], canonical)
+            except concurrent.futures.BrokenExecutor:
+                # Broken by an earlier job: retry once on a new pool
+                self.restart_executor(executor)
+                executor = self.executor
+                job = asyncio.get_running_loop().run_in_executor(
+                    executor, ENDPOINTS[endpoint], canonical)
+            self.in_flight[key] = job
+            job.add_done_callback(lambda f: self._finished(key, f, executor))
+        try:
+            # Shielded: a client going away doesn't cancel a shared job
+            result = dict(await asyncio.shield(job))
+        except Exception as e:
+            return 500, {'id': spec.get('id'), 'status': 'error',
+                         'error': "{}: {}".format(type(e).__name__, e)}
+        result['id'] = spec.get('id')
+        return 400 if result['status'] == 'error' else 200, result
+
+    def _finished(self, key, job, executor):
+        """ Forget a finished job (replacing the pool if it broke) """
+        self.in_flight.pop(key, None)
+        if job.cancelled() or job.exception() is not None:
+            self.counters['failed'] += 1
+            if isinstance(job.exception(),
+                          concurrent.futures.BrokenExecutor):
+                self.restart_executor(executor)
+        else:
+            self.counters['completed'] += 1
+
+    async def dispatch(self, method, path, body):
+        """
+        :type method: str
+        :type path: str
+        :type body: bytes
+        :return: HTTP status; JSON response
+        :rtype: (int, dict)
+        """
+        path = path.split('?', 1)[0]
+        if path == '/stats':
+            return (200, self.stats()) if method == 'GET' else \
+                (405, {'error': "Use GET"})
+        if path not in ENDPOINTS:
+            return 404, {'error': "Unknown endpoint {}".format(path)}
+        if method != 'POST':
+            return 405, {'error': "Use POST"}
+        try:
+            spec = json.loads(body)
+        except ValueError as e:
+            return 400, {'status': 'error',
+                         'error': "Invalid JSON: {}".format(e)}
+        if not isinstance(spec, dict):
+            return 400, {'status': 'error',
+                         'error': "Expected a JSON object"}
+        return await self.handle(path, spec)
+
+    async def serve_connection(self, reader, writer):
+        """ Answer HTTP/1.1 requests on a (keep-alive) connection """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                parts = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length', '0')
+                if len(parts) != 3 or not length.isdigit():
+                    # The request can't be parsed: answer, then hang up
+                    status, response = 400, {'error': "Malformed request"}
+                    keep_alive = False
+                elif int(length) > self.max_body:
+                    status, response = 413, {'error': "Request too large"}
+                    keep_alive = False
+                else:
+                    method, path, version = parts
+                    keep_alive = version == 'HTTP/1.1' and \
+                        headers.get('connection', '').lower() != 'close'
+                    body = await reader.readexactly(int(length))
+                    status, response = await self.dispatch(method, path,
+                                                           body)
+                data = json.dumps(response).encode()
+                head = ["HTTP/1.1 {} {}".format(status, REASONS[status]),
+                        "Content-Type: application/json",
+                        "Content-Length: {}".format(len(data)),
+                        "Connection: {}".format(
+                            'keep-alive' if keep_alive else 'close')]
+                if status == 503:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080, ready=None):
+        """
+        Serve until cancelled.
+
+        :param ready: (Optional) Callable called with the bound port once
+            the server is listening (e.g. with port 0)
+        """
+        self.start_executor()
+        try:
+            server = await asyncio.start_server(self.serve_connection, host,
+                                                port)
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve tile puzzle requests over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Maximum number of puzzles queued or being "
+                             "solved (default: 4 per worker)")
+    parser.add_argument('--max-decisions', type=int, default=None,
+                        help="Maximum number of decisions per search")
+    parser.add_argument('-p', '--propagator', default='FC',
+                        choices=sorted(PROPAGATORS),
+                        help="Default propagator (default: FC)")
+    args = parser.parse_args(argv)
+
+    server = PuzzleServer(args.workers, args.max_pending, args.max_decisions,
+                          args.propagator)
+
+    def ready(port):
+        print("Serving on http://{}:{} with {} workers".format(
+            args.host, port, server.workers), file=sys.stderr)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
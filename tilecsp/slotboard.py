@@ -0,0 +1,234 @@
+"""
+Two-level model of a tile board: tile identity and orientation.
+
+The cell model (TileBoard) gives each cell one value per tile and
+orientation, so every domain is |tiles| x |orientations| and all-diff has to
+compare the expanded values by tile ID. SlotTileBoard instead gives each
+cell two variables:
+
+    slot:         which tile is placed in the cell, over one TileSlot per
+                  physical tile
+    orientation:  the edge mask (see EDGE_BITS) of the roads in the cell
+
+All-diff becomes a plain permutation constraint over the slot variables,
+adjacency and border constraints are expressed over the orientation masks,
+and an orientation constraint per cell links the two (the tile in the slot
+must have an orientation with the given mask). The domain products over
+which has_support iterates shrink by the orientation factor.
+
+Orientations with the same edge mask (e.g. the two orientations of an
+OppositeCornersTile) are not distinguished; the solution uses the first.
+
+As with the other models, pair forward checking with the all-diff
+pigeonhole check (see tilecsp.edgeboard.prop_pigeonhole):
+
+    board = SlotTileBoard("p1", create_tiles(num_tiles), terminal_nodes, 4)
+    solver.bt_search(chain_propagators(prop_fc, prop_pigeonhole))
+"""
+from tilecsp.tileboard import *
+
+
+class TileSlot:
+    """
+    A physical tile (slot variable domain value)
+
+    Attributes:
+
+        id:         int, tile ID (as given by create_tiles)
+        tile_class: subclass of Tile
+        masks:      frozenset of the edge masks of the tile's orientations
+        tiles:      dict of edge mask to the Tile in the first orientation
+                    with that mask
+    """
+    __slots__ = ('id', 'tile_class', 'tiles', 'masks')
+
+    def __init__(self, tile_id, tile_class):
+        self.id = tile_id
+        self.tile_class = tile_class
+        self.tiles = {}
+        for orientation in tile_class.ORIENTATIONS:
+            tile = tile_class(tile_id, orientation)
+            self.tiles.setdefault(tile.edge_mask, tile)
+        self.masks = frozenset(self.tiles)
+
+    def get_tile(self, mask):
+        """
+        :return: This tile, oriented with roads on the edges in mask
+        :rtype: Tile
+        """
+        return self.tiles[mask]
+
+    def __str__(self):
+        return "{}-id-{}".format(self.tile_class.__name__, self.id)
+
+    def __repr__(self):
+        return str(self)
+
+
+def create_slots(tiles):
+    """
+    :param tiles: Tiles in every orientation (as given by create_tiles)
+    :type tiles: list[Tile]
+    :return: One TileSlot per tile ID, in order
+    :rtype: list[TileSlot]
+    """
+    tile_classes = {}
+    for tile in tiles:
+        tile_classes.setdefault(tile.id, type(tile))
+    return [TileSlot(tile_id, tile_class)
+            for tile_id, tile_class in tile_classes.items()]
+
+
+def orientation_constraint(var_map, slot_var):
+    """ True iff the tile in slot_var has an orientation with the mask """
+    assert len(var_map) == 2
+    mask = next(m for v, m in var_map.items() if v is not slot_var)
+    return mask in var_map[slot_var].masks
+
+
+def mask_adjacency_constraint(var_map, var, bit, neighbor_bit):
+    """
+    Adjacency constraint between the orientation masks of var and its
+    neighbour
+
+    :param bit: Edge bit of var's edge which meets the neighbour
+    :param neighbor_bit: Edge bit of the neighbour's edge which meets var
+    :return: True iff both either have or lack a road where they meet
+    :rtype: bool
+    """
+    assert len(var_map) == 2
+    mask = var_map[var]
+    neighbor_mask = next(m for v, m in var_map.items() if v is not var)
+    return bool(mask & bit) == bool(neighbor_mask & neighbor_bit)
+
+
+def mask_border_constraint(var_map, border_mask, terminal_mask):
+    """
+    :return: True iff the orientation has roads on exactly the terminal edges
+        among the edges that touch the border of the board
+    :rtype: bool
+    """
+    mask, = var_map.values()
+    return mask & border_mask == terminal_mask
+
+
+def slot_all_diff_constraint(var_map):
+    """ True iff no tile is placed in two cells """
+    slots = list(var_map.values())
+    return len(set(slots)) == len(slots)
+
+
+class SlotTileBoard(CSP):
+    """
+    Attributes:
+
+        slots_domain:   list of TileSlots (initial domain of every slot
+                        variable)
+        dimensions:     int, board dimension
+        template:       BoardTemplate for the board's dimensions and terminals
+        slots:          tuple of slot GridVariables, by template cell index
+        orientations:   tuple of orientation GridVariables, by template cell
+                        index
+        infeasible_reason:
+                        str, why the tiles cannot fill the board (see
+                        inventory_conflict), or None
+    """
+
+    def __init__(self, name, tiles, terminal_nodes, dim=3):
+        """
+        :param tiles: Tiles in every orientation (as given by create_tiles)
+        :type tiles: list[Tile]
+        """
+        self.name = name
+        self.slots_domain = create_slots(tiles)
+        self.dimensions = dim
+        self.terminal_nodes = terminal_nodes
+        self.template = get_template(dim, terminal_nodes)
+        template = self.template
+        # Only the masks of tiles which fit each cell (see cell_domains)
+        domains = cell_domains(template, tiles)
+        # Slot and orientation variables share a table each (see ValueTable)
+        slots_table = ValueTable(self.slots_domain)
+        masks_table = ValueTable(range(1 << len(Tile.EDGES)))
+        slots, orientations = [], []
+        for cell, (x, y) in enumerate(template.coords):
+            terminal_edges = template.terminal_edges(cell)
+            masks = sorted({tile.edge_mask for tile in domains[cell]})
+            slots.append(GridVariable('S{}'.format((x, y)), self.slots_domain,
+                                      x, y, terminal_edges, cell,
+                                      slots_table))
+            orientations.append(GridVariable('O{}'.format((x, y)), masks,
+                                             x, y, terminal_edges, cell,
+                                             masks_table))
+        self.slots = tuple(slots)
+        self.orientations = tuple(orientations)
+        CSP.__init__(self, name, self.orientations + self.slots)
+        self.infeasible_reason = inventory_conflict(template, tiles, domains)
+        self._add_all_diff_constraint()
+        self._add_orientation_constraints()
+        self._add_adjacency_constraints()
+        self._add_border_constraints()
+
+    def _add_all_diff_constraint(self):
+        """ Adds the permutation constraint over the slot variables """
+        self.add_constraint(
+            Constraint("All-diff", self.slots, slot_all_diff_constraint,
+                       'all-diff',
+                       AllDiffCheck(max((s.id for s in self.slots_domain),
+                                        default=-1) + 1)))
+
+    def _add_orientation_constraints(self):
+        """ Links each cell's slot and orientation variables """
+        for slot_var, orientation_var in zip(self.slots, self.orientations):
+            self.add_constraint(
+                Constraint("Orientation {}".format(slot_var.name),
+                           (slot_var, orientation_var),
+                           functools.partial(orientation_constraint,
+                                             slot_var=slot_var),
+                           'orientation'))
+
+    def _add_adjacency_constraints(self):
+        """ Adds all adjacency constraints over the orientation masks """
+        for cell, neighbor, edge in self.template.pairs:
+            var = self.orientations[cell]
+            neighbor_var = self.orientations[neighbor]
+            self.add_constraint(
+                Constraint("Pair {} {}".format(var.name, neighbor_var.name),
+                           (var, neighbor_var),
+                           functools.partial(
+                               mask_adjacency_constraint,
+                               var=var,
+                               bit=EDGE_BITS[edge],
+                               neighbor_bit=EDGE_BITS[OPPOSITE_EDGES[edge]]),
+                           'adjacency'))
+
+    def _add_border_constraints(self):
+        """ Set border constraints for the orientations of border cells """
+        template = self.template
+        for cell, var in enumerate(self.orientations):
+            if template.border_masks[cell]:
+                self.add_constraint(Constraint(
+                    "Border {}".format(var),
+                    (var,),
+                    functools.partial(
+                        mask_border_constraint,
+                        border_mask=template.border_masks[cell],
+                        terminal_mask=template.terminal_masks[cell] &
+                        template.border_masks[cell]),
+                    'border'))
+
+    def get_solution_grid(self):
+        """
+        :return: dim x dim matrix (indexed [y][x]) of the Tiles currently
+            assigned to the board's cells (None where either variable of a
+            cell is unassigned)
+        :rtype: list[list[Tile]]
+        """
+        dim = self.dimensions
+        grid = [[None] * dim for _ in range(dim)]
+        for slot_var, orientation_var in zip(self.slots, self.orientations):
+            slot = slot_var.get_assigned_value()
+            mask = orientation_var.get_assigned_value()
+            if slot is not None and mask is not None:
+                grid[slot_var.y_pos][slot_var.x_pos] = slot.get_tile(mask)
+        return grid
@@ -0,0 +1,76 @@
+"""
+On-disk cache of precompiled tables.
+
+Tables which are expensive to compile (e.g. the 2x2 block pattern database
+of an inventory, see tilecsp.patterns) are kept in memory for the life of a
+process, but a one-off solve pays for compiling them every time. With a
+cache directory set, compiled tables are pickled there and loaded by later
+processes instead. (Board templates are not stored: compiling one takes
+about as long as unpickling it.)
+
+The cache is off unless a directory is given, with set_cache_dir or the
+TILECSP_CACHE_DIR environment variable. Entries are keyed by the kind of
+table, its key and CACHE_VERSION (bump it when a table's layout changes);
+unreadable entries are rebuilt, and the directory can be deleted at any
+time.
+
+    set_cache_dir(os.path.expanduser('~/.cache/tilecsp'))
+    patterns = get_block_patterns(tiles)  # compiled once, then loaded
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+CACHE_VERSION = 1
+
+_cache_dir = os.environ.get('TILECSP_CACHE_DIR') or None
+
+
+def set_cache_dir(directory):
+    """
+    :param directory: Directory to store tables in (None = no disk cache)
+    :type directory: str
+    """
+    global _cache_dir
+    _cache_dir = directory
+
+
+def get_cache_dir():
+    """
+    :rtype: str
+    """
+    return _cache_dir
+
+
+def load_or_build(kind, key, build):
+    """
+    Load a table from the cache directory, or build it (and store it, if a
+    cache directory is set).
+
+    :param kind: Kind of table (used in file names)
+    :type kind: str
+    :param key: Key of the table within its kind (its repr must identify it)
+    :param build: Function (of no arguments) which compiles the table
+    :return: The table
+    """
+    if _cache_dir is None:
+        return build()
+    digest = hashlib.sha1(repr((CACHE_VERSION, key)).encode()).hexdigest()
+    path = os.path.join(_cache_dir, "{}-{}.pickle".format(kind, digest[:20]))
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, AttributeError, pickle.UnpicklingError):
+        pass
+    table = build()
+    try:
+        os.makedirs(_cache_dir, exist_ok=True)
+        # Written to a temporary file first, so readers never see part of it
+        fd, temp_path = tempfile.mkstemp(dir=_cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(table, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+    return table
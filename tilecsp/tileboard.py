@@ -1,6 +1,8 @@
+import collections
 import functools
 
 from csp.cspbase import *
+from search.transposition import zobrist_keys
 
 # Tile edge constants
 N, E, S, W = "n", "e", "s", "w"
@@ -14,6 +16,326 @@ CORRESPONDING_EDGES = {ABOVE: (S, N),
                        BELOW: (N, S),
                        LEFT: (E, W)}
 
+# Bit flags for each edge, used for compact edge masks
+EDGE_BITS = {N: 1, E: 2, S: 4, W: 8}
+
+# Edge of a neighbouring tile that meets the given edge
+OPPOSITE_EDGES = {N: S, E: W, S: N, W: E}
+
+# Set of edges of each edge mask (shared, so masks needn't be expanded anew)
+EDGE_SETS = tuple(frozenset(e for e in EDGE_BITS if mask & EDGE_BITS[e])
+                  for mask in range(1 << len(EDGE_BITS)))
+
+# Offset (dx, dy) to the neighbour across each edge
+EDGE_OFFSETS = {N: (0, -1), E: (1, 0), S: (0, 1), W: (-1, 0)}
+
+# Bit flags for each (unordered) pair of edges, used for compact path masks
+PATH_BITS = {frozenset(pair): 1 << i for i, pair in enumerate(
+    ((N, E), (N, S), (N, W), (E, S), (E, W), (S, W)))}
+
+
+def edge_mask(edges):
+    """
+    :param edges: Edges (N/E/S/W constants)
+    :type edges: Iterable[str]
+    :return: Bit mask of the given edges (see EDGE_BITS)
+    :rtype: int
+    """
+    mask = 0
+    for e in edges:
+        mask |= EDGE_BITS[e]
+    return mask
+
+
+class BoardTemplate:
+    """
+    Compiled layout of a board of a given dimension and set of terminal nodes,
+    independent of the tile inventory. Everything is stored as flat tuples of
+    integers, indexed by cell index (y * dim + x), so templates are cheap to
+    pickle and can be shared between any number of boards (see get_template).
+
+    Attributes:
+
+        dim:            int, board dimension
+        terminal_nodes: frozenset of ((x, y), edge) terminal nodes
+        num_cells:      int, dim * dim
+        coords:         (x, y) of each cell
+        neighbors:      for each cell, the indices of the neighbouring cells
+                        across its edges, in Tile.EDGES order (-1 at the border)
+        border_masks:   for each cell, edge mask of the edges that touch the
+                        border of the board
+        terminal_masks: for each cell, edge mask of its terminal edges
+        pairs:          (cell, neighbour, edge) for each pair of adjacent cells,
+                        where the neighbour is across edge (E or S) of the cell
+        cell_edges:     for each cell, the index of the grid edge on each of its
+                        edges, in Tile.EDGES order (shared with the neighbour
+                        across that edge)
+        num_edges:      int, number of grid edges (including border edges)
+        edge_cells:     for each grid edge, the (cell, edge position) pairs of
+                        the one or two cells it belongs to
+    """
+
+    def __init__(self, dim, terminal_nodes=frozenset()):
+        self.dim = dim
+        self.terminal_nodes = frozenset(terminal_nodes)
+        self.num_cells = dim * dim
+        self.coords = tuple((i % dim, i // dim) for i in range(self.num_cells))
+
+        def neighbor(x, y, e):
+            dx, dy = EDGE_OFFSETS[e]
+            n_x, n_y = x + dx, y + dy
+            return n_y * dim + n_x if 0 <= n_x < dim and 0 <= n_y < dim else -1
+
+        self.neighbors = tuple(tuple(neighbor(x, y, e) for e in Tile.EDGES)
+                               for x, y in self.coords)
+        self.border_masks = tuple(
+            edge_mask(e for e, n in zip(Tile.EDGES, cell_neighbors) if n < 0)
+            for cell_neighbors in self.neighbors)
+        terminal_masks = [0] * self.num_cells
+        for (x, y), e in self.terminal_nodes:
+            if 0 <= x < dim and 0 <= y < dim:
+                terminal_masks[y * dim + x] |= EDGE_BITS[e]
+        self.terminal_masks = tuple(terminal_masks)
+        self.pairs = tuple((cell, cell_neighbors[Tile.EDGES.index(e)], e)
+                           for cell, cell_neighbors in enumerate(self.neighbors)
+                           for e in (E, S)
+                           if cell_neighbors[Tile.EDGES.index(e)] >= 0)
+
+        # Number grid edges; an edge is numbered by the first cell to see it
+        cell_edges = [[-1] * 4 for _ in range(self.num_cells)]
+        num_edges = 0
+        for cell, cell_neighbors in enumerate(self.neighbors):
+            for i, n in enumerate(cell_neighbors):
+                if cell_edges[cell][i] >= 0:
+                    continue
+                cell_edges[cell][i] = num_edges
+                if n >= 0:
+                    cell_edges[n][(i + 2) % 4] = num_edges
+                num_edges += 1
+        self.cell_edges = tuple(map(tuple, cell_edges))
+        self.num_edges = num_edges
+        edge_cells = [[] for _ in range(num_edges)]
+        for cell, edges in enumerate(self.cell_edges):
+            for i, edge in enumerate(edges):
+                edge_cells[edge].append((cell, i))
+        self.edge_cells = tuple(map(tuple, edge_cells))
+
+    def index(self, x, y):
+        """
+        :return: Cell index of the cell at (x, y)
+        :rtype: int
+        """
+        return y * self.dim + x
+
+    def terminal_edges(self, cell):
+        """
+        :return: Terminal edges of the given cell
+        :rtype: frozenset[str]
+        """
+        return EDGE_SETS[self.terminal_masks[cell]]
+
+    def __reduce__(self):
+        # Rebuild from (dim, terminal_nodes): smaller than the tables
+        return get_template, (self.dim, self.terminal_nodes)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_template(dim, terminal_nodes):
+    return BoardTemplate(dim, terminal_nodes)
+
+
+def get_template(dim, terminal_nodes=frozenset()):
+    """
+    Return the (cached) BoardTemplate for a board of dimension dim with the
+    given terminal nodes. Templates are compiled once per process.
+
+    :type dim: int
+    :type terminal_nodes: Iterable[((int, int), str)]
+    :rtype: BoardTemplate
+    """
+    return _compile_template(dim, frozenset(terminal_nodes))
+
+
+def cell_domains(template, tiles):
+    """
+    Node consistency for the border constraints: the tiles which fit each cell
+    of the board, i.e. have roads on exactly the cell's terminal edges among
+    its edges that touch the border.
+
+    :type template: BoardTemplate
+    :param tiles: Tiles in every orientation (as given by create_tiles)
+    :type tiles: list[Tile]
+    :return: Unique tiles (in order) which fit each cell, by cell index
+    :rtype: list[list[Tile]]
+    """
+    tiles = list(dict.fromkeys(tiles))  # Unique, in order
+    by_masks = {}
+    domains = []
+    for border, terminal in zip(template.border_masks,
+                                template.terminal_masks):
+        if (border, terminal) not in by_masks:
+            by_masks[border, terminal] = [
+                t for t in tiles if t.edge_mask & border == terminal & border]
+        domains.append(by_masks[border, terminal])
+    return domains
+
+
+def inventory_conflict(template, tiles, domains):
+    """
+    Check invariants that any solution must satisfy, before any search:
+
+        - there are at least as many tiles as cells, and each cell has a tile
+          which fits it (domains, see cell_domains)
+        - no group of cells can only hold fewer tiles than there are cells
+          (e.g. more corner cells than tiles that fit a corner)
+        - if every tile is placed, the tiles' road ends pair up across the
+          internal grid edges, except at the terminals: their number less
+          the number of terminals is even and at most twice the number of
+          internal grid edges
+
+    :type template: BoardTemplate
+    :param tiles: Tiles in every orientation (as given by create_tiles)
+    :type tiles: list[Tile]
+    :param domains: Tiles which fit each cell, by cell index
+    :type domains: list[list[Tile]]
+    :return: Why the tiles cannot fill the board, or None if no conflict was
+        found
+    :rtype: str
+    """
+    num_roads = {t.id: len(t.edges_with_roads) for t in tiles}
+    if len(num_roads) < template.num_cells:
+        return "{} tiles for {} cells".format(len(num_roads),
+                                              template.num_cells)
+    for cell, domain in enumerate(domains):
+        if not domain:
+            return "No tile fits cell {}".format(template.coords[cell])
+
+    cells_by_ids = collections.Counter(
+        frozenset(t.id for t in domain) for domain in domains)
+    for ids in cells_by_ids:
+        num_cells = sum(count for other, count in cells_by_ids.items()
+                        if other <= ids)
+        if num_cells > len(ids):
+            return "{} cells can only hold {} tiles".format(num_cells,
+                                                            len(ids))
+
+    if len(num_roads) == template.num_cells:
+        num_terminals = sum(bin(terminal & border).count("1")
+                            for border, terminal in zip(
+                                template.border_masks,
+                                template.terminal_masks))
+        internal_ends = sum(num_roads.values()) - num_terminals
+        if internal_ends % 2:
+            return "Odd number of road ends"
+        if not 0 <= internal_ends <= 2 * len(template.pairs):
+            return "{} road ends for {} terminals and {} internal " \
+                   "edges".format(internal_ends + num_terminals,
+                                  num_terminals, len(template.pairs))
+    return None
+
+
+def adjacency_constraint(var_map, var, edge, neighbor_edge):
+    """
+    Adjacency constraint between var and its neighbour across edge
+
+    :param var_map: Dictionary of variables mapped to assigned values
+    :type var_map: dict[Variable, Tile]
+    :param var: The variable whose tile's edge is checked
+    :param edge: Edge of var's tile which meets the neighbour
+    :param neighbor_edge: Edge of the neighbour's tile which meets var
+    :return: True iff both tiles either have or lack a road where they meet
+    :rtype: bool
+    """
+    # If var_map has > 2 entries, something is wrong with the constraint
+    assert len(var_map) == 2
+    tile = var_map[var]
+    neighbor_tile = next(t for v, t in var_map.items() if v is not var)
+    return tile.has_edge(edge) == neighbor_tile.has_edge(neighbor_edge)
+
+
+def all_diff_constraint(var_map):
+    """ True iff all tiles have unique IDs """
+    seen = set()
+    # Uses early exit (lazy eval)
+    return not any(
+        t_id in seen or seen.add(t_id)
+        for t_id in map(lambda tile: tile.id, var_map.values())
+    )
+
+
+class AdjacencyCheck(IncrementalCheck):
+    """
+    Incremental check of an adjacency constraint (see adjacency_constraint):
+    compares the edge bits of the two tiles where they meet
+    """
+    __slots__ = ('var', 'neighbor', 'bit', 'neighbor_bit')
+
+    def __init__(self, var, neighbor, edge):
+        """
+        :param edge: Edge of var's tile which meets the neighbour
+        """
+        self.var = var
+        self.neighbor = neighbor
+        self.bit = EDGE_BITS[edge]
+        self.neighbor_bit = EDGE_BITS[OPPOSITE_EDGES[edge]]
+
+    def check(self, var):
+        return bool(self.var.get_assigned_value().edge_mask & self.bit) == \
+            bool(self.neighbor.get_assigned_value().edge_mask &
+                 self.neighbor_bit)
+
+
+class AllDiffCheck(IncrementalCheck):
+    """
+    Incremental check of the all-diff constraint (see all_diff_constraint):
+    keeps the number of assigned tiles with each ID, and of assigned tiles
+    whose ID was already assigned
+    """
+    __slots__ = ('counts', 'repeats')
+    stateful = True
+
+    def __init__(self, num_ids):
+        """
+        :param num_ids: Number of tile IDs (IDs are 0 to num_ids - 1)
+        :type num_ids: int
+        """
+        self.counts = [0] * num_ids
+        self.repeats = 0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.repeats = 0
+
+    def assigned(self, var, value):
+        if self.counts[value.id]:
+            self.repeats += 1
+        self.counts[value.id] += 1
+
+    def unassigned(self, var, value):
+        self.counts[value.id] -= 1
+        if self.counts[value.id]:
+            self.repeats -= 1
+
+    def check(self, var):
+        return not self.repeats
+
+
+def border_constraint(var_map, border_edge, terminal=False):
+    """
+    Checks whether var in var_map satisfies border constraint.
+
+    :param var_map: Dictionary of variables mapped to assigned values
+    :type var_map: dict[Variable, Tile]
+    :param border_edge: The edge that touches the border
+    :param terminal: True iff this constraint is a terminal variable
+    :return: True iff tile doesn't have edge where it meets the outside
+        of the board.
+    :rtype: bool
+    """
+    tile, = var_map.values()
+    has_edge = tile.has_edge(border_edge)
+    return has_edge if terminal else not has_edge
+
 
 class TileBoard(CSP):
     """
@@ -23,6 +345,11 @@ class TileBoard(CSP):
                         board)
         dimensions:     tuple of (int, int)
         vars:           list of Variables, n x n sized array (n = dimensions)
+        template:       BoardTemplate for the board's dimensions and terminals
+        cells:          tuple of GridVariables, by template cell index
+        infeasible_reason:
+                        str, why the tiles cannot fill the board (see
+                        inventory_conflict), or None
 
 
         (Optional)
@@ -40,102 +367,71 @@ class TileBoard(CSP):
         self.tiles = tiles
         self.dimensions = dim
         self.terminal_nodes = terminal_nodes
+        self.template = get_template(dim, terminal_nodes)
         variable_grid = TileBoard.create_board(self.dimensions,
                                                self.tiles,
                                                terminal_nodes)
-        CSP.__init__(self, name, itertools.chain(*variable_grid))
+        self.cells = tuple(itertools.chain(*variable_grid))
+        CSP.__init__(self, name, self.cells)
+        self.infeasible_reason = inventory_conflict(
+            self.template, self.tiles,
+            [var.domain() for var in self.cells])
         self._add_all_diff_constraint()
-        self._add_adjacency_constraints(variable_grid)
-        self._add_border_constraints(variable_grid)
-
-    def _add_adjacency_constraints(self, var_grid):
-        """
-        Adds all adjacency constraints over variables in var_grid
-
-        :param var_map: Dictionary of variables mapped to assigned values
-        :type var_map: dict[Variable, Tile]
-        """        
-        def adjacency_constraint(var_map):
-            """
-            Adds adjacency constraint between variables in var_map
-
-            :param var_map: Dictionary of variables mapped to assigned values
-            :type var_map: dict[Variable, Tile]
-            :return: True if both variables have edges that connect to each other
-            :rtype: bool
-            """
-            # If var_map has > 2 entries, something is wrong with the constraint
-            assert len(var_map) == 2
-            var1, var2 = var_map.items()
-            edges = CORRESPONDING_EDGES[var1[0].relation_to_neighbor(var2[0])]
-            return var1[1].has_edge(edges[0]) == var2[1].has_edge(edges[1])
-
-        for pair in TileBoard.get_adjacent_pairs(var_grid):
-            #var1, var2 = tuple(pair)
-            #var1.add_neighbor(var2)
-            #var2.add_neighbor(var1)
+        self._add_adjacency_constraints()
+        self._add_border_constraints()
+
+    def _add_adjacency_constraints(self):
+        """ Adds all adjacency constraints over the board's cells """
+        for cell, neighbor, edge in self.template.pairs:
+            var, neighbor_var = self.cells[cell], self.cells[neighbor]
             self.add_constraint(
-                Constraint("Pair {}".format(pair), 
-                           pair, 
-                           adjacency_constraint))
+                Constraint("Pair {} {}".format(var.name, neighbor_var.name),
+                           (var, neighbor_var),
+                           functools.partial(adjacency_constraint,
+                                             var=var,
+                                             edge=edge,
+                                             neighbor_edge=OPPOSITE_EDGES[edge]),
+                           'adjacency',
+                           AdjacencyCheck(var, neighbor_var, edge)))
 
     def _add_all_diff_constraint(self):
         """ Adds the all-diff constraint over all variables """
-        # Inner function
-        def all_diff(var_map):
-            """ True iff all tiles have unique IDs """
-            seen = set()
-            # Uses early exit (lazy eval)
-            return not any(
-                t_id in seen or seen.add(t_id)
-                for t_id in map(lambda tile: tile.id, var_map.values())
-            )
-
         self.add_constraint(
-            Constraint("All-diff", self.get_all_vars(), all_diff))
-
-    def _add_border_constraints(self, var_grid):
-        """
-        Set border constraints for all border variables.
-
-        :param var_map: Dictionary of variables mapped to assigned values
-        :type var_map: dict[Variable, Tile]
-        """
-        def border_constraint_fn(var_map, border_edge, terminal=False):
-            """
-            Checks whether var in var_map satisfies border constraint.
-
-            :param var_map: Dictionary of variables mapped to assigned values
-            :type var_map: dict[Variable, Tile]
-            :param border_edge: The edge that touches the border
-            :param terminal: True iff this constraint is a terminal variable
-            :return: True iff tile doesn't have edge where it meets the outside
-                of the board.
-            :rtype: bool
-            """
-            var, tile = list(var_map.items())[0]
-            has_edge = tile.has_edge(border_edge)
-            return has_edge if terminal else not has_edge
-
-        def make_constraint(var, edge, is_terminal):
-            return Constraint(
-                "Border {}".format(var),
-                frozenset({var}),
-                functools.partial(border_constraint_fn,
-                                  border_edge=edge,
-                                  terminal=is_terminal))
-
-        top_row = var_grid[0]
-        bottom_row = var_grid[-1]
-        left_column = (row[0] for row in var_grid)
-        right_column = (row[-1] for row in var_grid)
-        border_vars = itertools.chain(
-            map(lambda v: (v, N, N in v.terminal_edges), top_row),
-            map(lambda v: (v, W, W in v.terminal_edges), left_column),
-            map(lambda v: (v, E, E in v.terminal_edges), right_column),
-            map(lambda v: (v, S, S in v.terminal_edges), bottom_row))
-        for v_data in border_vars:
-            self.add_constraint(make_constraint(*v_data))
+            Constraint("All-diff", self.get_all_vars(), all_diff_constraint,
+                       'all-diff',
+                       AllDiffCheck(
+                           max((t.id for t in self.tiles), default=-1) + 1)))
+
+    def _add_border_constraints(self):
+        """ Set border constraints for all border variables. """
+        template = self.template
+        # One function per (edge, terminal) pair, shared by the constraints
+        functions = {}
+        for cell, var in enumerate(self.cells):
+            for e in Tile.EDGES:
+                if template.border_masks[cell] & EDGE_BITS[e]:
+                    is_terminal = bool(template.terminal_masks[cell] &
+                                       EDGE_BITS[e])
+                    if (e, is_terminal) not in functions:
+                        functions[e, is_terminal] = functools.partial(
+                            border_constraint, border_edge=e,
+                            terminal=is_terminal)
+                    self.add_constraint(Constraint(
+                        "Border {}".format(var),
+                        (var,),
+                        functions[e, is_terminal],
+                        'border'))
+
+    def get_solution_grid(self):
+        """
+        :return: dim x dim matrix (indexed [y][x]) of the Tiles currently
+            assigned to the board's variables (None where unassigned)
+        :rtype: list[list[Tile]]
+        """
+        dim = self.dimensions
+        return [[var.get_assigned_value() for var in self.cells[y * dim:
+                                                                (y + 1) * dim]]
+                for y in range(dim)]
 
     @staticmethod
     def create_board(dim, tiles, terminals):
@@ -146,42 +442,38 @@ class TileBoard(CSP):
             board)
         :type tiles: list[Tile]
 
-        :return: n x n matrix, each element is a Variable with initial domain
-            being the tiles array
-        :rtype: list[list[Variable]]
+        :return: n x n matrix (indexed [y][x]), each element is a Variable with
+            initial domain being the tiles which fit its cell (see
+            cell_domains)
+        :rtype: list[list[GridVariable]]
         """
-        tiles = set(tiles)
-
-        def make_grid_variable(m, n, term_edges):
-            return GridVariable('V{}'.format((m, n)), tiles, m, n, term_edges)
+        template = get_template(dim, terminals)
+        domains = cell_domains(template, tiles)
+        # All cells share one table of the tiles (see ValueTable)
+        table = ValueTable(tiles)
 
-        def get_terminal_edges(m, n, t):
-            return frozenset((term[1] for term in t if (m, n) == term[0]))
+        def make_grid_variable(cell):
+            x, y = template.coords[cell]
+            return GridVariable('V{}'.format((x, y)), domains[cell], x, y,
+                                template.terminal_edges(cell), cell, table)
 
-        return [[make_grid_variable(i, j, get_terminal_edges(i, j, terminals))
-                 for i in range(dim)]
-                for j in range(dim)]
+        return [[make_grid_variable(template.index(x, y)) for x in range(dim)]
+                for y in range(dim)]
 
     @staticmethod
     def get_adjacent_pairs(grid):
-        # top-left to bottom-right BFS adjacent-pair-finding algorithm
-        pairs = set()
-        q = [(0, 0)]  # list of (x, y) tuples
+        """
+        :param grid: Matrix of variables (indexed [y][x])
+        :type grid: list[list[Variable]]
+        :return: All pairs of horizontally or vertically adjacent variables
+        :rtype: set[frozenset[Variable]]
+        """
         max_y, max_x = len(grid), len(grid[0])
-        while q:
-
-            x, y = q.pop(0)
-            current_cell = grid[y][x]
-            # Get successor pairs (0, 1, or 2)
-            # TODO verify
-            successors = TileBoard.get_grid_successors(x, y, max_x, max_y)
-            adjacent = [(frozenset((current_cell, grid[s[1]][s[0]])), s)
-                        for s in successors
-                        if s is not None]
-            q.extend((pair[1] for pair in adjacent if pair[0] not in pairs))
-            adjacent = {pair for pair, coord in adjacent}
-            pairs.update(adjacent)
-        return pairs
+        return {frozenset((grid[y][x], grid[s_y][s_x]))
+                for y in range(max_y)
+                for x in range(max_x)
+                for s_x, s_y in filter(None, TileBoard.get_grid_successors(
+                    x, y, max_x, max_y))}
 
     @staticmethod
     def get_grid_successors(x, y, max_x, max_y):
@@ -190,25 +482,50 @@ class TileBoard(CSP):
         return s
 
 
+# Shared road layouts of tile orientations: (edges, paths) to (edges, edge
+# mask, paths, path mask), see Tile
+_LAYOUTS = {}
+
+
+def _road_layout(edges, paths):
+    """
+    :return: The shared (immutable) road layout of a tile orientation
+    :rtype: (frozenset[str], int, frozenset[frozenset[str]], int)
+    """
+    key = (frozenset(edges), None if paths is None else frozenset(paths))
+    layout = _LAYOUTS.get(key)
+    if layout is None:
+        # Default to paths between all edges unless otherwise specified
+        paths = key[1] if paths is not None else \
+            frozenset(map(frozenset, itertools.combinations(key[0], 2)))
+        layout = _LAYOUTS[key] = (
+            key[0], edge_mask(key[0]), paths,
+            sum(PATH_BITS[frozenset(p)] for p in paths))
+    return layout
+
+
 class Tile:
     """
     Class representing a game tile (tile_board variable domain value)
+
+    Tiles are interned: every tile in the same orientation shares the same
+    (immutable) sets of edges and paths, and only holds its ID (a small int,
+    as given by create_tiles) and references to them.
     """
+    __slots__ = ('id', 'edges_with_roads', 'edge_mask', 'paths', 'path_mask')
+
     # Edge constants
     EDGES = (N, E, S, W)
     # Generic configurations
     CONFIGURATIONS = {1: set()}
     ORIENTATIONS = CONFIGURATIONS.keys()
     PATHS = None
+    type = "AbsTile"
 
-    def __init__(self, tile_id, edges=set(), paths=None):
+    def __init__(self, tile_id, edges=frozenset(), paths=None):
         self.id = tile_id
-        self.edges_with_roads = edges
-        # Default to paths between all edges unless otherwise specified
-        self.paths = paths if paths is not None else \
-            set(itertools.combinations(edges, 2)) if self.edges_with_roads \
-            else set()
-        self.type = "AbsTile"
+        self.edges_with_roads, self.edge_mask, self.paths, self.path_mask = \
+            _road_layout(edges, paths)
 
     def get_edges(self):
         """
@@ -251,7 +568,7 @@ class Tile:
         return {e1, e2} in self.paths
 
     def __str__(self):
-        return "{}-{}(e={})".format(self.type,
+        return "{}-id-{}(e={})".format(self.type,
                                     self.id,
                                     tuple(self.edges_with_roads))
 
@@ -296,9 +613,11 @@ class Tile:
 
 
 class EmptyTile(Tile):
+    __slots__ = ()
+    type = "EmptyTile"
+
     def __init__(self, tile_id, orientation):
-        super().__init__(tile_id, set())
-        self.type = "EmptyTile"
+        super().__init__(tile_id, frozenset())
 
 
 class TTile(Tile):
@@ -311,10 +630,11 @@ class TTile(Tile):
                       4: {N, E, S}}
 
     ORIENTATIONS = CONFIGURATIONS.keys()
+    __slots__ = ()
+    type = "TTile"
 
     def __init__(self, tile_id, orientation):
         super().__init__(tile_id, TTile.CONFIGURATIONS[orientation])
-        self.type = "TTile"
 
 
 class CrossTile(Tile):
@@ -322,10 +642,11 @@ class CrossTile(Tile):
     Represents a tile with crossroads connecting all four edges
     """
     CONFIGURATIONS = {1: set(Tile.EDGES)}
+    __slots__ = ()
+    type = "CrossTile"
 
     def __init__(self, tile_id, orientation=1):
         super().__init__(tile_id, set(Tile.EDGES))
-        self.type = "CrossTile"
 
     # staticmethod get_orientations_for_edges(edges) is same as superclass
 
@@ -339,10 +660,11 @@ class CornerTile(Tile):
                       3: {S, W},
                       4: {W, N}}
     ORIENTATIONS = CONFIGURATIONS.keys()
+    __slots__ = ()
+    type = "CornerTile"
 
     def __init__(self, tile_id, orientation):
         super().__init__(tile_id, CornerTile.CONFIGURATIONS[orientation])
-        self.type = "CornerTile"
 
 
 class LineTile(Tile):
@@ -352,22 +674,24 @@ class LineTile(Tile):
     CONFIGURATIONS = {1: {N, S},
                       2: {E, W}}
     ORIENTATIONS = CONFIGURATIONS.keys()
+    __slots__ = ()
+    type = "LineTile"
 
     def __init__(self, tile_id, orientation):
         super().__init__(tile_id, LineTile.CONFIGURATIONS[orientation])
-        self.type = "LineTile"
 
 
 class BridgeCrossTile(Tile):
     CONFIGURATIONS = CrossTile.CONFIGURATIONS
 
     PATHS = {frozenset({N, S}), frozenset({E, W})}
+    __slots__ = ()
+    type = "BridgeTile"
 
     def __init__(self, tile_id, orientation):
         super().__init__(tile_id,
                          CrossTile.CONFIGURATIONS[orientation],
                          BridgeCrossTile.PATHS)
-        self.type = "BridgeTile"
 
 
 class OppositeCornersTile(Tile):
@@ -377,53 +701,40 @@ class OppositeCornersTile(Tile):
 
     PATHS = {1: {frozenset({N, E}), frozenset({S, W})},
              2: {frozenset({N, W}), frozenset({S, E})}}
+    __slots__ = ()
+    type = "OppCorTile"
 
     def __init__(self, tile_id, orientation):
         super().__init__(tile_id,
-                         CrossTile.CONFIGURATIONS[orientation],
+                         OppositeCornersTile.CONFIGURATIONS[orientation],
                          OppositeCornersTile.PATHS[orientation])
-        self.type = "OppCorTile"
+
+
+# Concrete tile classes, by name (used to describe inventories as text)
+TILE_TYPES = {cls.__name__: cls for cls in (EmptyTile,
+                                            TTile,
+                                            CrossTile,
+                                            CornerTile,
+                                            LineTile,
+                                            BridgeCrossTile,
+                                            OppositeCornersTile)}
 
 
 class GridVariable(Variable):
+    __slots__ = ('x_pos', 'y_pos', 'index', 'terminal_edges')
 
-    def __init__(self, name, domain, x, y, terminal_edges=frozenset()):
+    def __init__(self, name, domain, x, y, terminal_edges=frozenset(),
+                 index=None, table=None):
         # terminal_edges param must be frozenset
-        super().__init__(name, domain)
+        super().__init__(name, domain, table)
         self.x_pos = x
         self.y_pos = y
+        self.index = index  # Cell index in the board's BoardTemplate
         self.terminal_edges = terminal_edges
-        self.neighbors = dict()
-        self.path_id = dict()
 
     def get_coords(self):
         return self.x_pos, self.y_pos
 
-    #def assign(self, value):
-        # super().assign(value)
-        # for direction in CORRESPONDING_EDGES:
-        #     edges = CORRESPONDING_EDGES[direction]
-        #     if value.has_edge(edges[0]):
-        #         self.path_id[edges[0]] = self.neighbors[direction].get_path_id(edges[1])
-        # for edge in value.get_edges():
-        #     for conn_edge in value.get_paths(edge):
-        #         if conn_edge not in self.path_id:
-        #             self.path_id[conn_edge] = self.path_id[edge]
-
-    def add_neighbor(self, neighbor):
-        self.neighbors[self.relation_to_neighbor(neighbor)] = neighbor
-
-    def get_path_id(self, edge):
-        """
-        Return the neighbor in the direction desired.
-
-        :type dir: int
-        """
-        if self.get_assigned_value().has_edge(edge):
-            return self.path_id[edge]
-        else:
-            return None
-
     def get_exit_points(self):
         return self.terminal_edges
 
@@ -445,22 +756,280 @@ class GridVariable(Variable):
         return diff_to_relation[(n_x - x, n_y - y)]
 
 
+def layout_key(value):
+    """
+    Tiles of the same class in the same orientation are interchangeable:
+    solutions which only differ in which of them is placed where have the
+    same layout. Used as BacktrackingSearch.bt_count's value_key.
+
+    :return: (class, edge mask, path mask) of a Tile; the class of a
+        tilecsp.slotboard.TileSlot (its orientation is a separate variable);
+        any other value as is
+    """
+    if isinstance(value, Tile):
+        return type(value), value.edge_mask, value.path_mask
+    # Not imported: slotboard depends on this module
+    tile_class = getattr(value, 'tile_class', None)
+    return tile_class if tile_class is not None else value
+
+
+class FrontierKey(IncrementalCheck):
+    """
+    State function of a TileBoard for the transposition table of
+    BacktrackingSearch.bt_count (see search.transposition). The solutions
+    below a search node only depend on:
+
+        - which cells are unassigned, and for each of them, which of its
+          neighbours are assigned and whether their tiles have a road facing
+          it (the frontier)
+        - which tiles are left: their IDs, or if interchangeable (counting
+          with value_key layout_key), the number of tiles of each class
+
+    so long as the propagator only prunes values which are in no solution.
+    The state is hashed by XORing a Zobrist key for each unassigned cell's
+    frontier code and for each used tile (or the number of tiles of each
+    class used).
+
+    The hash and the frontier codes are kept up to date incrementally: the
+    key is notified of the cells' assignments (like the board's stateful
+    checks, see Variable.checks) and only notes which cells changed, since
+    propagators assign and unassign values to test them many times per
+    node; each call then XORs in and out the keys of the cells whose tiles
+    changed since the last call, and of their neighbours.
+
+        count = solver.bt_count(prop_fc, value_key=layout_key,
+                                state_key=FrontierKey(board, True))
+    """
+    __slots__ = ('cells', 'sides', 'class_index', 'class_limit',
+                 'interchangeable', 'cell_keys', 'inventory_keys', 'key',
+                 'codes', 'used', 'tiles', 'changed')
+    stateful = True
+
+    def __init__(self, board, interchangeable=False, seed=0):
+        """
+        :type board: TileBoard
+        :param interchangeable: True iff tiles of the same class are counted
+            as one (see layout_key)
+        :param seed: Seed of the Zobrist keys
+        """
+        template = board.template
+        self.cells = board.cells
+        # For each cell: (neighbour, bit of the edge towards the neighbour,
+        # bit of the neighbour's edge that meets it)
+        self.sides = tuple(
+            tuple((n, EDGE_BITS[e], EDGE_BITS[OPPOSITE_EDGES[e]])
+                  for n, e in zip(neighbors, Tile.EDGES) if n >= 0)
+            for neighbors in template.neighbors)
+        self.interchangeable = interchangeable
+        ids_by_class = {}
+        for tile in board.tiles:
+            ids_by_class.setdefault(type(tile), set()).add(tile.id)
+        self.class_index = {c: i for i, c in enumerate(ids_by_class)}
+        self.class_limit = max(map(len, ids_by_class.values()), default=0) + 1
+        if interchangeable:
+            num_keys = len(self.class_index) * self.class_limit
+        else:
+            num_keys = max((t.id for t in board.tiles), default=-1) + 1
+        # A frontier code has 4 bits of assigned neighbours and 4 of roads
+        keys = zobrist_keys((template.num_cells << 8) + num_keys, seed)
+        self.cell_keys = keys[:template.num_cells << 8]
+        self.inventory_keys = keys[template.num_cells << 8:]
+        self.reset()
+        # Listen to the cells' assignments (after freezing, which would
+        # replace their checks)
+        board.freeze()
+        for var in self.cells:
+            var.checks += (self,)
+
+    def reset(self):
+        """ Recompute the state from the board's current assignment """
+        self.tiles = [None] * len(self.cells)
+        self.codes = [0] * len(self.cells)
+        self.key = 0
+        if self.interchangeable:
+            self.used = [0] * len(self.class_index)
+            for i in range(len(self.used)):
+                self.key ^= self.inventory_keys[i * self.class_limit]
+        else:
+            self.used = 0
+        for cell in range(len(self.cells)):
+            self.key ^= self.cell_keys[cell << 8]
+        self.changed = list(range(len(self.cells)))
+
+    def assigned(self, var, value):
+        self.changed.append(var.index)
+
+    def unassigned(self, var, value):
+        self.changed.append(var.index)
+
+    def _update(self, cell, tile):
+        """
+        Move the state from the cell's last known tile (or None) to tile:
+        the codes of the cell and of its unassigned neighbours follow the
+        last known tiles of their neighbours (so cells can be updated in any
+        order)
+        """
+        tiles, codes, cell_keys = self.tiles, self.codes, self.cell_keys
+        old = tiles[cell]
+        key = self.key
+        for n, bit, n_bit in self.sides[cell]:
+            if tiles[n] is not None:
+                continue
+            code = codes[n] & ~(n_bit << 4 | n_bit)
+            if tile is not None:
+                code |= n_bit << 4
+                if tile.edge_mask & bit:
+                    code |= n_bit
+            key ^= cell_keys[n << 8 | codes[n]] ^ cell_keys[n << 8 | code]
+            codes[n] = code
+        if old is None:
+            key ^= cell_keys[cell << 8 | codes[cell]]
+        if tile is None:
+            known = roads = 0
+            for n, bit, n_bit in self.sides[cell]:
+                if tiles[n] is not None:
+                    known |= bit
+                    if tiles[n].edge_mask & n_bit:
+                        roads |= bit
+            codes[cell] = known << 4 | roads
+            key ^= cell_keys[cell << 8 | codes[cell]]
+        else:
+            codes[cell] = -1
+        tiles[cell] = tile
+        self.key = key
+        if old is not None:
+            self._use(old, -1)
+        if tile is not None:
+            self._use(tile, 1)
+
+    def _use(self, tile, step):
+        """ Add step (1 or -1) to the number of used tiles like tile """
+        inventory_keys = self.inventory_keys
+        if self.interchangeable:
+            i = self.class_index[type(tile)]
+            base = i * self.class_limit
+            self.key ^= inventory_keys[base + self.used[i]] ^ \
+                inventory_keys[base + self.used[i] + step]
+            self.used[i] += step
+        else:
+            self.key ^= inventory_keys[tile.id]
+            self.used ^= 1 << tile.id
+
+    def __call__(self, board):
+        """
+        :return: Zobrist hash and signature of the board's current state
+        :rtype: (int, (tuple[int], object))
+        """
+        changed = self.changed
+        if changed:
+            cells, tiles = self.cells, self.tiles
+            moves = [(cell, cells[cell].get_assigned_value())
+                     for cell in set(changed)]
+            moves = [(cell, tile) for cell, tile in moves
+                     if tile is not tiles[cell]]
+            # Take the old tiles away first, so that no more tiles of a
+            # class than there are are ever counted as used
+            for cell, tile in moves:
+                if tiles[cell] is not None:
+                    self._update(cell, None)
+            for cell, tile in moves:
+                if tile is not None:
+                    self._update(cell, tile)
+            changed.clear()
+        used = tuple(self.used) if self.interchangeable else self.used
+        return self.key, (tuple(self.codes), used)
+
+
+class BoardComponents:
+    """
+    Component decomposition of a TileBoard for BacktrackingSearch.bt_count's
+    decompose. Unassigned cells only interact with each other through the
+    adjacency constraints (cells which are not adjacent are kept apart by
+    assigned cells) and through the tiles left, so the unassigned cells are
+    split into the connected components of the board's adjacency structure
+    (BoardTemplate.neighbors, as in TileBoard.get_adjacent_pairs) among
+    them. The tiles are shared as items: by class if interchangeable
+    (counting with value_key layout_key), otherwise each tile is its own
+    item.
+
+        count = solver.bt_count(prop_fc, value_key=layout_key,
+                                decompose=BoardComponents(board, True))
+    """
+    __slots__ = ('cells', 'neighbors', 'interchangeable', 'item_index',
+                 'limits')
+
+    def __init__(self, board, interchangeable=False):
+        """
+        :type board: TileBoard
+        :param interchangeable: True iff tiles of the same class are counted
+            as one (see layout_key)
+        """
+        self.cells = board.cells
+        self.neighbors = tuple(tuple(n for n in neighbors if n >= 0)
+                               for neighbors in board.template.neighbors)
+        self.interchangeable = interchangeable
+        items = collections.Counter()
+        for tile_id, tile_class in {t.id: type(t) for t in board.tiles}.items():
+            items[tile_class if interchangeable else tile_id] += 1
+        self.item_index = {item: i for i, item in enumerate(items)}
+        self.limits = tuple(items.values())
+
+    def resource(self, tile):
+        """ :return: Index of the item which tile uses """
+        return self.item_index[type(tile) if self.interchangeable
+                               else tile.id]
+
+    def __call__(self, board, variables):
+        """
+        :param variables: The board's unassigned variables
+        :type variables: list[GridVariable]
+        :return: None if the variables are connected, otherwise their
+            components, the item used by each tile, and the number of each
+            item left
+        :rtype: (list[list[GridVariable]], function, tuple[int])
+        """
+        component = {var.index: None for var in variables}
+        components = []
+        for var in variables:
+            if component[var.index] is not None:
+                continue
+            # Flood fill from var over the unassigned cells
+            label = len(components)
+            component[var.index] = label
+            members = [var]
+            for member in members:
+                for n in self.neighbors[member.index]:
+                    if n in component and component[n] is None:
+                        component[n] = label
+                        members.append(self.cells[n])
+            components.append(members)
+        if len(components) < 2:
+            return None
+
+        limits = list(self.limits)
+        for var in self.cells:
+            tile = var.get_assigned_value()
+            if tile is not None:
+                limits[self.resource(tile)] -= 1
+        return components, self.resource, tuple(limits)
+
+
 def create_tiles(num_tiles):
     """
     IN:
         num_tiles: dictionary { Subclass of Tile : number of said tiles}
 
     OUT:
-        list of Tiles
+        list of Tiles (each tile in every orientation, with the same ID: a
+        small int, counting from 0)
     """
     tiles = []
 
     count = 0
     for tile_type in num_tiles:
         for i in range(num_tiles[tile_type]):
-            id_name = 'id-' + str(count)
             for orientation in tile_type.ORIENTATIONS:
-                value = tile_type(id_name, orientation)
+                value = tile_type(count, orientation)
                 tiles.append(value)
             count += 1
 